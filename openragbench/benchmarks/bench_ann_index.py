@@ -0,0 +1,141 @@
+import os
+import time
+import shutil
+import argparse
+import tempfile
+import numpy as np
+
+from openragbench.benchmarks.bench_two_stage_scoring import recall_at_k
+from openragbench.models.ann_index import build_ivf_index
+from openragbench.models.quantization import load_embeddings
+from openragbench.models.scoring import topk_similarity
+
+
+def synthetic_topics(n_queries,
+                     n_sections,
+                     dim,
+                     sections_per_topic=100,
+                     noise=0.7,
+                     query_noise=0.5,
+                     seed=0):
+    """Unit vectors grouped around random topic directions, with every query
+    a noisy copy of one gold section.
+
+    Returns:
+        Tuple (query_embeddings, section_embeddings, gold_rows)
+    """
+    rng = np.random.default_rng(seed)
+    n_topics = max(1, n_sections // sections_per_topic)
+    topics = rng.standard_normal((n_topics, dim))
+    sections = (topics[rng.integers(0, len(topics), n_sections)] +
+                noise * rng.standard_normal((n_sections, dim)))
+    sections /= np.linalg.norm(sections, axis=1, keepdims=True)
+    gold_rows = rng.integers(0, n_sections, n_queries)
+    queries = (sections[gold_rows] + query_noise * rng.standard_normal(
+        (n_queries, dim)))
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    return (queries.astype(np.float32), sections.astype(np.float32), gold_rows)
+
+
+def compare_ann(model_path,
+                query_embeddings,
+                k,
+                n_probes,
+                gold_rows=None,
+                n_lists=None):
+    """Build the model's IVF index and compare exact top-k with index
+    searches at every `n_probe`, with and without the exact re-rank.
+
+    Returns:
+        List of result rows, one per (n_probe, rerank) setting
+    """
+    section_embeddings = load_embeddings(
+        os.path.join(model_path, 'section_embeddings.npy'))
+
+    start_time = time.perf_counter()
+    index = build_ivf_index(model_path, n_lists=n_lists)
+    print(f"Built {index.n_lists} lists in "
+          f"{time.perf_counter() - start_time:.2f}s")
+
+    start_time = time.perf_counter()
+    exact = topk_similarity(query_embeddings,
+                            section_embeddings,
+                            k,
+                            gold_rows=gold_rows)
+    exact_seconds = time.perf_counter() - start_time
+    print(f"{'exact':>20}: {exact_seconds:8.2f}s")
+
+    rows = []
+    for n_probe in n_probes:
+        for rerank in (False, True):
+            start_time = time.perf_counter()
+            result = index.search(
+                query_embeddings,
+                k,
+                n_probe,
+                doc_embeddings=section_embeddings if rerank else None,
+                gold_rows=gold_rows if rerank else None)
+            seconds = time.perf_counter() - start_time
+            row = {
+                "n_probe": n_probe,
+                "rerank": rerank,
+                "seconds": seconds,
+                "speedup": exact_seconds / seconds,
+                "recall": recall_at_k(exact.ids, result.ids),
+            }
+            setting = f"probe {n_probe}" + (" rerank" if rerank else "")
+            message = (f"{setting:>20}: {seconds:8.2f}s, "
+                       f"{row['speedup']:5.2f}x, recall@{k} "
+                       f"{row['recall']:.3f}")
+            if rerank and gold_rows is not None:
+                # Share of queries on the same side of the top-k cut
+                row["gold_topk_agreement"] = float(
+                    np.mean((exact.gold_ranks < k) == (result.gold_ranks < k)))
+                message += (f", gold top-{k} agreement "
+                            f"{row['gold_topk_agreement']:.3f}")
+            rows.append(row)
+            print(message)
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Compare exact top-k scoring with IVF index searches.')
+    parser.add_argument('--model_path',
+                        type=str,
+                        default=None,
+                        help='Encoder directory with query_embeddings.npy '
+                        'and section_embeddings.npy (synthetic data if '
+                        'omitted); its ivf_index/ is rebuilt')
+    parser.add_argument('--n_queries', type=int, default=1000)
+    parser.add_argument('--n_sections', type=int, default=100000)
+    parser.add_argument('--dim', type=int, default=768)
+    parser.add_argument('--k', type=int, default=50)
+    parser.add_argument('--n_lists', type=int, default=None)
+    parser.add_argument('--n_probes', type=int, nargs='+', default=[4, 16, 64])
+    args = parser.parse_args()
+
+    if args.model_path:
+        query_embeddings = load_embeddings(
+            os.path.join(args.model_path, 'query_embeddings.npy'))
+        compare_ann(args.model_path,
+                    query_embeddings,
+                    args.k,
+                    args.n_probes,
+                    n_lists=args.n_lists)
+    else:
+        query_embeddings, section_embeddings, gold_rows = synthetic_topics(
+            args.n_queries, args.n_sections, args.dim)
+        model_path = tempfile.mkdtemp()
+        try:
+            np.save(os.path.join(model_path, 'section_embeddings.npy'),
+                    section_embeddings)
+            del section_embeddings
+            compare_ann(model_path,
+                        query_embeddings,
+                        args.k,
+                        args.n_probes,
+                        gold_rows=gold_rows,
+                        n_lists=args.n_lists)
+        finally:
+            shutil.rmtree(model_path)
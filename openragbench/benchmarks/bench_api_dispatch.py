@@ -0,0 +1,43 @@
+import time
+import argparse
+import numpy as np
+
+from openragbench.benchmarks.fake_embeddings_server import start_server
+
+
+def time_encoder(encoder, texts):
+    start_time = time.perf_counter()
+    embeddings = encoder.encode_docs(texts)
+    return embeddings, time.perf_counter() - start_time
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Benchmark concurrent API batching against a local fake '
+        'embeddings endpoint.')
+    parser.add_argument('--n_texts', type=int, default=800)
+    parser.add_argument('--batch_size', type=int, default=16)
+    parser.add_argument('--latency', type=float, default=0.1)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests_per_minute', type=int, default=None)
+    args = parser.parse_args()
+
+    from openragbench.models.encoders import OpenAIEncoder
+
+    server, base_url = start_server(latency=args.latency)
+    texts = [f"synthetic section {i} " * 20 for i in range(args.n_texts)]
+
+    results = {}
+    for concurrency in (1, args.concurrency):
+        encoder = OpenAIEncoder(batch_size=args.batch_size,
+                                api_key="fake",
+                                base_url=base_url,
+                                concurrency=concurrency,
+                                requests_per_minute=args.requests_per_minute)
+        results[concurrency], elapsed = time_encoder(encoder, texts)
+        print(f"concurrency {concurrency:3d}: {elapsed:7.2f}s, "
+              f"{len(texts) / elapsed:8.1f} texts/sec")
+    server.shutdown()
+
+    print("Identical results:",
+          np.array_equal(results[1], results[args.concurrency]))
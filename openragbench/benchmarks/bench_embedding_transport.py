@@ -0,0 +1,64 @@
+import json
+import time
+import argparse
+import tracemalloc
+import numpy as np
+
+from openragbench.benchmarks.fake_embeddings_server import encode_embedding
+from openragbench.models.api_dispatch import decode_base64_embeddings
+
+
+def make_payload(n_vectors, dim, encoding_format, seed=0):
+    """Serialized embeddings response body in the given encoding format."""
+    vectors = np.random.default_rng(seed).standard_normal(
+        (n_vectors, dim)).astype(np.float32)
+    return json.dumps({
+        "data": [{
+            "index": i,
+            "embedding": encode_embedding(vector, encoding_format)
+        } for i, vector in enumerate(vectors)]
+    }).encode("utf-8"), vectors
+
+
+def parse_float_lists(payload):
+    """Previous path: JSON float lists collected and converted at the end."""
+    data = json.loads(payload)["data"]
+    return np.array([item["embedding"] for item in data])
+
+
+def parse_base64(payload):
+    return decode_base64_embeddings(json.loads(payload)["data"])
+
+
+def measure(parse, payload, repeats=3):
+    """Best wall time and peak traced memory of one parse."""
+    times = []
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        parse(payload)
+        times.append(time.perf_counter() - start_time)
+
+    tracemalloc.start()
+    result = parse(payload)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, min(times), peak
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Compare float-list and base64 embedding transport.')
+    parser.add_argument('--n_vectors', type=int, default=2048)
+    parser.add_argument('--dim', type=int, default=3072)
+    args = parser.parse_args()
+
+    for name, encoding_format, parse in [
+        ("float lists", "float", parse_float_lists),
+        ("base64", "base64", parse_base64),
+    ]:
+        payload, vectors = make_payload(args.n_vectors, args.dim,
+                                        encoding_format)
+        result, elapsed, peak = measure(parse, payload)
+        print(f"{name:>12}: payload {len(payload) / 2**20:7.1f} MiB, "
+              f"parse {elapsed:6.3f}s, peak {peak / 2**20:8.1f} MiB, "
+              f"exact: {np.array_equal(result.astype(np.float32), vectors)}")
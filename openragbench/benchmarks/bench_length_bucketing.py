@@ -0,0 +1,88 @@
+import time
+import argparse
+import numpy as np
+
+from openragbench.models.batching import (fixed_size_batches, padded_tokens,
+                                          token_budget_batches)
+
+
+def synthetic_lengths(n_texts, max_length=2048, seed=0):
+    """Section token lengths with a long right tail, clipped to the model's
+    maximum sequence length."""
+    rng = np.random.default_rng(seed)
+    lengths = rng.lognormal(mean=5.5, sigma=0.9, size=n_texts)
+    return np.clip(lengths.astype(np.int64), 16, max_length)
+
+
+def synthetic_texts(lengths, seed=0):
+    rng = np.random.default_rng(seed)
+    vocabulary = np.array(
+        ["model", "retrieval", "section", "graph", "token", "paper", "data"])
+    return [" ".join(rng.choice(vocabulary, size=n)) for n in lengths]
+
+
+def compare_padding(lengths, batch_size, max_batch_tokens):
+    """Padded-token cost of fixed-size batches vs. token-budget batches."""
+    real_tokens = int(lengths.sum())
+    for name, batches in [
+        ("fixed", fixed_size_batches(len(lengths), batch_size)),
+        ("bucketed", token_budget_batches(lengths, max_batch_tokens)),
+    ]:
+        padded = padded_tokens(lengths, batches)
+        print(f"{name:>9}: {len(batches):6d} batches, {padded:12d} padded "
+              f"tokens, {real_tokens / padded:6.1%} useful")
+
+
+def compare_throughput(model_name,
+                       lengths,
+                       batch_size,
+                       max_batch_tokens,
+                       n_workers=None):
+    """Measured tokens/sec of a real model with both batching strategies."""
+    from openragbench.models.encoders import HuggingfaceEncoder
+
+    encoder = HuggingfaceEncoder(model_name, batch_size=batch_size)
+    encoder.n_workers = n_workers
+    encoder.model.max_seq_length = int(lengths.max())
+    texts = synthetic_texts(lengths)
+    real_tokens = int(encoder.token_lengths(texts).sum())
+
+    results = {}
+    for name, budget in [("fixed", None), ("bucketed", max_batch_tokens)]:
+        encoder.max_batch_tokens = budget
+        start_time = time.perf_counter()
+        results[name] = encoder.encode_docs(texts)
+        elapsed = time.perf_counter() - start_time
+        print(f"{name:>9}: {elapsed:8.2f}s, "
+              f"{real_tokens / elapsed:10.0f} tokens/sec")
+
+    max_diff = np.abs(results["fixed"] - results["bucketed"]).max()
+    print(f"Max embedding difference between strategies: {max_diff:.2e}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Benchmark length-bucketed, token-budget batching.')
+    parser.add_argument('--n_texts', type=int, default=2000)
+    parser.add_argument('--max_length', type=int, default=2048)
+    parser.add_argument('--batch_size', type=int, default=16)
+    parser.add_argument('--max_batch_tokens', type=int, default=16 * 512)
+    parser.add_argument(
+        '--model',
+        type=str,
+        default=None,
+        help='Optional SentenceTransformer model to measure tokens/sec with')
+    parser.add_argument('--n_workers',
+                        type=int,
+                        default=None,
+                        help='CPU worker processes used with --model')
+    args = parser.parse_args()
+
+    lengths = synthetic_lengths(args.n_texts, args.max_length)
+    print(f"Synthetic corpus: {len(lengths)} texts, "
+          f"median {int(np.median(lengths))} / max {lengths.max()} tokens")
+    compare_padding(lengths, args.batch_size, args.max_batch_tokens)
+
+    if args.model:
+        compare_throughput(args.model, lengths, args.batch_size,
+                           args.max_batch_tokens, args.n_workers)
@@ -0,0 +1,57 @@
+import sys
+import json
+import argparse
+import subprocess
+
+MODULES = [
+    "openragbench.models.scoring",
+    "openragbench.models.encoders",
+    "openragbench.models.query_evaluator",
+    "openragbench.pipeline.post_filtering.filter_by_doc_relevance",
+    "openragbench.pipeline.data_processing.mine_hns",
+]
+
+HEAVY_MODULES = ["torch", "sentence_transformers", "openai", "google.genai"]
+
+# Runs in a fresh interpreter so every measurement starts from a cold import
+PROBE = """
+import sys, json, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"seconds": elapsed,
+                   "loaded": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def measure_import(module, repeats=3):
+    """Best-of-`repeats` cold import time of `module` and the heavy
+    dependencies it pulled in."""
+    command = [
+        sys.executable, "-c",
+        PROBE.format(module=module, heavy=HEAVY_MODULES)
+    ]
+    runs = []
+    for _ in range(repeats):
+        result = subprocess.run(command, capture_output=True, text=True)
+        if result.returncode != 0:
+            error = result.stderr.strip().splitlines()
+            return None, error[-1] if error else "import failed"
+        runs.append(json.loads(result.stdout.strip().splitlines()[-1]))
+    return min(run["seconds"] for run in runs), runs[0]["loaded"]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Measure cold import time of the main modules and which '
+        'heavy dependencies each one loads.')
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+
+    for module in MODULES:
+        seconds, loaded = measure_import(module, args.repeats)
+        if seconds is None:
+            print(f"{module:65s}  failed: {loaded}")
+            continue
+        print(f"{module:65s} {seconds * 1000:8.1f} ms  "
+              f"heavy: {', '.join(loaded) or '-'}")
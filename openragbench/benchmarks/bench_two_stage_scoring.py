@@ -0,0 +1,139 @@
+import time
+import argparse
+import numpy as np
+
+from openragbench.models.quantization import load_embeddings
+from openragbench.models.scoring import (topk_similarity,
+                                         two_stage_topk_similarity)
+
+
+def synthetic_matryoshka(n_queries,
+                         n_sections,
+                         dim,
+                         noise=0.6,
+                         decay_scale=32,
+                         seed=0):
+    """Unit vectors whose variance decays along the dimensions, as in
+    Matryoshka-trained models, with every query a noisy copy of one gold
+    section.
+
+    Returns:
+        Tuple (query_embeddings, section_embeddings, gold_rows)
+    """
+    rng = np.random.default_rng(seed)
+    decay = 1 / np.sqrt(1 + np.arange(dim) / decay_scale)
+    sections = rng.standard_normal((n_sections, dim)) * decay
+    sections /= np.linalg.norm(sections, axis=1, keepdims=True)
+    gold_rows = rng.integers(0, n_sections, n_queries)
+    queries = (sections[gold_rows] + noise * rng.standard_normal(
+        (n_queries, dim)) * decay)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    return (queries.astype(np.float32), sections.astype(np.float32), gold_rows)
+
+
+def recall_at_k(exact_ids, approx_ids):
+    """Mean share of each query's exact top-k found by the approximation."""
+    return float(
+        np.mean([
+            len(np.intersect1d(exact, approx)) / len(exact)
+            for exact, approx in zip(exact_ids, approx_ids)
+        ]))
+
+
+def compare_two_stage(query_embeddings,
+                      section_embeddings,
+                      k,
+                      prefix_dims,
+                      shortlist_factors,
+                      gold_rows=None,
+                      device="auto"):
+    """Time exact top-k against two-stage prefix scoring and report the
+    recall@k of each (prefix_dim, shortlist) setting.
+
+    Returns:
+        List of result rows, one per setting
+    """
+    start_time = time.perf_counter()
+    exact = topk_similarity(query_embeddings,
+                            section_embeddings,
+                            k,
+                            device=device,
+                            gold_rows=gold_rows)
+    exact_seconds = time.perf_counter() - start_time
+    print(f"{'exact':>22}: {exact_seconds:8.2f}s")
+
+    rows = []
+    for prefix_dim in prefix_dims:
+        for factor in shortlist_factors:
+            start_time = time.perf_counter()
+            result = two_stage_topk_similarity(query_embeddings,
+                                               section_embeddings,
+                                               k,
+                                               prefix_dim,
+                                               shortlist=factor * k,
+                                               device=device,
+                                               gold_rows=gold_rows)
+            seconds = time.perf_counter() - start_time
+            row = {
+                "prefix_dim": prefix_dim,
+                "shortlist": factor * k,
+                "seconds": seconds,
+                "speedup": exact_seconds / seconds,
+                "recall": recall_at_k(exact.ids, result.ids),
+            }
+            if gold_rows is not None:
+                # Gold ranks drive the relevance filter's top-N stage
+                in_top = exact.gold_ranks < k
+                row["gold_rank_agreement"] = float(
+                    np.mean(
+                        exact.gold_ranks[in_top] == result.gold_ranks[in_top]))
+            rows.append(row)
+            setting = f"prefix {prefix_dim} x{factor}"
+            message = (f"{setting:>22}: {seconds:8.2f}s, "
+                       f"{row['speedup']:5.2f}x, recall@{k} "
+                       f"{row['recall']:.3f}")
+            if gold_rows is not None:
+                message += (f", gold rank agreement "
+                            f"{row['gold_rank_agreement']:.3f}")
+            print(message)
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Compare exact top-k scoring with two-stage truncated '
+        'prefix shortlisting and full-dimension re-scoring.')
+    parser.add_argument('--query_embeddings',
+                        type=str,
+                        default=None,
+                        help='query_embeddings.npy of a model (synthetic '
+                        'data if omitted)')
+    parser.add_argument('--section_embeddings', type=str, default=None)
+    parser.add_argument('--n_queries', type=int, default=1000)
+    parser.add_argument('--n_sections', type=int, default=100000)
+    parser.add_argument('--dim', type=int, default=1024)
+    parser.add_argument('--k', type=int, default=50)
+    parser.add_argument('--prefix_dims',
+                        type=int,
+                        nargs='+',
+                        default=[64, 128, 256])
+    parser.add_argument('--shortlist_factors',
+                        type=int,
+                        nargs='+',
+                        default=[4, 8])
+    parser.add_argument('--device', type=str, default="auto")
+    args = parser.parse_args()
+
+    if args.query_embeddings:
+        query_embeddings = load_embeddings(args.query_embeddings)
+        section_embeddings = load_embeddings(args.section_embeddings)
+        gold_rows = None
+    else:
+        query_embeddings, section_embeddings, gold_rows = synthetic_matryoshka(
+            args.n_queries, args.n_sections, args.dim)
+    print(f"{query_embeddings.shape[0]} queries x "
+          f"{section_embeddings.shape[0]} sections, "
+          f"dim {section_embeddings.shape[1]}, k={args.k}")
+    compare_two_stage(query_embeddings, section_embeddings, args.k,
+                      args.prefix_dims, args.shortlist_factors, gold_rows,
+                      args.device)
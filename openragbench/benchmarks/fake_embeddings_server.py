@@ -0,0 +1,98 @@
+import json
+import time
+import base64
+import hashlib
+import argparse
+import threading
+import numpy as np
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def fake_embedding(text, dim):
+    """Deterministic unit vector derived from the text."""
+    seed = int.from_bytes(
+        hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dim)
+    return vector / np.linalg.norm(vector)
+
+
+def encode_embedding(vector, encoding_format="float"):
+    """Embedding as the OpenAI API returns it: a float list, or base64 of
+    little-endian float32 bytes."""
+    if encoding_format == "base64":
+        return base64.b64encode(np.asarray(
+            vector, dtype="<f4").tobytes()).decode("ascii")
+    return np.asarray(vector, dtype=np.float32).tolist()
+
+
+class FakeEmbeddingsHandler(BaseHTTPRequestHandler):
+    """OpenAI-compatible `POST /v1/embeddings` with a fixed latency."""
+
+    latency = 0.1
+    dim = 256
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/embeddings"):
+            self.send_error(404)
+            return
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        texts = body["input"]
+        texts = [texts] if isinstance(texts, str) else texts
+        time.sleep(self.latency)
+
+        payload = json.dumps({
+            "object": "list",
+            "model": body.get("model", "fake"),
+            "data": [{
+                "object":
+                    "embedding",
+                "index":
+                    i,
+                "embedding":
+                    encode_embedding(fake_embedding(text, self.dim),
+                                     body.get("encoding_format", "float"))
+            } for i, text in enumerate(texts)],
+            "usage": {
+                "prompt_tokens": 0,
+                "total_tokens": 0
+            },
+        }).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(port=0, latency=0.1, dim=256):
+    """Serve fake embeddings from a background thread.
+
+    Returns:
+        Tuple (server, base_url); call `server.shutdown()` to stop it.
+    """
+    handler = type("Handler", (FakeEmbeddingsHandler,), {
+        "latency": latency,
+        "dim": dim
+    })
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Serve an OpenAI-compatible fake embeddings endpoint.')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--latency', type=float, default=0.1)
+    parser.add_argument('--dim', type=int, default=256)
+    args = parser.parse_args()
+
+    server, base_url = start_server(args.port, args.latency, args.dim)
+    print(f"Serving fake embeddings at {base_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
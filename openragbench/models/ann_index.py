@@ -0,0 +1,346 @@
+import os
+import numpy as np
+
+from openragbench.models.quantization import load_embeddings
+from openragbench.models.scoring import (TopKResult, gold_similarity,
+                                         rescore_candidates, sort_topk)
+from openragbench.utils import read_json, write_json
+
+INDEX_DIR = "ivf_index"
+CENTROIDS_FILE = "centroids.npy"
+LIST_OFFSETS_FILE = "list_offsets.npy"
+LIST_IDS_FILE = "list_ids.npy"
+LIST_VECTORS_FILE = "list_vectors.npy"
+META_FILE = "ivf_meta.json"
+
+
+def default_n_lists(n_sections):
+    """About 4 * sqrt(S) inverted lists, the usual IVF starting point."""
+    return int(max(1, min(n_sections, round(4 * np.sqrt(n_sections)))))
+
+
+def _section_signature(section_emb_path):
+    stat = os.stat(section_emb_path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def assign_lists(embeddings, centroids, chunk_rows=16384):
+    """Index of the best-scoring centroid of every row, read in chunks."""
+    assignments = np.empty(embeddings.shape[0], dtype=np.int64)
+    for start in range(0, embeddings.shape[0], chunk_rows):
+        end = min(start + chunk_rows, embeddings.shape[0])
+        block = np.asarray(embeddings[start:end], dtype=np.float32)
+        assignments[start:end] = (block @ centroids.T).argmax(axis=1)
+    return assignments
+
+
+def train_centroids(section_embeddings,
+                    n_lists,
+                    n_iter=10,
+                    sample_size=None,
+                    seed=0):
+    """Spherical k-means centroids on a random sample of the sections.
+
+    Args:
+        section_embeddings: (S, D) array or memory-mapped array
+        n_lists: Number of centroids
+        n_iter: k-means iterations
+        sample_size: Sections sampled for training (default 32 per list)
+        seed: Seed for the sample and the initial centroids
+
+    Returns:
+        (n_lists, D) float32 array of unit-length centroids.
+    """
+    rng = np.random.default_rng(seed)
+    n_sections = section_embeddings.shape[0]
+    sample_size = min(n_sections, max(n_lists, sample_size or 32 * n_lists))
+    rows = np.sort(rng.choice(n_sections, sample_size, replace=False))
+    sample = _normalize(np.asarray(section_embeddings[rows], dtype=np.float32))
+    centroids = sample[rng.choice(sample_size, n_lists, replace=False)]
+
+    for _ in range(n_iter):
+        assignments = assign_lists(sample, centroids)
+        counts = np.bincount(assignments, minlength=n_lists)
+        sums = np.empty(centroids.shape, dtype=np.float64)
+        for dim, column in enumerate(sample.T):
+            sums[:, dim] = np.bincount(assignments,
+                                       weights=column,
+                                       minlength=n_lists)
+        filled = np.flatnonzero(counts)
+        centroids[filled] = _normalize(sums[filled])
+        # Re-seed empty lists on random sample rows
+        empty = np.flatnonzero(counts == 0)
+        if len(empty):
+            centroids[empty] = sample[rng.choice(sample_size,
+                                                 len(empty),
+                                                 replace=False)]
+    return centroids
+
+
+def build_ivf_index(model_path,
+                    n_lists=None,
+                    n_iter=10,
+                    sample_size=None,
+                    vector_dtype="float16",
+                    chunk_rows=65536,
+                    seed=0):
+    """Build the inverted-file index of a model's section embeddings.
+
+    Sections are clustered with spherical k-means and stored grouped by
+    their nearest centroid in `<model_path>/ivf_index/`: the centroids, the
+    CSR offsets of every list, the section row of every entry and the
+    entries' vectors as `vector_dtype`.
+
+    Args:
+        model_path: Encoder directory holding `section_embeddings.npy`
+        n_lists: Number of inverted lists (default `default_n_lists`)
+        n_iter: k-means iterations
+        sample_size: Sections sampled for k-means (default 32 per list)
+        vector_dtype: Storage type of the list vectors, "float16" or
+            "float32"
+        chunk_rows: Sections written per chunk
+        seed: Seed for the k-means sample
+
+    Returns:
+        The written IVFIndex.
+    """
+    section_emb_path = os.path.join(model_path, 'section_embeddings.npy')
+    section_embeddings = load_embeddings(section_emb_path)
+    n_sections, dim = section_embeddings.shape
+    n_lists = min(n_sections, n_lists or default_n_lists(n_sections))
+
+    centroids = train_centroids(section_embeddings, n_lists, n_iter,
+                                sample_size, seed)
+    assignments = assign_lists(section_embeddings, centroids)
+
+    list_ids = np.argsort(assignments, kind="stable").astype(np.int32)
+    counts = np.bincount(assignments, minlength=n_lists)
+    list_offsets = np.concatenate([[0], np.cumsum(counts)])
+
+    index_path = os.path.join(model_path, INDEX_DIR)
+    os.makedirs(index_path, exist_ok=True)
+    np.save(os.path.join(index_path, CENTROIDS_FILE), centroids)
+    np.save(os.path.join(index_path, LIST_OFFSETS_FILE), list_offsets)
+    np.save(os.path.join(index_path, LIST_IDS_FILE), list_ids)
+    vectors_path = os.path.join(index_path, LIST_VECTORS_FILE)
+    list_vectors = np.lib.format.open_memmap(vectors_path,
+                                             mode="w+",
+                                             dtype=np.dtype(vector_dtype),
+                                             shape=(n_sections, dim))
+    for start in range(0, n_sections, chunk_rows):
+        end = min(start + chunk_rows, n_sections)
+        rows = list_ids[start:end]
+        # Read in row order, which is much faster on memory-mapped files
+        order = np.argsort(rows)
+        block = np.empty((end - start, dim), dtype=np.float32)
+        block[order] = np.asarray(section_embeddings[rows[order]],
+                                  dtype=np.float32)
+        list_vectors[start:end] = block
+    list_vectors.flush()
+    del list_vectors
+
+    write_json(
+        {
+            "n_lists": int(n_lists),
+            "n_sections": int(n_sections),
+            "dim": int(dim),
+            "vector_dtype": vector_dtype,
+            "source": _section_signature(section_emb_path),
+        }, os.path.join(index_path, META_FILE))
+    return IVFIndex(index_path)
+
+
+def load_ivf_index(model_path, mmap_mode="r"):
+    """Load a model's IVF index, or return None if it was never built."""
+    index_path = os.path.join(model_path, INDEX_DIR)
+    if not os.path.exists(os.path.join(index_path, META_FILE)):
+        return None
+    return IVFIndex(index_path, mmap_mode=mmap_mode)
+
+
+def get_ivf_index(model_path, **build_kwargs):
+    """Load a model's IVF index, rebuilding it when it is missing or older
+    than the section embeddings."""
+    index = load_ivf_index(model_path)
+    section_emb_path = os.path.join(model_path, 'section_embeddings.npy')
+    if index is None or not index.is_current(section_emb_path):
+        del index
+        return build_ivf_index(model_path, **build_kwargs)
+    return index
+
+
+class IVFIndex:
+    """Inverted-file index over one model's section embeddings.
+
+    A query is scored against the centroids and then only against the
+    sections of its `n_probe` closest lists, so the cost per query is about
+    `n_probe / n_lists` of exhaustive scoring. The centroids are held in
+    memory; the lists are memory-mapped.
+    """
+
+    def __init__(self, path, mmap_mode="r"):
+        self.path = path
+        self.meta = read_json(os.path.join(path, META_FILE))
+        self.centroids = np.load(os.path.join(path, CENTROIDS_FILE))
+        self.list_offsets = np.load(os.path.join(path, LIST_OFFSETS_FILE))
+        self.list_ids = np.load(os.path.join(path, LIST_IDS_FILE),
+                                mmap_mode=mmap_mode)
+        self.list_vectors = np.load(os.path.join(path, LIST_VECTORS_FILE),
+                                    mmap_mode=mmap_mode)
+
+    @property
+    def n_lists(self):
+        return self.meta["n_lists"]
+
+    def is_current(self, section_emb_path):
+        return self.meta["source"] == _section_signature(section_emb_path)
+
+    def _probe(self, queries, n_probe):
+        # Closest lists of every query, plus its farthest list, which holds
+        # the low end of the row for min-max scaling
+        centroid_scores = queries @ self.centroids.T
+        if n_probe >= self.n_lists:
+            return np.broadcast_to(np.arange(self.n_lists),
+                                   (len(queries), self.n_lists)), None
+        probe = np.argpartition(-centroid_scores, n_probe - 1,
+                                axis=1)[:, :n_probe]
+        farthest = centroid_scores.argmin(axis=1)
+        probed = (probe == farthest[:, None]).any(axis=1)
+        return probe, np.where(probed, -1, farthest)
+
+    def _search_block(self, queries, n_probe, shortlist):
+        n_queries = len(queries)
+        probe, farthest = self._probe(queries, n_probe)
+        pair_rows = np.repeat(np.arange(n_queries), probe.shape[1])
+        pair_lists = probe.ravel()
+        if farthest is not None:
+            has_farthest = np.flatnonzero(farthest >= 0)
+            pair_rows = np.concatenate([pair_rows, has_farthest])
+            pair_lists = np.concatenate([pair_lists, farthest[has_farthest]])
+        n_slots = probe.shape[1] + 1
+
+        # Every (query, list) pair writes its best candidates into its own
+        # slot of the buffer; the slots are merged at the end
+        slots = np.zeros(n_queries, dtype=np.int64)
+        buffer_ids = np.full((n_queries, n_slots * shortlist),
+                             -1,
+                             dtype=np.int64)
+        buffer_scores = np.full(buffer_ids.shape, -np.inf, dtype=np.float32)
+        row_min = np.full(n_queries, np.inf, dtype=np.float32)
+
+        order = np.argsort(pair_lists, kind="stable")
+        pair_rows, pair_lists = pair_rows[order], pair_lists[order]
+        bounds = np.flatnonzero(np.diff(pair_lists)) + 1
+        for rows, list_id in zip(np.split(pair_rows, bounds),
+                                 pair_lists[np.concatenate([[0], bounds])]):
+            start, end = self.list_offsets[list_id:list_id + 2]
+            if start == end:
+                continue
+            vectors = np.asarray(self.list_vectors[start:end], dtype=np.float32)
+            scores = queries[rows] @ vectors.T
+            row_min[rows] = np.minimum(row_min[rows], scores.min(axis=1))
+
+            n_keep = min(shortlist, end - start)
+            keep = np.argpartition(scores, -n_keep, axis=1)[:, -n_keep:]
+            columns = slots[rows, None] * shortlist + np.arange(n_keep)
+            buffer_ids[rows[:, None], columns] = self.list_ids[start + keep]
+            keep_scores = np.take_along_axis(scores, keep, axis=1)
+            buffer_scores[rows[:, None], columns] = keep_scores
+            slots[rows] += 1
+
+        keep = np.argpartition(buffer_scores, -shortlist, axis=1)
+        keep = keep[:, -shortlist:]
+        ids, scores = sort_topk(np.take_along_axis(buffer_ids, keep, axis=1),
+                                np.take_along_axis(buffer_scores, keep, axis=1))
+        return ids, scores, row_min
+
+    def search(self,
+               query_embeddings,
+               k,
+               n_probe=16,
+               doc_embeddings=None,
+               rerank_factor=4,
+               gold_rows=None,
+               memory_budget_mb=512):
+        """Approximate top-k sections of every query.
+
+        Without `doc_embeddings`, scores come from the stored list vectors.
+        With them, `rerank_factor * k` candidates per query are re-scored
+        exactly against the original embeddings and re-ranked, which also
+        gives exact gold scores: a gold rank then counts the re-scored
+        candidates above the gold section, and is exact whenever every
+        section scoring above it was retrieved.
+
+        `row_max` is the best candidate (or gold) score; `row_min` is the
+        lowest score seen in the probed lists and in each query's farthest
+        list, a close estimate of the true row minimum.
+
+        Args:
+            query_embeddings: (Q, D) array or memory-mapped array
+            k: Number of sections to return per query
+            n_probe: Lists scored per query
+            doc_embeddings: Original section embeddings for the exact
+                re-rank; required for `gold_rows`
+            rerank_factor: Candidates re-scored per query, as a multiple of k
+            gold_rows: Optional (Q,) gold section row per query (-1 if
+                unknown)
+            memory_budget_mb: Approximate memory budget for one query block
+
+        Returns:
+            TopKResult, as `scoring.topk_similarity`.
+        """
+        if gold_rows is not None and doc_embeddings is None:
+            raise ValueError("Gold ranks need doc_embeddings for the exact "
+                             "re-rank")
+        n_queries = query_embeddings.shape[0]
+        n_sections = self.meta["n_sections"]
+        k = min(k, n_sections)
+        shortlist = k if doc_embeddings is None else min(
+            n_sections, rerank_factor * k)
+        n_probe = max(1, min(n_probe, self.n_lists))
+
+        budget = max(1, int(memory_budget_mb * 1024 * 1024))
+        bytes_per_query = 12 * (n_probe + 1) * shortlist + 4 * self.n_lists
+        query_block = max(1, min(n_queries, budget // bytes_per_query))
+
+        ids = np.full((n_queries, shortlist), -1, dtype=np.int64)
+        scores = np.full((n_queries, shortlist), -np.inf, dtype=np.float32)
+        row_min = np.empty(n_queries, dtype=np.float32)
+        for q_start in range(0, n_queries, query_block):
+            q_end = min(q_start + query_block, n_queries)
+            queries = np.ascontiguousarray(query_embeddings[q_start:q_end],
+                                           dtype=np.float32)
+            block_ids, block_scores, block_min = self._search_block(
+                queries, n_probe, shortlist)
+            ids[q_start:q_end] = block_ids
+            scores[q_start:q_end] = block_scores
+            row_min[q_start:q_end] = block_min
+
+        if doc_embeddings is not None:
+            scores = rescore_candidates(query_embeddings, doc_embeddings, ids,
+                                        memory_budget_mb)
+            ids, scores = sort_topk(ids, scores)
+        row_max = scores[:, 0].copy()
+        row_min = np.minimum(row_min,
+                             np.where(ids >= 0, scores, np.inf).min(axis=1))
+
+        gold_scores = gold_ranks = None
+        if gold_rows is not None:
+            gold_rows = np.asarray(gold_rows, dtype=np.int64)
+            gold_scores = gold_similarity(query_embeddings, doc_embeddings,
+                                          gold_rows)
+            above = scores > gold_scores[:, None]
+            above &= ids != gold_rows[:, None]
+            gold_ranks = above.sum(axis=1).astype(np.int64)
+            gold_ranks[gold_rows < 0] = -1
+            known = gold_rows >= 0
+            row_max[known] = np.maximum(row_max[known], gold_scores[known])
+            row_min[known] = np.minimum(row_min[known], gold_scores[known])
+
+        return TopKResult(ids[:, :k], scores[:, :k], row_min, row_max,
+                          gold_scores, gold_ranks)
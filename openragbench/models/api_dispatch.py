@@ -0,0 +1,142 @@
+import time
+import base64
+import asyncio
+import threading
+import numpy as np
+from tqdm import tqdm
+
+
+def estimate_tokens(text):
+    """Rough token count (~4 characters per token) for rate limiting."""
+    return len(text) // 4 + 1
+
+
+class RateLimiter:
+    """Asyncio token bucket refilled continuously at `rate_per_minute`.
+
+    Used both as a request-per-minute limiter (acquire 1 per request) and as
+    a token-per-minute limiter (acquire the request's token count). Requests
+    larger than the whole bucket wait for a full bucket and then proceed.
+    """
+
+    def __init__(self, rate_per_minute):
+        self.capacity = float(rate_per_minute)
+        self.rate = rate_per_minute / 60.0
+        self.available = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.available = min(self.capacity,
+                             self.available + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount=1):
+        amount = min(float(amount), self.capacity)
+        # The lock keeps waiters first-come, first-served
+        async with self.lock:
+            self._refill()
+            while self.available < amount:
+                await asyncio.sleep((amount - self.available) / self.rate)
+                self._refill()
+            self.available -= amount
+
+
+async def dispatch_batches(batches,
+                           send,
+                           concurrency=8,
+                           requests_per_minute=None,
+                           tokens_per_minute=None,
+                           count_tokens=estimate_tokens,
+                           gate=None):
+    """Send batches concurrently under rate limits, preserving order.
+
+    Args:
+        batches: List of text batches
+        send: Coroutine function mapping a batch to its list of results
+        concurrency: Maximum number of requests in flight
+        requests_per_minute: Optional request rate limit
+        tokens_per_minute: Optional token rate limit
+        count_tokens: Token estimate of one text, for the token limit
+        gate: Optional `autotune.CalibrationGate` held shared by every
+            request, so batch-size calibration never overlaps one
+
+    Returns:
+        List with the result of every batch, in batch order.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    request_limiter = RateLimiter(
+        requests_per_minute) if requests_per_minute else None
+    token_limiter = RateLimiter(
+        tokens_per_minute) if tokens_per_minute else None
+    results = [None] * len(batches)
+    progress = tqdm(total=len(batches))
+
+    async def run(index, batch):
+        async with semaphore:
+            if request_limiter is not None:
+                await request_limiter.acquire(1)
+            if token_limiter is not None:
+                await token_limiter.acquire(
+                    sum(count_tokens(text) for text in batch))
+            if gate is not None:
+                await asyncio.to_thread(gate.acquire_shared)
+            try:
+                results[index] = await send(batch)
+            finally:
+                if gate is not None:
+                    gate.release_shared()
+            progress.update(1)
+
+    try:
+        await asyncio.gather(
+            *[run(index, batch) for index, batch in enumerate(batches)])
+    finally:
+        progress.close()
+    return results
+
+
+def run_sync(coroutine):
+    """Run a coroutine to completion from synchronous code.
+
+    `asyncio.run` refuses to start inside a running event loop (Jupyter, an
+    async pipeline); there the coroutine runs on its own loop in a worker
+    thread instead, blocking the caller until it finishes.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+
+    outcome = {}
+
+    def run():
+        try:
+            outcome["result"] = asyncio.run(coroutine)
+        except BaseException as e:
+            outcome["error"] = e
+
+    worker = threading.Thread(target=run)
+    worker.start()
+    worker.join()
+    if "error" in outcome:
+        raise outcome["error"]
+    return outcome["result"]
+
+
+def split_batches(texts, batch_size):
+    return [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+
+
+def decode_base64_embeddings(items):
+    """Decode base64 embedding items (`{"index": i, "embedding": b64}`, as
+    returned with `encoding_format="base64"`) straight into one float32
+    array, without materializing Python floats."""
+    embeddings = None
+    for item in items:
+        vector = np.frombuffer(base64.b64decode(item["embedding"]), dtype="<f4")
+        if embeddings is None:
+            embeddings = np.empty((len(items), len(vector)), dtype=np.float32)
+        embeddings[item["index"]] = vector
+    return embeddings
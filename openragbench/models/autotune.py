@@ -0,0 +1,279 @@
+import os
+import sys
+import ctypes
+import platform
+import threading
+from contextlib import contextmanager
+
+from openragbench.utils import clear_memory, read_json, write_json
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache",
+                                  "openragbench", "batch_sizes.json")
+
+
+def is_out_of_memory(error):
+    """Whether an exception is a CPU or CUDA out-of-memory error."""
+    if isinstance(error, MemoryError):
+        return True
+    torch = sys.modules.get("torch")
+    if torch is not None and isinstance(
+            error, getattr(torch.cuda, "OutOfMemoryError", ())):
+        return True
+    return "out of memory" in str(error).lower()
+
+
+def available_memory_mb(device):
+    """Free memory on the device: CUDA memory, or physical memory for CPU."""
+    if device.startswith("cuda"):
+        import torch
+        free, _ = torch.cuda.mem_get_info(torch.device(device))
+        return free / 2**20
+    return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE") / 2**20
+
+
+def current_rss_mb():
+    """Current resident set size of this process in MiB, or None where
+    `/proc/self/statm` is unavailable."""
+    try:
+        with open("/proc/self/statm") as f:
+            resident_pages = int(f.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    return resident_pages * os.sysconf("SC_PAGE_SIZE") / 2**20
+
+
+def can_measure_peak(device):
+    """Whether `measure_peak_mb` can measure probes on the device."""
+    return device.startswith("cuda") or current_rss_mb() is not None
+
+
+def _trim_heap():
+    # Hand freed heap pages back to the OS so the next probe's RSS growth
+    # is not hidden by memory an earlier probe left mapped
+    try:
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+
+def measure_peak_mb(fn, device, interval=0.002):
+    """Run `fn` and return the memory it added at its peak, in MiB.
+
+    Exact on CUDA (allocator peak statistics). On CPU a background thread
+    samples the resident set size every `interval` seconds while `fn` runs
+    and the peak is taken relative to the size before the run; spikes
+    shorter than the interval can be missed. The CPU figure covers the
+    whole process, so other threads must be idle while `fn` runs (see
+    `CalibrationGate`).
+    """
+    if device.startswith("cuda"):
+        import torch
+        torch.cuda.synchronize(device)
+        torch.cuda.reset_peak_memory_stats(device)
+        baseline = torch.cuda.memory_allocated(device)
+        fn()
+        torch.cuda.synchronize(device)
+        return (torch.cuda.max_memory_allocated(device) - baseline) / 2**20
+
+    baseline = current_rss_mb()
+    peak = baseline
+    done = threading.Event()
+
+    def sample():
+        nonlocal peak
+        # Model forward passes release the GIL, so sampling keeps running
+        while not done.wait(interval):
+            peak = max(peak, current_rss_mb())
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    try:
+        fn()
+    finally:
+        done.set()
+        sampler.join()
+    return max(peak, current_rss_mb()) - baseline
+
+
+def machine_key(device):
+    """Identify the host and device a calibration is valid for."""
+    if device.startswith("cuda"):
+        import torch
+        properties = torch.cuda.get_device_properties(torch.device(device))
+        hardware = f"{properties.name}/{properties.total_memory // 2**20}MiB"
+    else:
+        hardware = f"cpu{os.cpu_count()}"
+    return f"{platform.node()}/{hardware}"
+
+
+class CalibrationGate:
+    """Shared/exclusive gate between calibration probes and other work in
+    the process.
+
+    Encoding work (API requests, local batches) holds the gate shared; a
+    calibration holds it exclusively, so it waits for in-flight work to
+    finish and blocks new work until its probes are measured. Waiting
+    calibrations take precedence over new shared holders.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.n_shared = 0
+        self.n_exclusive_waiting = 0
+        self.exclusive = False
+
+    def acquire_shared(self):
+        with self.condition:
+            while self.exclusive or self.n_exclusive_waiting:
+                self.condition.wait()
+            self.n_shared += 1
+
+    def release_shared(self):
+        with self.condition:
+            self.n_shared -= 1
+            self.condition.notify_all()
+
+    @contextmanager
+    def shared(self):
+        self.acquire_shared()
+        try:
+            yield
+        finally:
+            self.release_shared()
+
+    @contextmanager
+    def exclusive_access(self):
+        with self.condition:
+            self.n_exclusive_waiting += 1
+            while self.exclusive or self.n_shared:
+                self.condition.wait()
+            self.n_exclusive_waiting -= 1
+            self.exclusive = True
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.exclusive = False
+                self.condition.notify_all()
+
+
+class BatchSizeTuner:
+    """Largest batch size per encoder and sequence-length bucket that fits
+    a memory budget, calibrated once and cached per machine.
+
+    A calibration doubles the batch size of a probe batch until it runs out
+    of memory or its peak exceeds the budget, then bisects towards the
+    limit. Results are stored in a JSON file keyed on the machine, the
+    encoder and the bucket, so later runs on the same hardware reuse them.
+
+    Probes measure the whole process, so a calibration holds `gate`
+    exclusively; work that runs alongside it (API encoders, other local
+    encoders) must hold the gate shared.
+    """
+
+    def __init__(self,
+                 cache_path=None,
+                 memory_budget_mb=None,
+                 memory_fraction=0.8,
+                 max_batch_size=256):
+        """
+        Args:
+            cache_path: JSON file for calibrated sizes (default
+                `$OPENRAGBENCH_BATCH_CACHE` or
+                `~/.cache/openragbench/batch_sizes.json`)
+            memory_budget_mb: Peak memory a batch may add; defaults to
+                `memory_fraction` of the device's free memory
+            memory_fraction: Share of free memory used as default budget
+            max_batch_size: Upper bound for any batch size
+        """
+        self.cache_path = cache_path or os.environ.get(
+            "OPENRAGBENCH_BATCH_CACHE", DEFAULT_CACHE_PATH)
+        self.memory_budget_mb = memory_budget_mb
+        self.memory_fraction = memory_fraction
+        self.max_batch_size = max_batch_size
+        self.sizes = read_json(self.cache_path) if os.path.exists(
+            self.cache_path) else {}
+        self.lock = threading.RLock()
+        self.gate = CalibrationGate()
+
+    def _save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.cache_path)),
+                    exist_ok=True)
+        write_json(self.sizes, self.cache_path + ".tmp")
+        os.replace(self.cache_path + ".tmp", self.cache_path)
+
+    @staticmethod
+    def _key(encoder_key, device, bucket):
+        return f"{machine_key(device)}|{encoder_key}|{bucket}"
+
+    def _fits(self, probe, device, batch_size, budget_mb):
+        try:
+            peak_mb = measure_peak_mb(lambda: probe(batch_size), device)
+        except Exception as e:
+            if not is_out_of_memory(e):
+                raise
+            peak_mb = None
+        clear_memory()
+        if not device.startswith("cuda"):
+            _trim_heap()
+        return peak_mb is not None and peak_mb <= budget_mb
+
+    def calibrate(self, probe, device):
+        """Largest batch size for which `probe(batch_size)` fits the budget
+        (at least 1)."""
+        budget_mb = self.memory_budget_mb or (available_memory_mb(device) *
+                                              self.memory_fraction)
+        good, bad = 0, None
+        batch_size = 1
+        while batch_size <= self.max_batch_size:
+            if not self._fits(probe, device, batch_size, budget_mb):
+                bad = batch_size
+                break
+            good = batch_size
+            batch_size *= 2
+        if bad is None:
+            return max(good, 1)
+
+        # Bisect to within a quarter of the last size that fit
+        while bad - good > max(1, good // 4):
+            middle = (good + bad) // 2
+            if self._fits(probe, device, middle, budget_mb):
+                good = middle
+            else:
+                bad = middle
+        return max(good, 1)
+
+    def batch_size(self, encoder_key, device, bucket, probe):
+        """Cached batch size for the bucket, calibrating it on first use.
+        Returns None, leaving the encoder's own default in place, when probe
+        memory cannot be measured on the device.
+
+        Args:
+            encoder_key: Identifies the model and its settings
+            device: Device the model runs on, e.g. "cuda:0" or "cpu"
+            bucket: Sequence-length bucket
+            probe: Function encoding one synthetic batch of the given size
+                with texts of the bucket's length
+        """
+        key = self._key(encoder_key, device, bucket)
+        # Calibrations share the device, so they run one at a time
+        with self.lock:
+            if key not in self.sizes and not can_measure_peak(device):
+                return None
+            if key not in self.sizes:
+                print(f"Calibrating batch size for {encoder_key} at "
+                      f"{bucket} tokens")
+                with self.gate.exclusive_access():
+                    self.sizes[key] = self.calibrate(probe, device)
+                print(f"Batch size {self.sizes[key]} at {bucket} tokens")
+                self._save()
+            return self.sizes[key]
+
+    def record_oom(self, encoder_key, device, bucket, batch_size):
+        """Lower the cached size for the bucket below a batch that ran out
+        of memory."""
+        key = self._key(encoder_key, device, bucket)
+        with self.lock:
+            self.sizes[key] = max(
+                1, min(self.sizes.get(key, batch_size), batch_size // 2))
+            self._save()
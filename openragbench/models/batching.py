@@ -0,0 +1,82 @@
+import numpy as np
+
+
+def token_budget_batches(lengths, max_batch_tokens, max_batch_size=None):
+    """Group texts into length-sorted batches under a padded-token budget.
+
+    Texts are sorted by token length (longest first) and packed greedily, so
+    each batch holds texts of similar length and its padded size
+    `len(batch) * max(lengths[batch])` stays within `max_batch_tokens`. A
+    text longer than the budget gets a batch of its own.
+
+    Args:
+        lengths: Token length of every text
+        max_batch_tokens: Padded-token budget per batch
+        max_batch_size: Optional cap on the number of texts per batch
+
+    Returns:
+        List of index arrays into the original order, one per batch.
+    """
+    lengths = np.asarray(lengths, dtype=np.int64)
+    order = np.argsort(-lengths, kind="stable")
+    batches = []
+    start = 0
+    while start < len(order):
+        # Sorted descending, so the first text sets the padded length
+        longest = max(int(lengths[order[start]]), 1)
+        size = max(1, max_batch_tokens // longest)
+        if max_batch_size is not None:
+            size = min(size, max_batch_size)
+        batches.append(order[start:start + size])
+        start += size
+    return batches
+
+
+def fixed_size_batches(n_texts, batch_size):
+    """Consecutive fixed-size batches in the original order."""
+    return [
+        np.arange(start, min(start + batch_size, n_texts))
+        for start in range(0, n_texts, batch_size)
+    ]
+
+
+def padded_tokens(lengths, batches):
+    """Total tokens processed, padding included, for the given batches."""
+    lengths = np.asarray(lengths, dtype=np.int64)
+    return sum(len(batch) * int(lengths[batch].max()) for batch in batches)
+
+
+def length_bucket(length, min_bucket=64):
+    """Smallest power-of-two sequence length (at least `min_bucket`) that
+    holds `length` tokens."""
+    bucket = min_bucket
+    while bucket < length:
+        bucket *= 2
+    return bucket
+
+
+def bucketed_batches(lengths, batch_size_for_bucket, min_bucket=64):
+    """Group texts into length-sorted batches with a batch size per length
+    bucket.
+
+    Args:
+        lengths: Token length of every text
+        batch_size_for_bucket: Function mapping a bucket length (see
+            `length_bucket`) to the batch size for texts in that bucket
+        min_bucket: Smallest bucket length
+
+    Returns:
+        List of index arrays into the original order, longest texts first.
+    """
+    lengths = np.asarray(lengths, dtype=np.int64)
+    order = np.argsort(-lengths, kind="stable")
+    buckets = np.array(
+        [length_bucket(int(length), min_bucket) for length in lengths[order]],
+        dtype=np.int64)
+    batches = []
+    for bucket in np.unique(buckets)[::-1].tolist():
+        members = order[buckets == bucket]
+        size = max(1, int(batch_size_for_bucket(bucket)))
+        batches.extend(members[start:start + size]
+                       for start in range(0, len(members), size))
+    return batches
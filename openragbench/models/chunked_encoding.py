@@ -0,0 +1,113 @@
+import os
+import hashlib
+import numpy as np
+
+from openragbench.models.quantization import (load_embeddings,
+                                              open_quantized_memmap,
+                                              scales_path, write_rows)
+from openragbench.utils import read_json, write_json
+
+PARTIAL_SUFFIX = ".partial.npy"
+JOURNAL_SUFFIX = ".journal.json"
+
+
+def texts_digest(texts):
+    """Fingerprint of the exact texts and their order."""
+    digest = hashlib.sha256()
+    for text in texts:
+        digest.update(hashlib.sha256(text.encode("utf-8")).digest())
+    return digest.hexdigest()
+
+
+def _write_journal(journal, journal_path):
+    # Replace atomically so a crash never leaves a half-written journal
+    write_json(journal, journal_path + ".tmp")
+    os.replace(journal_path + ".tmp", journal_path)
+
+
+def _resume(partial_path, journal_path, journal):
+    """Number of completed chunks and the open partial memmaps (values and
+    int8 scales), if the journal on disk belongs to the same job."""
+    if not (os.path.exists(journal_path) and os.path.exists(partial_path)):
+        return 0, None, None
+    saved = read_json(journal_path)
+    if any(saved.get(key) != value for key, value in journal.items()):
+        return 0, None, None
+    scales = None
+    if journal["dtype"] == "int8":
+        scales = np.lib.format.open_memmap(scales_path(partial_path), mode="r+")
+    return saved["completed_chunks"], np.lib.format.open_memmap(
+        partial_path, mode="r+"), scales
+
+
+def encode_to_npy(encode_fn,
+                  texts,
+                  output_path,
+                  chunk_size=4096,
+                  dtype="float32"):
+    """Encode texts chunk by chunk into a `.npy` file, resumably.
+
+    Each chunk's float32 embeddings are written into a preallocated memmap
+    (`<output_path>.partial.npy`) and recorded in a journal before the next
+    chunk starts, so an interrupted run resumes from the last completed
+    chunk and memory stays bounded by one chunk. The partial file is renamed
+    to `output_path` once every chunk is written.
+
+    With `dtype` "float16" or "int8" the embeddings are stored quantized;
+    int8 rows carry a float32 scale in `<name>.scales.npy` (see
+    `quantization.load_embeddings`).
+
+    Args:
+        encode_fn: Function mapping a list of texts to an embedding array
+        texts: List of texts
+        output_path: Destination `.npy` path
+        chunk_size: Number of texts encoded per chunk
+        dtype: Storage dtype, one of "float32", "float16" or "int8"
+
+    Returns:
+        The embeddings, memory-mapped read-only from `output_path`.
+    """
+    partial_path = output_path[:-len(".npy")] + PARTIAL_SUFFIX
+    journal_path = output_path[:-len(".npy")] + JOURNAL_SUFFIX
+    journal = {
+        "n_texts": len(texts),
+        "chunk_size": chunk_size,
+        "texts_sha256": texts_digest(texts),
+        "dtype": dtype,
+    }
+    n_chunks = (len(texts) + chunk_size - 1) // chunk_size
+
+    completed, embeddings, scales = _resume(partial_path, journal_path, journal)
+    if completed:
+        print(f"Resuming {os.path.basename(output_path)} from chunk "
+              f"{completed}/{n_chunks}")
+
+    for chunk in range(completed, n_chunks):
+        start = chunk * chunk_size
+        end = min(start + chunk_size, len(texts))
+        chunk_embeddings = np.asarray(encode_fn(texts[start:end]),
+                                      dtype=np.float32)
+        if embeddings is None:
+            embeddings, scales = open_quantized_memmap(
+                partial_path, (len(texts), chunk_embeddings.shape[1]), dtype)
+        write_rows(embeddings, scales, start, chunk_embeddings)
+        embeddings.flush()
+        if scales is not None:
+            scales.flush()
+        _write_journal(dict(journal, completed_chunks=chunk + 1), journal_path)
+        del chunk_embeddings
+
+    if embeddings is None:
+        # Nothing to encode; keep the output a valid (0, 0) array
+        np.save(output_path, np.empty((0, 0), dtype=np.float32))
+    else:
+        del embeddings, scales
+        os.replace(partial_path, output_path)
+    # Keep the scale file in step with the values it belongs to
+    if os.path.exists(scales_path(partial_path)):
+        os.replace(scales_path(partial_path), scales_path(output_path))
+    elif os.path.exists(scales_path(output_path)):
+        os.remove(scales_path(output_path))
+    if os.path.exists(journal_path):
+        os.remove(journal_path)
+    return load_embeddings(output_path)
@@ -0,0 +1,106 @@
+import numpy as np
+
+
+class UnionFind:
+    """Disjoint-set forest over `n` items with path halving. Roots are
+    always linked under the smaller root index, so edge batches can be
+    merged with vectorized hooking. Tracks the number of components as
+    unions are applied."""
+
+    def __init__(self, n):
+        self.parent = np.arange(n, dtype=np.int64)
+        self.n_components = n
+
+    def find(self, x):
+        parent = self.parent
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    def union(self, a, b):
+        """Merge the components of a and b; returns True if they differed."""
+        root_a, root_b = self.find(a), self.find(b)
+        if root_a == root_b:
+            return False
+        if root_a > root_b:
+            root_a, root_b = root_b, root_a
+        self.parent[root_b] = root_a
+        self.n_components -= 1
+        return True
+
+    def _find_many(self, items):
+        # Vectorized find with full path compression of the given items
+        roots = self.parent[items]
+        while True:
+            next_roots = self.parent[roots]
+            if np.array_equal(next_roots, roots):
+                break
+            roots = next_roots
+        self.parent[items] = roots
+        return roots
+
+    def union_edges(self, rows, cols):
+        """Merge the components of every (rows[i], cols[i]) edge.
+
+        Each round hooks every root that still has an edge to another
+        component under the smallest root it is connected to, then retries
+        the remaining edges on their roots, so a batch costs a few vectorized
+        passes instead of one Python call per edge.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        cols = np.asarray(cols, dtype=np.int64)
+        while len(rows):
+            root_rows, root_cols = self._find_many(rows), self._find_many(cols)
+            differ = root_rows != root_cols
+            low = np.minimum(root_rows[differ], root_cols[differ])
+            high = np.maximum(root_rows[differ], root_cols[differ])
+            if not len(high):
+                break
+            # Every hooked root points to a smaller index, so no cycles form
+            np.minimum.at(self.parent, high, low)
+            self.n_components -= len(np.unique(high))
+            rows, cols = low, high
+
+    def labels(self):
+        """Root of every item, fully compressed with vectorized pointer
+        jumping."""
+        labels = self.parent.copy()
+        while True:
+            next_labels = labels[labels]
+            if np.array_equal(next_labels, labels):
+                return labels
+            labels = next_labels
+
+
+def connected_components(n, rows, cols):
+    """Label the connected components of an undirected graph given as edge
+    lists.
+
+    Returns:
+        (n,) int64 array with the root item of each component.
+    """
+    union_find = UnionFind(n)
+    union_find.union_edges(rows, cols)
+    return union_find.labels()
+
+
+def select_representatives(labels, scores):
+    """Pick the highest-scoring item of every component.
+
+    Ties go to the lowest index. Representatives are returned in the order
+    of each component's lowest member index.
+
+    Returns:
+        Array of representative item indices.
+    """
+    labels = np.asarray(labels)
+    order = np.lexsort((np.arange(len(labels)), -np.asarray(scores), labels))
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = labels[order[1:]] != labels[order[:-1]]
+    representatives = order[first]
+
+    first_member = np.full(len(labels), len(labels), dtype=np.int64)
+    np.minimum.at(first_member, labels, np.arange(len(labels)))
+    return representatives[np.argsort(first_member[labels[representatives]],
+                                      kind="stable")]
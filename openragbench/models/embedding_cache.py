@@ -0,0 +1,214 @@
+import os
+import sqlite3
+import hashlib
+import threading
+import functools
+from collections import OrderedDict
+import numpy as np
+
+INDEX_FILE = "index.sqlite"
+VECTORS_DIR = "vectors"
+
+# SQLite caps the number of bound parameters per statement
+_LOOKUP_CHUNK = 500
+
+
+def text_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """Content-addressed embedding store shared by all encoders.
+
+    Embeddings are keyed on (namespace, sha256 of the exact text), where the
+    namespace names the encoder, model and role/prompt. New vectors are
+    buffered per namespace and written as immutable float32 `.npy` shards of
+    about `shard_mb` once the buffer fills or on `flush()`, so chunked
+    encoding does not leave one small shard per chunk. Shards are read
+    memory-mapped, keeping at most `max_open_shards` mappings open; a SQLite
+    index maps every key to its (shard, row). Index reads and writes are
+    serialized, so encoders running in parallel threads can share a cache.
+    """
+
+    def __init__(self, cache_dir, shard_mb=256, max_open_shards=64):
+        self.cache_dir = cache_dir
+        self.shard_mb = shard_mb
+        self.max_open_shards = max_open_shards
+        os.makedirs(os.path.join(cache_dir, VECTORS_DIR), exist_ok=True)
+        self.connection = sqlite3.connect(os.path.join(cache_dir, INDEX_FILE),
+                                          check_same_thread=False)
+        self.lock = threading.RLock()
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS shards (
+                shard_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                namespace TEXT NOT NULL,
+                n_rows INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS embeddings (
+                namespace TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                shard_id INTEGER NOT NULL,
+                row INTEGER NOT NULL,
+                PRIMARY KEY (namespace, text_hash)
+            );
+        """)
+        # Least recently used shard mappings first
+        self._shards = OrderedDict()
+        # namespace -> {text_hash: embedding} not yet written to a shard
+        self._pending = {}
+
+    def _shard_path(self, shard_id):
+        return os.path.join(self.cache_dir, VECTORS_DIR, f"{shard_id}.npy")
+
+    def _load_shard(self, shard_id):
+        with self.lock:
+            if shard_id in self._shards:
+                self._shards.move_to_end(shard_id)
+                return self._shards[shard_id]
+            shard = np.load(self._shard_path(shard_id), mmap_mode="r")
+            self._shards[shard_id] = shard
+            while len(self._shards) > self.max_open_shards:
+                # Rows are copied out on lookup, so dropping the mapping
+                # closes the file
+                self._shards.popitem(last=False)
+            return shard
+
+    def lookup(self, namespace, hashes):
+        """Find cached embeddings, buffered ones included.
+
+        Args:
+            namespace: Encoder/role namespace
+            hashes: Text hashes to look up
+
+        Returns:
+            Tuple (found, embeddings): a boolean mask over `hashes` and the
+            (found.sum(), dim) float32 embeddings of the hits, in order.
+        """
+        with self.lock:
+            pending = dict(self._pending.get(namespace, {}))
+        locations = {}
+        stored = [h for h in hashes if h not in pending]
+        for start in range(0, len(stored), _LOOKUP_CHUNK):
+            chunk = stored[start:start + _LOOKUP_CHUNK]
+            placeholders = ",".join("?" * len(chunk))
+            with self.lock:
+                matches = self.connection.execute(
+                    "SELECT text_hash, shard_id, row FROM embeddings "
+                    f"WHERE namespace = ? AND text_hash IN ({placeholders})",
+                    [namespace, *chunk]).fetchall()
+            locations.update((row[0], (row[1], row[2])) for row in matches)
+
+        found = np.array([h in locations or h in pending for h in hashes],
+                         dtype=bool)
+        if not found.any():
+            return found, None
+
+        hits = [h for h in hashes if h in locations or h in pending]
+        embeddings = None
+        in_pending = np.array([h in pending for h in hits], dtype=bool)
+        if in_pending.any():
+            vectors = np.stack([pending[h] for h in hits if h in pending])
+            embeddings = np.empty((len(hits), vectors.shape[1]),
+                                  dtype=np.float32)
+            embeddings[in_pending] = vectors
+
+        stored_hits = [locations[h] for h in hits if h in locations]
+        shard_ids = np.array([shard_id for shard_id, _ in stored_hits])
+        rows = np.array([row for _, row in stored_hits])
+        in_stored = np.flatnonzero(~in_pending)
+        for shard_id in np.unique(shard_ids).tolist():
+            in_shard = shard_ids == shard_id
+            shard = self._load_shard(shard_id)
+            if embeddings is None:
+                embeddings = np.empty((len(hits), shard.shape[1]),
+                                      dtype=np.float32)
+            embeddings[in_stored[in_shard]] = shard[rows[in_shard]]
+        return found, embeddings
+
+    def put(self, namespace, hashes, embeddings):
+        """Buffer embeddings for the given text hashes; the namespace's
+        buffer is written as a shard once it reaches `shard_mb`."""
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if len(hashes) == 0:
+            return
+        with self.lock:
+            pending = self._pending.setdefault(namespace, {})
+            pending.update(zip(hashes, embeddings))
+            if len(pending) * embeddings[0].nbytes >= self.shard_mb * 2**20:
+                self._write_shard(namespace)
+
+    def _write_shard(self, namespace):
+        pending = self._pending.pop(namespace, None)
+        if not pending:
+            return
+        hashes = list(pending)
+        with self.connection:
+            shard_id = self.connection.execute(
+                "INSERT INTO shards (namespace, n_rows) VALUES (?, ?)",
+                (namespace, len(hashes))).lastrowid
+            np.save(self._shard_path(shard_id), np.stack(list(
+                pending.values())))
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?)",
+                [(namespace, h, shard_id, row) for row, h in enumerate(hashes)])
+
+    def flush(self):
+        """Write every buffered embedding to disk."""
+        with self.lock:
+            for namespace in list(self._pending):
+                self._write_shard(namespace)
+
+    def encode(self, namespace, texts, encode_fn):
+        """Embed texts, running `encode_fn` only on texts not yet cached.
+
+        Args:
+            namespace: Encoder/role namespace
+            texts: List of texts
+            encode_fn: Function mapping a list of texts to an embedding array
+
+        Returns:
+            (len(texts), dim) float32 array of embeddings
+        """
+        hashes = [text_hash(text) for text in texts]
+        unique_hashes, first_index, inverse = np.unique(hashes,
+                                                        return_index=True,
+                                                        return_inverse=True)
+        unique_hashes = unique_hashes.tolist()
+        found, cached = self.lookup(namespace, unique_hashes)
+
+        missing = np.flatnonzero(~found)
+        if len(missing):
+            print(f"Embedding cache: {found.sum()} hits, "
+                  f"{len(missing)} texts to encode")
+            computed = np.asarray(
+                encode_fn([texts[first_index[i]] for i in missing]))
+            self.put(namespace, [unique_hashes[i] for i in missing], computed)
+
+        dim = cached.shape[1] if cached is not None else computed.shape[1]
+        embeddings = np.empty((len(unique_hashes), dim), dtype=np.float32)
+        if cached is not None:
+            embeddings[found] = cached
+        if len(missing):
+            embeddings[missing] = computed
+        return embeddings[inverse.reshape(-1)]
+
+
+def cached_encode(role):
+    """Route an encoder's `encode_queries`/`encode_docs` through its
+    `embedding_cache`, if one is set, under `self.cache_namespace(role)`."""
+
+    def decorator(encode):
+
+        @functools.wraps(encode)
+        def wrapper(self, texts):
+            if isinstance(texts, str):
+                texts = [texts]
+            cache = getattr(self, "embedding_cache", None)
+            if cache is None or not texts:
+                return encode(self, texts)
+            return cache.encode(self.cache_namespace(role), texts,
+                                lambda missing: encode(self, missing))
+
+        return wrapper
+
+    return decorator
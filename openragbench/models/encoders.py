@@ -1,85 +1,96 @@
 import os
-import gc
-import torch
+import json
+import math
+import multiprocessing
 import numpy as np
+from contextlib import nullcontext
 from tqdm import tqdm
-from openai import OpenAI
-from google import genai
-from google.genai.types import EmbedContentConfig
-from sentence_transformers import SentenceTransformer
-from tenacity import retry, stop_after_attempt, wait_random_exponential
+from typing import Optional
+from tenacity import (retry, retry_if_exception, stop_after_attempt,
+                      wait_random_exponential)
 
+from openragbench.models.api_dispatch import (decode_base64_embeddings,
+                                              dispatch_batches, run_sync,
+                                              split_batches)
+from openragbench.models.autotune import is_out_of_memory
+from openragbench.models.batching import (bucketed_batches, fixed_size_batches,
+                                          length_bucket, token_budget_batches)
+from openragbench.models.embedding_cache import cached_encode
+from openragbench.models.request_packing import (combine_segments,
+                                                 get_tokenizer, pack_requests)
+# Re-exported for callers that still import them from here
+from openragbench.models.scoring import similarity, similarity_gpu
+from openragbench.utils import clear_memory
 
-def similarity_gpu(query_embeddings, doc_embeddings):
-    if isinstance(query_embeddings, list):
-        query_embeddings = np.array(query_embeddings)
-    if isinstance(doc_embeddings, list):
-        doc_embeddings = np.array(doc_embeddings)
+# torch, sentence_transformers, openai and google-genai are imported where an
+# encoder first needs them, so importing this module stays cheap
 
-    assert query_embeddings.shape[1] == doc_embeddings.shape[
-        1], "Query and document embeddings must have the same dimension"
-    assert query_embeddings.ndim == 2, "Query embeddings should be a 2D array"
-    assert doc_embeddings.ndim == 2, "Document embeddings should be a 2D array"
+ENCODER_CLASSES = {}
 
-    # Convert to PyTorch tensors and move to GPU
-    query_tensor = torch.from_numpy(query_embeddings).cuda()
-    doc_tensor = torch.from_numpy(doc_embeddings).cuda()
 
-    # Perform matrix multiplication on GPU
-    sim_tensor = torch.matmul(query_tensor, doc_tensor.T)
+def register_encoder(cls):
+    """Make an encoder class resolvable by its class name."""
+    ENCODER_CLASSES[cls.__name__] = cls
+    return cls
 
-    # Convert back to numpy for the rest of the processing
-    sim_matrix = sim_tensor.cpu().numpy()
 
-    # Apply min-max scaling row-wise (for each query)
-    def min_max_scale(x):
-        # Find min and max for each row
-        min_vals = np.min(x, axis=1, keepdims=True)
-        max_vals = np.max(x, axis=1, keepdims=True)
+def get_encoder_class(name):
+    if name not in ENCODER_CLASSES:
+        raise ValueError(f"Unknown encoder: {name}. "
+                         f"Available: {', '.join(sorted(ENCODER_CLASSES))}")
+    return ENCODER_CLASSES[name]
 
-        # Handle the case where min equals max (avoid division by zero)
-        range_vals = max_vals - min_vals
-        # Where range is 0, set it to 1 to avoid division by zero
-        range_vals = np.where(range_vals == 0, 1, range_vals)
 
-        # Apply min-max scaling
-        return (x - min_vals) / range_vals
+def create_encoder(name, **kwargs):
+    """Instantiate a registered encoder; its model or client (and their
+    libraries) are loaded only now."""
+    return get_encoder_class(name)(**kwargs)
 
-    scaled_matrix = min_max_scale(sim_matrix)
 
-    return scaled_matrix  #.tolist()
+# Output width of the OpenAI embedding models, for empty inputs
+OPENAI_EMBEDDING_DIMS = {
+    "text-embedding-3-large": 3072,
+    "text-embedding-3-small": 1536,
+    "text-embedding-ada-002": 1536,
+}
 
 
-def similarity(query_embeddings, doc_embeddings):
-    if isinstance(query_embeddings, list):
-        query_embeddings = np.array(query_embeddings)
-    if isinstance(doc_embeddings, list):
-        doc_embeddings = np.array(doc_embeddings)
+def _is_token_limit_error(exception):
+    # Rate-limit (429) messages mention tokens per minute too; only a
+    # rejected request (400) means an input or request is too long
+    return (getattr(exception, "status_code", None) == 400 and
+            "token" in str(exception).lower())
 
-    assert query_embeddings.shape[1] == doc_embeddings.shape[
-        1], "Query and document embeddings must have the same dimension"
-    assert query_embeddings.ndim == 2, "Query embeddings should be a 2D array"
-    assert doc_embeddings.ndim == 2, "Document embeddings should be a 2D array"
 
-    sim_matrix = query_embeddings @ doc_embeddings.T
+def _is_not_token_limit_error(exception):
+    return not _is_token_limit_error(exception)
 
-    # Apply min-max scaling row-wise (for each query)
-    def min_max_scale(x):
-        # Find min and max for each row
-        min_vals = np.min(x, axis=1, keepdims=True)
-        max_vals = np.max(x, axis=1, keepdims=True)
 
-        # Handle the case where min equals max (avoid division by zero)
-        range_vals = max_vals - min_vals
-        # Where range is 0, set it to 1 to avoid division by zero
-        range_vals = np.where(range_vals == 0, 1, range_vals)
+# Model of the current encoding worker process, see HuggingfaceEncoder
+_worker_model = None
 
-        # Apply min-max scaling
-        return (x - min_vals) / range_vals
 
-    scaled_matrix = min_max_scale(sim_matrix)
+def _init_encoding_worker(model_name, trust_remote_code, max_seq_length,
+                          n_threads):
+    """Pin the worker's torch thread pools and load its copy of the model."""
+    global _worker_model
+    import torch
+    from sentence_transformers import SentenceTransformer
 
-    return scaled_matrix.tolist()
+    torch.set_num_threads(n_threads)
+    torch.set_num_interop_threads(1)
+    _worker_model = SentenceTransformer(model_name,
+                                        trust_remote_code=trust_remote_code,
+                                        device="cpu")
+    _worker_model.max_seq_length = max_seq_length
+
+
+def _encode_in_worker(task):
+    batch_index, texts, kwargs = task
+    return batch_index, _worker_model.encode(texts,
+                                             batch_size=len(texts),
+                                             show_progress_bar=False,
+                                             **kwargs)
 
 
 class HuggingfaceEncoder:
@@ -88,34 +99,178 @@ class HuggingfaceEncoder:
                  model_name: str = "",
                  trust_remote_code: bool = False,
                  batch_size: int = 16):
+        from sentence_transformers import SentenceTransformer
+
         self.model = SentenceTransformer(model_name,
                                          trust_remote_code=trust_remote_code)
+        self.model_name = model_name
+        self.trust_remote_code = trust_remote_code
         self.prompt = None
         self.prompt_name = None
         self.batch_size = batch_size
-
+        # Padded tokens per batch; None restores fixed `batch_size` batches
+        self.max_batch_tokens = batch_size * 512
+        # CPU worker processes for encoding; None encodes in this process
+        self.n_workers = None
+        self.embedding_cache = None
+        # BatchSizeTuner; when set, batch sizes are calibrated per length
+        # bucket instead of following `batch_size`/`max_batch_tokens`
+        self.batch_tuner = None
+
+    def cache_namespace(self, role):
+        prompt = (self.prompt or self.prompt_name) if role == "query" else None
+        return "/".join([
+            type(self).__name__, self.model_name, role,
+            str(prompt),
+            str(self.model.max_seq_length)
+        ])
+
+    def token_lengths(self, texts, prompt=None):
+        """Token length of every text as the model sees it (prompt included,
+        truncated to `max_seq_length`)."""
+        tokenizer = self.model.tokenizer
+        prompt_length = len(
+            tokenizer(prompt,
+                      add_special_tokens=False)["input_ids"]) if prompt else 0
+        lengths = np.array([
+            len(ids)
+            for ids in tokenizer(texts, add_special_tokens=True)["input_ids"]
+        ]) + prompt_length
+        return np.minimum(lengths, self.model.max_seq_length)
+
+    @property
+    def device(self):
+        return str(getattr(self.model, "device", "cpu"))
+
+    def tuning_key(self):
+        return "/".join([
+            type(self).__name__, self.model_name,
+            str(self.model.max_seq_length)
+        ])
+
+    def _probe_batch(self, bucket, batch_size):
+        """Encode a synthetic batch of texts about `bucket` tokens long."""
+        text = " ".join(["hello"] * bucket)
+        self.model.encode([text] * batch_size,
+                          batch_size=batch_size,
+                          show_progress_bar=False)
+
+    def _tuned_batch_size(self, bucket):
+        batch_size = self.batch_tuner.batch_size(
+            self.tuning_key(), self.device, bucket,
+            lambda batch_size: self._probe_batch(bucket, batch_size))
+        if batch_size is None:
+            # The device's memory cannot be measured; keep the defaults
+            if self.max_batch_tokens is None:
+                return self.batch_size
+            return max(1, self.max_batch_tokens // bucket)
+        return batch_size
+
+    def _prompt_text(self, kwargs):
+        prompt = kwargs.get("prompt")
+        if prompt is None and kwargs.get("prompt_name"):
+            prompt = self.model.prompts.get(kwargs["prompt_name"])
+        return prompt
+
+    def _plan_batches(self, texts, kwargs):
+        if self.batch_tuner is None and self.max_batch_tokens is None:
+            return fixed_size_batches(len(texts), self.batch_size)
+        lengths = self.token_lengths(texts, self._prompt_text(kwargs))
+        if self.batch_tuner is not None:
+            return bucketed_batches(lengths, self._tuned_batch_size)
+        return token_budget_batches(lengths, self.max_batch_tokens)
+
+    def _encode_batch(self, texts, kwargs):
+        """Encode one batch, splitting it in half on out-of-memory errors
+        instead of failing the whole encoder."""
+        # Calibration probes of other encoders never overlap a batch
+        gate = (self.batch_tuner.gate.shared()
+                if self.batch_tuner is not None else nullcontext())
+        try:
+            with gate:
+                return self.model.encode(texts,
+                                         batch_size=len(texts),
+                                         show_progress_bar=False,
+                                         **kwargs)
+        except Exception as e:
+            if len(texts) == 1 or not is_out_of_memory(e):
+                raise
+        # Retry outside the handler so the failed attempt's memory is freed
+        clear_memory()
+        half = len(texts) // 2
+        print(f"Out of memory on a batch of {len(texts)}; retrying in halves")
+        if self.batch_tuner is not None:
+            longest = int(
+                self.token_lengths(texts, self._prompt_text(kwargs)).max())
+            self.batch_tuner.record_oom(self.tuning_key(), self.device,
+                                        length_bucket(longest), len(texts))
+        return np.concatenate([
+            self._encode_batch(texts[:half], kwargs),
+            self._encode_batch(texts[half:], kwargs)
+        ])
+
+    def _iter_encoded_batches(self, texts, batches, kwargs):
+        """Yield (batch, embeddings) pairs, in completion order when a worker
+        pool is used."""
+        if not self.n_workers:
+            for batch in tqdm(batches):
+                yield batch, self._encode_batch([texts[j] for j in batch],
+                                                kwargs)
+            return
+
+        n_threads = max(1, (os.cpu_count() or 1) // self.n_workers)
+        batch_texts = [[texts[j] for j in batch] for batch in batches]
+        tasks = [(i, batch_texts[i], kwargs) for i in range(len(batches))]
+        context = multiprocessing.get_context("spawn")
+        with context.Pool(self.n_workers,
+                          initializer=_init_encoding_worker,
+                          initargs=(self.model_name, self.trust_remote_code,
+                                    self.model.max_seq_length,
+                                    n_threads)) as pool:
+            results = pool.imap_unordered(_encode_in_worker, tasks)
+            for i, batch_embeddings in tqdm(results, total=len(tasks)):
+                yield batches[i], batch_embeddings
+
+    def _encode(self, texts, **kwargs):
+        """Encode texts in length-bucketed batches under `max_batch_tokens`
+        padded tokens (fixed `batch_size` batches when it is None), spread
+        over `n_workers` CPU processes if set. Embeddings are gathered into
+        one preallocated array in the input order. With a `batch_tuner`,
+        every length bucket uses its calibrated batch size."""
+        if (self.max_batch_tokens is None and not self.n_workers and
+                self.batch_tuner is None):
+            return self.model.encode(texts,
+                                     batch_size=self.batch_size,
+                                     show_progress_bar=True,
+                                     **kwargs)
+
+        batches = self._plan_batches(texts, kwargs)
+        embeddings = None
+        for batch, batch_embeddings in self._iter_encoded_batches(
+                texts, batches, kwargs):
+            if embeddings is None:
+                embeddings = np.empty((len(texts), batch_embeddings.shape[1]),
+                                      dtype=batch_embeddings.dtype)
+            embeddings[batch] = batch_embeddings
+        return embeddings
+
+    @cached_encode("query")
     def encode_queries(self, queries):
         if isinstance(queries, str):
             queries = [queries]
         if self.prompt:
-            return self.model.encode(queries,
-                                     prompt=self.prompt,
-                                     batch_size=self.batch_size,
-                                     show_progress_bar=True)
+            return self._encode(queries, prompt=self.prompt)
         if self.prompt_name:
-            return self.model.encode(queries,
-                                     prompt_name=self.prompt_name,
-                                     batch_size=self.batch_size,
-                                     show_progress_bar=True)
+            return self._encode(queries, prompt_name=self.prompt_name)
 
+    @cached_encode("doc")
     def encode_docs(self, docs):
         if isinstance(docs, str):
             docs = [docs]
-        return self.model.encode(docs,
-                                 batch_size=self.batch_size,
-                                 show_progress_bar=True)
+        return self._encode(docs)
 
 
+@register_encoder
 class LinqEncoder(HuggingfaceEncoder):
 
     def __init__(self,
@@ -126,6 +281,7 @@ class LinqEncoder(HuggingfaceEncoder):
         self.model.max_seq_length = 2048
 
 
+@register_encoder
 class StellaEncoder(HuggingfaceEncoder):
 
     def __init__(self,
@@ -136,6 +292,7 @@ class StellaEncoder(HuggingfaceEncoder):
         self.prompt_name = "s2p_query"
 
 
+@register_encoder
 class QwenEncoder(HuggingfaceEncoder):
 
     def __init__(self,
@@ -147,6 +304,7 @@ class QwenEncoder(HuggingfaceEncoder):
         self.model.max_seq_length = 2048
 
 
+@register_encoder
 class JinaEncoder(HuggingfaceEncoder):
 
     def __init__(self,
@@ -156,16 +314,16 @@ class JinaEncoder(HuggingfaceEncoder):
         super().__init__(model_name, trust_remote_code, batch_size)
         self.prompt_name = "retrieval.query"
 
+    @cached_encode("query")
     def encode_queries(self, queries):
         if isinstance(queries, str):
             queries = [queries]
-        return self.model.encode(queries,
-                                 prompt_name=self.prompt_name,
-                                 task=self.prompt_name,
-                                 batch_size=self.batch_size,
-                                 show_progress_bar=True)
+        return self._encode(queries,
+                            prompt_name=self.prompt_name,
+                            task=self.prompt_name)
 
 
+@register_encoder
 class InfEncoder(HuggingfaceEncoder):
 
     def __init__(self,
@@ -177,6 +335,7 @@ class InfEncoder(HuggingfaceEncoder):
         self.model.max_seq_length = 2048
 
 
+@register_encoder
 class SFREncoder(HuggingfaceEncoder):
 
     def __init__(self,
@@ -190,73 +349,176 @@ class SFREncoder(HuggingfaceEncoder):
     def _get_detailed_instruct(query: str) -> str:
         return f'Instruct: Given a web search query, retrieve relevant passages that answer the query\nQuery: {query}'
 
+    @cached_encode("query")
     def encode_queries(self, queries):
         if isinstance(queries, str):
             queries = [queries]
         queries = [self._get_detailed_instruct(query) for query in queries]
-        return self.model.encode(queries,
-                                 batch_size=self.batch_size,
-                                 show_progress_bar=True)
+        return self._encode(queries)
 
 
+@register_encoder
 class OpenAIEncoder():
 
     def __init__(self,
                  model_name: str = "text-embedding-3-large",
-                 batch_size: int = 16):
-        self.client = OpenAI(api_key=os.environ["OPENAI_API_KEY"])
+                 batch_size: int = 16,
+                 api_key: Optional[str] = None,
+                 base_url: Optional[str] = None,
+                 concurrency: int = 8,
+                 requests_per_minute: Optional[int] = None,
+                 tokens_per_minute: Optional[int] = None,
+                 tokenizer=None,
+                 max_tokens_per_input: int = 8191,
+                 max_tokens_per_request: int = 300000,
+                 oversize_policy: str = "split_mean",
+                 packing_margin: float = 0.9):
+        self.api_key = api_key or os.environ["OPENAI_API_KEY"]
+        self.base_url = base_url
+        self.async_client = None
         self.model = model_name
+        # Learned from the first response for models not listed
+        self.embedding_dim = OPENAI_EMBEDDING_DIMS.get(model_name)
         self.batch_size = batch_size
-        self.max_retries = 3  # For handling token limit errors
+        # Requests are packed by token count; batch_size caps their inputs
+        self.tokenizer = tokenizer or get_tokenizer(model_name)
+        self.max_tokens_per_input = max_tokens_per_input
+        self.max_tokens_per_request = max_tokens_per_request
+        self.oversize_policy = oversize_policy
+        # Requests are packed to this fraction of the provider's caps, since
+        # token counts may be estimates
+        self.packing_margin = packing_margin
+        self.manifest = {"n_requests": 0, "oversize": [], "resplit": 0}
+        # Requests in flight and optional provider rate limits
+        self.concurrency = concurrency
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.embedding_cache = None
+        # autotune.CalibrationGate held by every request, if set
+        self.calibration_gate = None
+
+    @property
+    def packed_tokens_per_input(self):
+        return int(self.max_tokens_per_input * self.packing_margin)
+
+    @property
+    def packed_tokens_per_request(self):
+        return int(self.max_tokens_per_request * self.packing_margin)
+
+    def cache_namespace(self, role):
+        return "/".join([
+            type(self).__name__, self.model, role, self.oversize_policy,
+            str(self.packed_tokens_per_input)
+        ])
 
     @retry(wait=wait_random_exponential(min=1, max=60),
-           stop=stop_after_attempt(6))
-    def _process_in_batches(self,
-                            texts,
-                            retry_count=0,
-                            current_batch_size=None):
-        """Process texts in batches with adaptive batch sizing for token limits"""
-        if current_batch_size is None:
-            current_batch_size = self.batch_size
-
-        all_embeddings = []
-
-        for i in tqdm(range(0, len(texts), current_batch_size)):
-            batch = texts[i:i + current_batch_size]
-            try:
-                response = self.client.embeddings.create(model=self.model,
-                                                         input=batch)
-                all_embeddings.extend(
-                    [sample.embedding for sample in response.data])
-            except Exception as e:
-                if "token" in str(e).lower() and retry_count < self.max_retries:
-                    new_batch_size = max(1, current_batch_size // 2)
-                    print(
-                        f"Token limit likely exceeded. Reducing batch size to {new_batch_size} and retrying..."
-                    )
-
-                    chunk_embeddings = self._process_in_batches(
-                        [item[:8000] for item in batch], retry_count + 1,
-                        new_batch_size)
-                    all_embeddings.extend(chunk_embeddings)
-                else:
-                    raise e
-
-        return all_embeddings
-
+           stop=stop_after_attempt(6),
+           retry=retry_if_exception(_is_not_token_limit_error))
+    async def _create_embeddings(self, batch):
+        # Raw base64 floats skip the client's per-float Python conversion
+        response = await self.async_client.embeddings.with_raw_response.create(
+            model=self.model, input=batch, encoding_format="base64")
+        return decode_base64_embeddings(json.loads(response.content)["data"])
+
+    async def _embed_request(self, batch):
+        """Embed one packed request; if the provider rejects it as too long,
+        embed its halves instead, down to splitting a single input."""
+        try:
+            return await self._create_embeddings(batch)
+        except Exception as e:
+            if _is_not_token_limit_error(e):
+                raise
+        self.manifest["resplit"] += 1
+        if len(batch) > 1:
+            middle = len(batch) // 2
+            return np.concatenate([
+                await self._embed_request(batch[:middle]),
+                await self._embed_request(batch[middle:])
+            ])
+
+        # A single input the tokenizer under-counted: halve it and apply the
+        # oversize policy to the halves
+        text = batch[0]
+        if self.oversize_policy == "error":
+            raise ValueError(f"Input of {len(text)} characters exceeds the "
+                             f"provider's token limit")
+        pieces = self.tokenizer.split(
+            text, max(1, math.ceil(self.tokenizer.count(text) / 2)))
+        if len(pieces) < 2:
+            pieces = [text[:len(text) // 2], text[len(text) // 2:]]
+        if self.oversize_policy == "truncate":
+            return await self._embed_request(pieces[:1])
+        piece_embeddings = [
+            await self._embed_request([piece]) for piece in pieces
+        ]
+        # Token-weighted, like texts split while packing
+        piece_tokens = np.array(
+            [self.tokenizer.count(piece) for piece in pieces],
+            dtype=np.float64)
+        return combine_segments(np.concatenate(piece_embeddings),
+                                np.zeros(len(pieces), dtype=np.int64),
+                                piece_tokens, 1)
+
+    async def _process_async(self, requests):
+        from openai import AsyncOpenAI
+
+        # A fresh client per event loop; pooled connections are loop-bound
+        async with AsyncOpenAI(api_key=self.api_key,
+                               base_url=self.base_url) as self.async_client:
+            return await dispatch_batches(
+                requests,
+                self._embed_request,
+                concurrency=self.concurrency,
+                requests_per_minute=self.requests_per_minute,
+                tokens_per_minute=self.tokens_per_minute,
+                count_tokens=self.tokenizer.count,
+                gate=self.calibration_gate)
+
+    def _process_in_batches(self, texts):
+        """Embed texts with token-packed, concurrent, rate-limited requests"""
+        requests, segment_owner, segment_tokens, oversize = pack_requests(
+            texts, self.tokenizer, self.packed_tokens_per_request,
+            self.packed_tokens_per_input, self.batch_size,
+            self.oversize_policy)
+        if not requests:
+            return np.empty((0, self.embedding_dim or 0), dtype=np.float32)
+        if oversize:
+            print(f"{len(oversize)} texts exceed {self.packed_tokens_per_input} "
+                  f"tokens; applying the '{self.oversize_policy}' policy")
+        self.manifest["n_requests"] += len(requests)
+        self.manifest["oversize"].extend(oversize)
+
+        segment_embeddings = np.concatenate(
+            run_sync(self._process_async(requests)))
+        self.embedding_dim = segment_embeddings.shape[1]
+        return combine_segments(segment_embeddings, segment_owner,
+                                segment_tokens, len(texts))
+
+    def pop_manifest(self):
+        """Packing settings, request count, oversize texts and requests
+        re-split after a token-limit rejection since the last call."""
+        manifest = dict(self.manifest,
+                        tokenizer=self.tokenizer.name,
+                        max_tokens_per_input=self.max_tokens_per_input,
+                        max_tokens_per_request=self.max_tokens_per_request,
+                        packing_margin=self.packing_margin,
+                        oversize_policy=self.oversize_policy)
+        self.manifest = {"n_requests": 0, "oversize": [], "resplit": 0}
+        return manifest
+
+    @cached_encode("query")
     def encode_queries(self, queries):
         if isinstance(queries, str):
             queries = [queries]
 
-        all_embeddings = self._process_in_batches(queries)
-        return np.array(all_embeddings)
+        return self._process_in_batches(queries)
 
+    @cached_encode("doc")
     def encode_docs(self, docs):
         if isinstance(docs, str):
             docs = [docs]
 
-        all_embeddings = self._process_in_batches(docs)
-        return np.array(all_embeddings)
+        return self._process_in_batches(docs)
 
 
 ###### DEPRECATED ######
@@ -279,6 +541,7 @@ class NVEncoder(HuggingfaceEncoder):
         ]
         return input_examples
 
+    @cached_encode("query")
     def encode_queries(self, queries):
         if isinstance(queries, str):
             queries = [queries]
@@ -288,6 +551,7 @@ class NVEncoder(HuggingfaceEncoder):
                                  prompt=self.prompt,
                                  normalize_embeddings=True)
 
+    @cached_encode("doc")
     def encode_docs(self, docs):
         if isinstance(docs, str):
             docs = [docs]
@@ -297,51 +561,89 @@ class NVEncoder(HuggingfaceEncoder):
                                  normalize_embeddings=True)
 
 
+@register_encoder
 class GeminiEncoder():
 
     def __init__(self,
                  model_name: str = "gemini-embedding-exp-03-07",
-                 batch_size: int = 16):
-        self.client = genai.Client(api_key=os.environ["GEMINI_API_KEY"])
+                 batch_size: int = 16,
+                 api_key: Optional[str] = None,
+                 base_url: Optional[str] = None,
+                 concurrency: int = 8,
+                 requests_per_minute: Optional[int] = None,
+                 tokens_per_minute: Optional[int] = None):
+        from google import genai
+        from google.genai.types import HttpOptions
+
+        self.client_args = {
+            "api_key": api_key or os.environ["GEMINI_API_KEY"],
+            "http_options": HttpOptions(base_url=base_url) if base_url else None
+        }
+        self.client = genai.Client(**self.client_args)
         self.model = model_name
         self.batch_size = batch_size  # Default to max API batch size
+        # Requests in flight and optional provider rate limits
+        self.concurrency = concurrency
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.embedding_cache = None
+        # autotune.CalibrationGate held by every request, if set
+        self.calibration_gate = None
+
+    def cache_namespace(self, role):
+        task_type = "RETRIEVAL_QUERY" if role == "query" else "RETRIEVAL_DOCUMENT"
+        return "/".join([type(self).__name__, self.model, task_type, "768"])
 
     @retry(wait=wait_random_exponential(min=1, max=60),
            stop=stop_after_attempt(6))
-    def get_embs(self, texts, task_type):
-        response = self.client.models.embed_content(
+    async def get_embs(self, texts, task_type):
+        from google.genai.types import EmbedContentConfig
+
+        response = await self.client.aio.models.embed_content(
             model=self.model,
             contents=texts,
             config=EmbedContentConfig(task_type=task_type,
                                       output_dimensionality=768),
         )
-        return [embedding.values for embedding in response.embeddings]
-
+        # Fill one float32 block per batch instead of nested Python lists
+        embeddings = np.empty((len(response.embeddings), 768), dtype=np.float32)
+        for i, embedding in enumerate(response.embeddings):
+            embeddings[i] = embedding.values
+        return embeddings
+
+    async def _process_async(self, texts, task_type):
+        from google import genai
+
+        # A fresh client per event loop; pooled connections are loop-bound
+        self.client = genai.Client(**self.client_args)
+        return await dispatch_batches(
+            split_batches(texts, self.batch_size),
+            lambda batch: self.get_embs(batch, task_type),
+            concurrency=self.concurrency,
+            requests_per_minute=self.requests_per_minute,
+            tokens_per_minute=self.tokens_per_minute,
+            gate=self.calibration_gate)
+
+    def _process_in_batches(self, texts, task_type):
+        """Embed texts with concurrent, rate-limited batch requests"""
+        if not texts:
+            return np.empty((0, 768), dtype=np.float32)
+        return np.concatenate(
+            run_sync(self._process_async(texts, task_type)))
+
+    @cached_encode("query")
     def encode_queries(self, queries):
         if isinstance(queries, str):
             queries = [queries]
 
-        all_embeddings = []
-
-        for i in tqdm(range(0, len(queries), self.batch_size)):
-            batch = queries[i:i + self.batch_size]
-            embeddings = self.get_embs(batch, "RETRIEVAL_QUERY")
-            all_embeddings.extend(embeddings)
-
-        return np.array(all_embeddings)
+        return self._process_in_batches(queries, "RETRIEVAL_QUERY")
 
+    @cached_encode("doc")
     def encode_docs(self, docs):
         if isinstance(docs, str):
             docs = [docs]
 
-        all_embeddings = []
-
-        for i in tqdm(range(0, len(docs), self.batch_size)):
-            batch = docs[i:i + self.batch_size]
-            embeddings = self.get_embs(batch, "RETRIEVAL_DOCUMENT")
-            all_embeddings.extend(embeddings)
-
-        return np.array(all_embeddings)
+        return self._process_in_batches(docs, "RETRIEVAL_DOCUMENT")
 
 
 if __name__ == "__main__":
@@ -360,11 +662,6 @@ if __name__ == "__main__":
         "Green tea has been consumed for centuries and is known for its potential health benefits. It contains antioxidants that may help protect the body against damage caused by free radicals. Regular consumption of green tea has been associated with improved heart health, enhanced cognitive function, and a reduced risk of certain types of cancer. The polyphenols in green tea may also have anti-inflammatory and weight loss properties.",
     ]
 
-    def clear_memory():
-        gc.collect()
-        if torch.cuda.is_available():
-            torch.cuda.empty_cache()
-
     # List of encoder classes to test
     encoder_classes = [{
         "class": LinqEncoder,
@@ -0,0 +1,191 @@
+import os
+import numpy as np
+
+from openragbench.utils import read_json
+
+QUERY_ID_MAP_NAME = "query_id"
+SECTION_INDEX_NAME = "section_index"
+
+
+def _lookup_sorted(table, values):
+    """Position of each value in the sorted string table (-1 if absent)."""
+    values = np.asarray(values, dtype=str)
+    if len(table) == 0:
+        return np.full(len(values), -1, dtype=np.int64)
+    positions = np.minimum(np.searchsorted(table, values), len(table) - 1)
+    return np.where(table[positions] == values, positions, -1)
+
+
+class IdMap:
+    """Array-backed string ID -> embedding row mapping.
+
+    IDs are kept as a sorted fixed-width string table with an int32 row per
+    entry, so lookups are a vectorized binary search and the arrays can be
+    memory-mapped straight from `.npy` files.
+    """
+
+    def __init__(self, ids, rows):
+        self.ids = np.asarray(ids)
+        self.rows = np.asarray(rows, dtype=np.int32)
+
+    @classmethod
+    def from_mapping(cls, id_to_index):
+        """Build the map from an `{id: row}` dict such as
+        `query_id_to_index.json`."""
+        ids = np.array(sorted(id_to_index), dtype=str)
+        rows = np.array([id_to_index[i] for i in ids.tolist()], dtype=np.int32)
+        return cls(ids, rows)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def rows_of(self, ids):
+        """Embedding row of each ID (-1 if unknown)."""
+        positions = _lookup_sorted(self.ids, ids)
+        return np.where(positions >= 0, self.rows[positions], -1)
+
+    def ids_by_row(self):
+        """Array of IDs ordered by embedding row."""
+        ids = np.empty(len(self.ids), dtype=self.ids.dtype)
+        ids[self.rows] = self.ids
+        return ids
+
+    def save(self, directory, name=QUERY_ID_MAP_NAME):
+        np.save(os.path.join(directory, f"{name}_ids.npy"), self.ids)
+        np.save(os.path.join(directory, f"{name}_rows.npy"), self.rows)
+
+    @classmethod
+    def load(cls, directory, name=QUERY_ID_MAP_NAME, mmap_mode="r"):
+        return cls(
+            np.load(os.path.join(directory, f"{name}_ids.npy"),
+                    mmap_mode=mmap_mode),
+            np.load(os.path.join(directory, f"{name}_rows.npy"),
+                    mmap_mode=mmap_mode))
+
+
+class SectionIndex:
+    """Compact CSR view of section ownership.
+
+    Document `d` owns the embedding rows
+    `section_rows[doc_offsets[d]:doc_offsets[d + 1]]`, ordered by section
+    number, so section `i` of document `d` is row
+    `section_rows[doc_offsets[d] + i]`. Document IDs are sorted, so they can
+    be resolved by binary search.
+    """
+
+    def __init__(self, doc_ids, doc_offsets, section_rows):
+        self.doc_ids = np.asarray(doc_ids)
+        self.doc_offsets = np.asarray(doc_offsets, dtype=np.int64)
+        self.section_rows = np.asarray(section_rows, dtype=np.int32)
+
+    @classmethod
+    def from_mapping(cls, section_id_to_index):
+        """Build the index from the nested `section_id_to_index.json` dict
+        ({doc_id: {section_id: row}}), whose section ids run from 0."""
+        doc_ids = sorted(section_id_to_index)
+        counts = np.zeros(len(doc_ids) + 1, dtype=np.int64)
+        section_rows = []
+        for i, doc_id in enumerate(doc_ids):
+            sections = section_id_to_index[doc_id]
+            for section_number in range(len(sections)):
+                if str(section_number) not in sections:
+                    raise ValueError(
+                        f"Document {doc_id} has non-contiguous section ids")
+                section_rows.append(sections[str(section_number)])
+            counts[i + 1] = len(sections)
+        return cls(np.array(doc_ids, dtype=str), np.cumsum(counts),
+                   np.array(section_rows, dtype=np.int32))
+
+    @property
+    def n_docs(self):
+        return len(self.doc_offsets) - 1
+
+    @property
+    def n_sections(self):
+        return len(self.section_rows)
+
+    def section_counts(self):
+        return np.diff(self.doc_offsets)
+
+    def entry_docs(self):
+        """Owning document index of every CSR entry."""
+        return np.repeat(np.arange(self.n_docs), self.section_counts())
+
+    def row_docs(self, n_rows=None):
+        """Owning document index of every embedding row (-1 if unowned)."""
+        n_rows = n_rows or int(self.section_rows.max(initial=-1)) + 1
+        owners = np.full(n_rows, -1, dtype=np.int64)
+        owners[self.section_rows] = self.entry_docs()
+        return owners
+
+    def doc_index(self, doc_ids):
+        """Document index of each doc ID (-1 if unknown)."""
+        return _lookup_sorted(self.doc_ids, doc_ids)
+
+    def lookup(self, doc_indices, section_numbers):
+        """Embedding row of each (document index, section number) pair, or
+        -1 where the document is unknown or has no such section."""
+        doc_indices = np.asarray(doc_indices, dtype=np.int64)
+        section_numbers = np.asarray(section_numbers, dtype=np.int64)
+        valid = ((doc_indices >= 0) & (section_numbers >= 0))
+        safe_docs = np.where(valid, doc_indices, 0)
+        valid &= section_numbers < self.section_counts()[safe_docs]
+        positions = self.doc_offsets[safe_docs] + np.where(
+            valid, section_numbers, 0)
+        return np.where(
+            valid, self.section_rows[np.minimum(positions,
+                                                self.n_sections - 1)], -1)
+
+    def rows_of(self, doc_ids, section_numbers):
+        """Embedding row of each (doc ID, section number) pair (-1 if
+        unknown)."""
+        return self.lookup(self.doc_index(doc_ids), section_numbers)
+
+    def doc_hit_counts(self, row_mask):
+        """Number of flagged sections per document.
+
+        Args:
+            row_mask: Boolean array over embedding rows
+
+        Returns:
+            (n_docs,) int64 array of flagged-section counts
+        """
+        hits = np.asarray(row_mask)[self.section_rows]
+        return np.bincount(self.entry_docs(),
+                           weights=hits,
+                           minlength=self.n_docs).astype(np.int64)
+
+    def save(self, directory, name=SECTION_INDEX_NAME):
+        np.save(os.path.join(directory, f"{name}_doc_ids.npy"), self.doc_ids)
+        np.save(os.path.join(directory, f"{name}_doc_offsets.npy"),
+                self.doc_offsets)
+        np.save(os.path.join(directory, f"{name}_rows.npy"), self.section_rows)
+
+    @classmethod
+    def load(cls, directory, name=SECTION_INDEX_NAME, mmap_mode="r"):
+        return cls(
+            np.load(os.path.join(directory, f"{name}_doc_ids.npy"),
+                    mmap_mode=mmap_mode),
+            np.load(os.path.join(directory, f"{name}_doc_offsets.npy"),
+                    mmap_mode=mmap_mode),
+            np.load(os.path.join(directory, f"{name}_rows.npy"),
+                    mmap_mode=mmap_mode))
+
+
+def load_query_id_map(directory, mmap_mode="r"):
+    """Load the query ID map of an embeddings directory, memory-mapped from
+    its binary files, falling back to `query_id_to_index.json`."""
+    if os.path.exists(os.path.join(directory, f"{QUERY_ID_MAP_NAME}_ids.npy")):
+        return IdMap.load(directory, mmap_mode=mmap_mode)
+    return IdMap.from_mapping(
+        read_json(os.path.join(directory, "query_id_to_index.json")))
+
+
+def load_section_index(directory, mmap_mode="r"):
+    """Load the section index of an embeddings directory, memory-mapped from
+    its binary files, falling back to `section_id_to_index.json`."""
+    if os.path.exists(
+            os.path.join(directory, f"{SECTION_INDEX_NAME}_doc_ids.npy")):
+        return SectionIndex.load(directory, mmap_mode=mmap_mode)
+    return SectionIndex.from_mapping(
+        read_json(os.path.join(directory, "section_id_to_index.json")))
@@ -0,0 +1,130 @@
+import os
+import numpy as np
+
+EMBEDDING_DTYPES = ("float32", "float16", "int8")
+SCALES_SUFFIX = ".scales.npy"
+
+
+def scales_path(embeddings_path):
+    """Per-row scale file stored next to int8 `<name>.npy` embeddings."""
+    return embeddings_path[:-len(".npy")] + SCALES_SUFFIX
+
+
+def quantize_int8(embeddings):
+    """Symmetric per-row int8 quantization.
+
+    Returns:
+        Tuple (codes, scales) with `embeddings ~= codes * scales[:, None]`;
+        all-zero rows get a scale of 1.
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    scales = np.abs(embeddings).max(axis=1) / 127
+    scales[scales == 0] = 1
+    codes = np.rint(embeddings / scales[:, None]).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+def dequantize_int8(codes, scales):
+    return np.asarray(codes, dtype=np.float32) * np.asarray(
+        scales, dtype=np.float32)[..., None]
+
+
+class Int8Embeddings:
+    """Row-indexable view of int8 codes with per-row float32 scales.
+
+    Indexing rows (`embeddings[start:end]`, `embeddings[rows]`) returns the
+    dequantized float32 rows, so the scoring engine reads quantized data
+    block by block without a float32 copy of the whole matrix.
+    """
+
+    def __init__(self, codes, scales):
+        self.codes = codes
+        self.scales = scales
+
+    @property
+    def shape(self):
+        return self.codes.shape
+
+    @property
+    def ndim(self):
+        return self.codes.ndim
+
+    @property
+    def dtype(self):
+        return np.dtype(np.float32)
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes + self.scales.nbytes
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, rows):
+        return dequantize_int8(self.codes[rows], self.scales[rows])
+
+    def __array__(self, dtype=None, copy=None):
+        embeddings = dequantize_int8(self.codes, self.scales)
+        return embeddings if dtype is None else embeddings.astype(dtype)
+
+
+def load_embeddings(path, mmap_mode="r"):
+    """Load `<name>_embeddings.npy` as stored: a (memory-mapped) float32 or
+    float16 array, or an `Int8Embeddings` when a scale file sits next to
+    it."""
+    if os.path.exists(scales_path(path)):
+        return Int8Embeddings(np.load(path, mmap_mode=mmap_mode),
+                              np.load(scales_path(path), mmap_mode=mmap_mode))
+    return np.load(path, mmap_mode=mmap_mode)
+
+
+def open_quantized_memmap(path, shape, dtype):
+    """Create `.npy` memmaps for embeddings stored as `dtype`.
+
+    Returns:
+        Tuple (values, scales); `scales` is None unless dtype is int8.
+    """
+    if dtype not in EMBEDDING_DTYPES:
+        raise ValueError(f"Unknown embedding dtype: {dtype}")
+    values = np.lib.format.open_memmap(path,
+                                       mode="w+",
+                                       dtype=np.dtype(dtype),
+                                       shape=shape)
+    scales = None
+    if dtype != "int8" and os.path.exists(scales_path(path)):
+        # A stale scale file would make the values load as int8 codes
+        os.remove(scales_path(path))
+    if dtype == "int8":
+        scales = np.lib.format.open_memmap(scales_path(path),
+                                           mode="w+",
+                                           dtype=np.float32,
+                                           shape=(shape[0],))
+    return values, scales
+
+
+def write_rows(values, scales, start, embeddings):
+    """Store float embeddings into rows `start:` of memmaps opened with
+    `open_quantized_memmap`."""
+    end = start + len(embeddings)
+    if scales is None:
+        values[start:end] = embeddings
+    else:
+        values[start:end], scales[start:end] = quantize_int8(embeddings)
+
+
+def quantize_npy(source_path, output_path, dtype, chunk_rows=65536):
+    """Re-encode a stored embedding file as `dtype`, chunk by chunk.
+
+    Returns:
+        The quantized embeddings, loaded with `load_embeddings`.
+    """
+    source = load_embeddings(source_path)
+    values, scales = open_quantized_memmap(output_path, source.shape, dtype)
+    for start in range(0, source.shape[0], chunk_rows):
+        write_rows(values, scales, start,
+                   np.asarray(source[start:start + chunk_rows]))
+    values.flush()
+    if scales is not None:
+        scales.flush()
+    del values, scales
+    return load_embeddings(output_path)
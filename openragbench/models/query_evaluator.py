@@ -1,14 +1,21 @@
 import os
-import gc
-import torch
+import time
+import threading
 import numpy as np
 from utils import read_config, read_json, write_json
-from openai import OpenAI
 from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
 from tenacity import retry, stop_after_attempt, wait_random_exponential
 
 from openragbench.prompts.arxiv_templates import STYLE_VALIDATION_INSTRUCTION, TYPE_VALIDATION_INSTRUCTION
 from openragbench.models.processors import MarkdownProcessor
+from openragbench.models.id_maps import IdMap, SectionIndex
+from openragbench.models.embedding_cache import EmbeddingCache
+from openragbench.models.autotune import BatchSizeTuner
+from openragbench.models.chunked_encoding import encode_to_npy
+from openragbench.models.scoring import similarity
+from openragbench.models.encoders import create_encoder
+from openragbench.utils import clear_memory
 
 OPENAI_MODELS = read_config("query_configs.yaml")["OPENAI_MODELS"]
 
@@ -30,6 +37,8 @@ class StyleValidator:
                 "OpenAI/VLLM API key is required. Please provide it via function argument or environment variable."
             )
 
+        from openai import OpenAI
+
         self.client = OpenAI(api_key=api_key, base_url=base_url)
         self.model_args = {"model": model}
         if model != "o3-mini":
@@ -79,57 +88,81 @@ class StyleValidator:
 
 class DocumentRelevanceFilter:
 
-    def __init__(self):
-        from models.encoders import (LinqEncoder, StellaEncoder, QwenEncoder,
-                                     JinaEncoder, InfEncoder, SFREncoder,
-                                     GeminiEncoder, OpenAIEncoder, similarity)
+    # Encoding batch size per role when no batch tuner is set; full documents
+    # are encoded one at a time
+    ROLE_BATCH_SIZES = {"query": 16, "section": 16, "doc": 1}
+
+    def __init__(self,
+                 cache_dir: Optional[str] = None,
+                 chunk_size: int = 4096,
+                 api_workers: int = 2,
+                 local_workers: int = 1,
+                 batch_tuner: Optional[BatchSizeTuner] = None,
+                 embedding_dtype: str = "float32"):
+        # Encoders are resolved by name from the registry, so a model's
+        # libraries are only imported once that encoder is used
         self.encoder_classes = [
             {
-                "class": LinqEncoder,
                 "name": "LinqEncoder",
                 "api_required": False
             },
             {
-                "class": StellaEncoder,
                 "name": "StellaEncoder",
                 "api_required": False
             },
             {
-                "class": QwenEncoder,
                 "name": "QwenEncoder",
                 "api_required": False
             },
-            # {"class": JinaEncoder, "name": "JinaEncoder", "api_required": False},
+            # {"name": "JinaEncoder", "api_required": False},
             {
-                "class": InfEncoder,
                 "name": "InfEncoder",
                 "api_required": False
             },
             {
-                "class": SFREncoder,
                 "name": "SFREncoder",
                 "api_required": False
             },
-            # {"class": GeminiEncoder, "name": "GeminiEncoder", "api_required": True, "api_key": "GEMINI_API_KEY"},
+            # {"name": "GeminiEncoder", "api_required": True, "api_key": "GEMINI_API_KEY"},
             {
-                "class": OpenAIEncoder,
                 "name": "OpenAIEncoder",
                 "api_required": True,
                 "api_key": "OPENAI_API_KEY"
             }
         ]
         self.similarity = similarity
-
-    @staticmethod
-    def clear_memory():
-        gc.collect()
-        if torch.cuda.is_available():
-            torch.cuda.empty_cache()
+        # With a cache, every run re-encodes only texts it has not seen yet
+        self.embedding_cache = EmbeddingCache(cache_dir) if cache_dir else None
+        # Texts encoded and written to disk per chunk
+        self.chunk_size = chunk_size
+        # Separate pools, so network-bound API encoders run while local
+        # models hold the GPU/CPU; local models run one at a time by default
+        self.api_workers = api_workers
+        self.local_workers = local_workers
+        self.encoder_status = {}
+        self._status_lock = threading.Lock()
+        # Calibrates local encoders' batch sizes per length bucket and backs
+        # off on out-of-memory errors; None uses ROLE_BATCH_SIZES. API
+        # requests and local batches pause while a calibration is measured
+        self.batch_tuner = batch_tuner
+        # Storage dtype of the written embeddings: float32, float16 or int8
+        # with per-row scales (see models.quantization)
+        self.embedding_dtype = embedding_dtype
+
+    clear_memory = staticmethod(clear_memory)
 
     def compute_similarity(self, embeddings1, embeddings2):
         return self.similarity(embeddings1, embeddings2)
 
-    def compute_query_embeddings(self, query_path, output_dir):
+    @staticmethod
+    def _set_batch_size(encoder, batch_size):
+        encoder.batch_size = batch_size
+        if getattr(encoder, "max_batch_tokens", None) is not None:
+            encoder.max_batch_tokens = batch_size * 512
+
+    @staticmethod
+    def prepare_queries(query_path, output_dir):
+        """Query texts in embedding order; writes the query ID maps."""
         queries = read_json(query_path)
         query_items = sorted(queries.items())
         query_texts = [item[1]['query'] for item in query_items]
@@ -137,46 +170,14 @@ class DocumentRelevanceFilter:
             query_id: idx for idx, (query_id, _) in enumerate(query_items)
         }
 
-        os.makedirs(output_dir, exist_ok=True)
-
-        for encoder_info in self.encoder_classes:
-            # Skip API-based encoders if the API key is not available
-            if encoder_info["api_required"] and encoder_info[
-                    "api_key"] not in os.environ:
-                print(
-                    f"\nSkipping {encoder_info['name']} test as {encoder_info['api_key']} environment variable is not set"
-                )
-                continue
-
-            print(f"Encoding queries with {encoder_info['name']}")
-            try:
-                subfolder_path = os.path.join(output_dir, encoder_info["name"])
-                os.makedirs(subfolder_path, exist_ok=True)
-                if os.path.exists(
-                        os.path.join(subfolder_path, "query_embeddings.npy")):
-                    print(
-                        f"Query embeddings for {encoder_info['name']} already exist. Skipping computation."
-                    )
-                    continue
-
-                encoder = encoder_info["class"]()
-                query_embeddings = encoder.encode_queries(query_texts)
-
-                np.save(os.path.join(subfolder_path, "query_embeddings.npy"),
-                        query_embeddings)
-            except Exception as e:
-                print(f"Error testing {encoder_info['name']}: {str(e)}")
-            finally:
-                if 'encoder' in locals():
-                    del encoder
-                if 'query_embeddings' in locals():
-                    del query_embeddings
-                self.clear_memory()
-
         write_json(query_id_to_index,
                    os.path.join(output_dir, "query_id_to_index.json"))
+        IdMap.from_mapping(query_id_to_index).save(output_dir)
+        return query_texts
 
-    def compute_section_embeddings(self, corpus_path, output_dir):
+    @staticmethod
+    def prepare_sections(corpus_path, output_dir):
+        """Section texts in embedding order; writes the section ID maps."""
         processor = MarkdownProcessor()
         sections_data = []  # Will hold all section texts
         section_id_to_index = {}  # Three-level nested dictionary for mapping
@@ -206,54 +207,15 @@ class DocumentRelevanceFilter:
                     section_id_to_index[doc_id][str(i)] = section_index
                     section_index += 1
 
-        os.makedirs(output_dir, exist_ok=True)
-
-        # Save the mapping dictionary
+        # Save the mapping dictionary and its memory-mappable binary form
         write_json(section_id_to_index,
                    os.path.join(output_dir, "section_id_to_index.json"))
+        SectionIndex.from_mapping(section_id_to_index).save(output_dir)
+        return sections_data
 
-        # Process with each encoder
-        for encoder_info in self.encoder_classes:
-            # Skip API-based encoders if the API key is not available
-            if encoder_info["api_required"] and encoder_info[
-                    "api_key"] not in os.environ:
-                print(
-                    f"\nSkipping {encoder_info['name']} test as {encoder_info['api_key']} environment variable is not set"
-                )
-                continue
-
-            print(f"Encoding sections with {encoder_info['name']}")
-            try:
-                subfolder_path = os.path.join(output_dir, encoder_info["name"])
-                os.makedirs(subfolder_path, exist_ok=True)
-
-                # Skip if embeddings already exist
-                if os.path.exists(
-                        os.path.join(subfolder_path, "section_embeddings.npy")):
-                    print(
-                        f"Section embeddings for {encoder_info['name']} already exist. Skipping computation."
-                    )
-                    continue
-
-                # Create and use the encoder
-                encoder = encoder_info["class"]()
-                encoder.batch_size = 16
-                section_embeddings = encoder.encode_docs(sections_data)
-
-                # Save the embeddings
-                np.save(os.path.join(subfolder_path, "section_embeddings.npy"),
-                        section_embeddings)
-            except Exception as e:
-                print(f"Error testing {encoder_info['name']}: {str(e)}")
-            finally:
-                # Clean up to free memory
-                if 'encoder' in locals():
-                    del encoder
-                if 'section_embeddings' in locals():
-                    del section_embeddings
-                self.clear_memory()
-
-    def compute_doc_embeddings(self, corpus_path, output_dir):
+    @staticmethod
+    def prepare_docs(corpus_path, output_dir):
+        """Full document texts in embedding order; writes doc_id_to_index."""
         processor = MarkdownProcessor()
         docs = {}
         for filename in os.listdir(corpus_path):
@@ -268,44 +230,193 @@ class DocumentRelevanceFilter:
             doc_id: idx for idx, (doc_id, _) in enumerate(doc_items)
         }
 
+        write_json(doc_id_to_index,
+                   os.path.join(output_dir, "doc_id_to_index.json"))
+        return doc_texts
+
+    def _update_status(self, status_path, name, **fields):
+        """Record an encoder's progress and persist all statuses."""
+        with self._status_lock:
+            self.encoder_status.setdefault(name, {}).update(fields)
+            write_json(self.encoder_status, status_path)
+
+    def _run_encoder(self, encoder_info, pending_roles, role_texts,
+                     subfolder_path, status_path):
+        """Load one encoder, encode all its pending roles and release it."""
+        name = encoder_info["name"]
+        start_time = time.perf_counter()
+        self._update_status(status_path, name, state="running")
+        encoder, completed_roles = None, []
+        try:
+            # Load the encoder once for all pending roles
+            encoder = create_encoder(name)
+            encoder.embedding_cache = self.embedding_cache
+            if hasattr(encoder, "batch_tuner"):
+                encoder.batch_tuner = self.batch_tuner
+            if (hasattr(encoder, "calibration_gate") and
+                    self.batch_tuner is not None):
+                # API requests pause while a local model is calibrated
+                encoder.calibration_gate = self.batch_tuner.gate
+            for role in pending_roles:
+                print(f"Encoding {role}s with {name}")
+                self._set_batch_size(encoder, self.ROLE_BATCH_SIZES[role])
+                encode_fn = (encoder.encode_queries
+                             if role == "query" else encoder.encode_docs)
+
+                # Stream chunks to disk; an interrupted run resumes here
+                encode_to_npy(
+                    encode_fn, role_texts[role],
+                    os.path.join(subfolder_path, f"{role}_embeddings.npy"),
+                    self.chunk_size, self.embedding_dtype)
+                if self.embedding_cache is not None:
+                    self.embedding_cache.flush()
+
+                # API encoders report how oversize texts were handled
+                if hasattr(encoder, "pop_manifest"):
+                    write_json(
+                        encoder.pop_manifest(),
+                        os.path.join(subfolder_path, f"{role}_manifest.json"))
+                completed_roles.append(role)
+                self._update_status(status_path,
+                                    name,
+                                    completed_roles=list(completed_roles))
+            self._update_status(status_path,
+                                name,
+                                state="done",
+                                seconds=time.perf_counter() - start_time)
+        except Exception as e:
+            print(f"Error testing {name}: {str(e)}")
+            self._update_status(status_path,
+                                name,
+                                state="failed",
+                                error=str(e),
+                                seconds=time.perf_counter() - start_time)
+        finally:
+            # Keep what was embedded, even if the encoder failed midway
+            if self.embedding_cache is not None:
+                self.embedding_cache.flush()
+            # Clean up to free memory
+            del encoder
+            self.clear_memory()
+
+    def compute_all_embeddings(self,
+                               output_dir,
+                               query_path=None,
+                               corpus_path=None,
+                               roles=("query", "section", "doc")):
+        """
+        Embed queries, sections and/or full documents with every encoder.
+
+        Each encoder is loaded once and encodes all requested roles before it
+        is released, instead of being reloaded for every role. API encoders
+        and local models run in separate thread pools (`api_workers` and
+        `local_workers`), so the network-bound and compute-bound encoders
+        overlap. Every encoder's state, completed roles, error and wall-clock
+        time are tracked in `self.encoder_status` and written to
+        `embedding_status.json`; a failing encoder does not stop the others.
+
+        Args:
+            output_dir: Directory for the ID maps and the per-encoder
+                `<role>_embeddings.npy` files
+            query_path: Path to queries.json, required for the query role
+            corpus_path: Corpus directory, required for section/doc roles
+            roles: Subset of ("query", "section", "doc") to encode
+
+        Returns:
+            Dict of the per-encoder status.
+        """
         os.makedirs(output_dir, exist_ok=True)
-
+        status_path = os.path.join(output_dir, "embedding_status.json")
+        self.encoder_status = {}
+
+        role_texts = {}
+        if "query" in roles:
+            role_texts["query"] = self.prepare_queries(query_path, output_dir)
+        if "section" in roles:
+            role_texts["section"] = self.prepare_sections(
+                corpus_path, output_dir)
+        if "doc" in roles:
+            role_texts["doc"] = self.prepare_docs(corpus_path, output_dir)
+
+        jobs = []
         for encoder_info in self.encoder_classes:
+            name = encoder_info["name"]
             # Skip API-based encoders if the API key is not available
             if encoder_info["api_required"] and encoder_info[
                     "api_key"] not in os.environ:
                 print(
-                    f"\nSkipping {encoder_info['name']} test as {encoder_info['api_key']} environment variable is not set"
+                    f"\nSkipping {name} test as {encoder_info['api_key']} environment variable is not set"
                 )
+                self._update_status(status_path,
+                                    name,
+                                    state="skipped",
+                                    error=f"{encoder_info['api_key']} not set")
                 continue
 
-            print(f"Encoding docs with {encoder_info['name']}")
-            try:
-                subfolder_path = os.path.join(output_dir, encoder_info["name"])
-                os.makedirs(subfolder_path, exist_ok=True)
-                if os.path.exists(
-                        os.path.join(subfolder_path, "doc_embeddings.npy")):
+            subfolder_path = os.path.join(output_dir, name)
+            os.makedirs(subfolder_path, exist_ok=True)
+
+            # Without a cache, roles whose embeddings exist are skipped
+            pending_roles = []
+            for role in role_texts:
+                if self.embedding_cache is None and os.path.exists(
+                        os.path.join(subfolder_path, f"{role}_embeddings.npy")):
                     print(
-                        f"Doc embeddings for {encoder_info['name']} already exist. Skipping computation."
+                        f"{role.capitalize()} embeddings for {name} already exist. Skipping computation."
                     )
-                    continue
-
-                encoder = encoder_info["class"](batch_size=1)
-                doc_embeddings = encoder.encode_docs(doc_texts)
-
-                np.save(os.path.join(subfolder_path, "doc_embeddings.npy"),
-                        doc_embeddings)
-            except Exception as e:
-                print(f"Error testing {encoder_info['name']}: {str(e)}")
-            finally:
-                if 'encoder' in locals():
-                    del encoder
-                if 'doc_embeddings' in locals():
-                    del doc_embeddings
-                self.clear_memory()
+                else:
+                    pending_roles.append(role)
+            if not pending_roles:
+                self._update_status(status_path, name, state="done")
+                continue
 
-        write_json(doc_id_to_index,
-                   os.path.join(output_dir, "doc_id_to_index.json"))
+            self._update_status(
+                status_path,
+                name,
+                state="pending",
+                pool="api" if encoder_info["api_required"] else "local",
+                pending_roles=pending_roles,
+                completed_roles=[])
+            jobs.append((encoder_info, pending_roles, subfolder_path))
+
+        start_time = time.perf_counter()
+        with ThreadPoolExecutor(self.api_workers) as api_pool, \
+                ThreadPoolExecutor(self.local_workers) as local_pool:
+            futures = []
+            for encoder_info, pending_roles, subfolder_path in jobs:
+                pool = api_pool if encoder_info["api_required"] else local_pool
+                futures.append(
+                    pool.submit(self._run_encoder, encoder_info, pending_roles,
+                                role_texts, subfolder_path, status_path))
+            for future in futures:
+                future.result()
+
+        elapsed = time.perf_counter() - start_time
+        print(f"\nEmbedding finished in {elapsed:.1f}s")
+        for name, status in self.encoder_status.items():
+            seconds = status.get("seconds")
+            line = f"  {name:20s} {status['state']:8s}"
+            if seconds is not None:
+                line += f" {seconds:8.1f}s"
+            if status.get("error"):
+                line += f"  {status['error']}"
+            print(line)
+        return self.encoder_status
+
+    def compute_query_embeddings(self, query_path, output_dir):
+        self.compute_all_embeddings(output_dir,
+                                    query_path=query_path,
+                                    roles=("query",))
+
+    def compute_section_embeddings(self, corpus_path, output_dir):
+        self.compute_all_embeddings(output_dir,
+                                    corpus_path=corpus_path,
+                                    roles=("section",))
+
+    def compute_doc_embeddings(self, corpus_path, output_dir):
+        self.compute_all_embeddings(output_dir,
+                                    corpus_path=corpus_path,
+                                    roles=("doc",))
 
 
 class TypeValidator:
@@ -325,6 +436,8 @@ class TypeValidator:
                 "OpenAI/VLLM API key is required. Please provide it via function argument or environment variable."
             )
 
+        from openai import OpenAI
+
         self.client = OpenAI(api_key=api_key, base_url=base_url)
         self.model_args = {"model": model}
         if model != "o3-mini":
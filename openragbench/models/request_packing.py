@@ -0,0 +1,156 @@
+import os
+import math
+import hashlib
+import numpy as np
+
+OVERSIZE_POLICIES = ("split_mean", "truncate", "error")
+
+
+class CharTokenizer:
+    """Dependency-free token estimate from the character count.
+
+    3 characters per token is conservative for English prose, but math and
+    LaTeX tokenize denser, so counts can fall short of the provider's; pack
+    below the real caps and re-split requests the provider rejects.
+    """
+
+    def __init__(self, chars_per_token=3):
+        self.chars_per_token = chars_per_token
+        self.name = f"chars/{chars_per_token}"
+
+    def count(self, text):
+        return max(1, math.ceil(len(text) / self.chars_per_token))
+
+    def split(self, text, max_tokens):
+        size = max_tokens * self.chars_per_token
+        return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+class TiktokenTokenizer:
+    """Exact token counts with a local tiktoken encoding."""
+
+    def __init__(self, encoding):
+        self.encoding = encoding
+        self.name = f"tiktoken/{encoding.name}"
+
+    def _encode(self, text):
+        return self.encoding.encode(text, disallowed_special=())
+
+    def count(self, text):
+        return max(1, len(self._encode(text)))
+
+    def split(self, text, max_tokens):
+        tokens = self._encode(text)
+        return [
+            self.encoding.decode(tokens[i:i + max_tokens])
+            for i in range(0, len(tokens), max_tokens)
+        ]
+
+
+def get_tokenizer(model_name=None):
+    """tiktoken tokenizer for the model when tiktoken is installed and
+    `TIKTOKEN_CACHE_DIR` points to a populated local cache, otherwise the
+    character-based estimate. tiktoken downloads missing encodings on first
+    use, so it is never tried without an explicit cache."""
+    cache_dir = os.environ.get("TIKTOKEN_CACHE_DIR")
+    if not cache_dir or not os.path.isdir(cache_dir) or not os.listdir(
+            cache_dir):
+        return CharTokenizer()
+    try:
+        import tiktoken
+        try:
+            encoding = tiktoken.encoding_for_model(model_name)
+        except KeyError:
+            encoding = tiktoken.get_encoding("cl100k_base")
+        return TiktokenTokenizer(encoding)
+    except Exception:
+        # Not installed, or the encoding is missing from the cache
+        return CharTokenizer()
+
+
+def pack_requests(texts,
+                  tokenizer,
+                  max_tokens_per_request,
+                  max_tokens_per_input,
+                  max_inputs_per_request,
+                  oversize_policy="split_mean"):
+    """Pack texts into API requests by token count.
+
+    Texts longer than `max_tokens_per_input` are handled by
+    `oversize_policy`: "split_mean" embeds every piece and later averages
+    them (token-weighted), "truncate" keeps only the first piece and
+    "error" raises. Requests are filled in input order until the next
+    segment would exceed `max_tokens_per_request` or
+    `max_inputs_per_request`.
+
+    Returns:
+        Tuple (requests, segment_owner, segment_tokens, oversize): the list
+        of requests (lists of segment texts), the text index and token
+        count of every segment in request order, and one manifest entry per
+        oversize text.
+    """
+    if oversize_policy not in OVERSIZE_POLICIES:
+        raise ValueError(f"Unknown oversize policy: {oversize_policy}")
+
+    requests, segment_owner, segment_tokens, oversize = [], [], [], []
+    current, current_tokens = [], 0
+    for index, text in enumerate(texts):
+        n_tokens = tokenizer.count(text)
+        pieces = [text]
+        if n_tokens > max_tokens_per_input:
+            if oversize_policy == "error":
+                raise ValueError(
+                    f"Text {index} has {n_tokens} tokens, more than the "
+                    f"{max_tokens_per_input} allowed per input")
+            pieces = tokenizer.split(text, max_tokens_per_input)
+            if oversize_policy == "truncate":
+                pieces = pieces[:1]
+            oversize.append({
+                "text_sha256": hashlib.sha256(text.encode("utf-8")).hexdigest(),
+                "tokens": n_tokens,
+                "policy": oversize_policy,
+                "pieces": len(pieces),
+            })
+            piece_tokens = [tokenizer.count(piece) for piece in pieces]
+        else:
+            piece_tokens = [n_tokens]
+
+        for piece, n_piece_tokens in zip(pieces, piece_tokens):
+            full = (current_tokens + n_piece_tokens > max_tokens_per_request or
+                    len(current) >= max_inputs_per_request)
+            if current and full:
+                requests.append(current)
+                current, current_tokens = [], 0
+            current.append(piece)
+            current_tokens += n_piece_tokens
+            segment_owner.append(index)
+            segment_tokens.append(n_piece_tokens)
+    if current:
+        requests.append(current)
+    segment_owner = np.array(segment_owner, dtype=np.int64)
+    segment_tokens = np.array(segment_tokens, dtype=np.float64)
+    return requests, segment_owner, segment_tokens, oversize
+
+
+def combine_segments(segment_embeddings, segment_owner, segment_tokens,
+                     n_texts):
+    """Token-weighted mean of every text's segment embeddings, re-normalized
+    for texts that were split into several segments. Segments are expected
+    in text order, as produced by `pack_requests`."""
+    segment_embeddings = np.asarray(segment_embeddings)
+    counts = np.bincount(segment_owner, minlength=n_texts)
+    if np.all(counts == 1):
+        return segment_embeddings
+
+    embeddings = np.zeros((n_texts, segment_embeddings.shape[1]),
+                          dtype=np.float64)
+    np.add.at(embeddings, segment_owner,
+              segment_embeddings * segment_tokens[:, None])
+    embeddings /= np.bincount(segment_owner,
+                              weights=segment_tokens,
+                              minlength=n_texts)[:, None]
+    split = counts > 1
+    embeddings[split] /= np.linalg.norm(embeddings[split],
+                                        axis=1,
+                                        keepdims=True)
+    return embeddings.astype(segment_embeddings.dtype)
@@ -0,0 +1,251 @@
+import os
+import hashlib
+import numpy as np
+
+from openragbench.models.ann_index import get_ivf_index
+from openragbench.models.quantization import load_embeddings
+from openragbench.models.scoring import (gold_ranks, min_max_scale,
+                                         topk_similarity,
+                                         two_stage_topk_similarity)
+from openragbench.utils import read_json, write_json
+
+TOPK_IDS_FILE = "topk_ids.npy"
+TOPK_SCORES_FILE = "topk_scores.npy"
+ROW_STATS_FILE = "row_stats.npy"
+GOLD_FILE = "gold.npy"
+META_FILE = "topk_meta.json"
+
+# One record per query: the row of its gold section (-1 if unknown), the raw
+# similarity with that section and its rank among all sections.
+GOLD_DTYPE = np.dtype([("row", "<i4"), ("score", "<f4"), ("rank", "<i4")])
+MISSING_RANK = np.iinfo(np.int32).max
+
+
+def _save_atomic(path, array):
+    # A store that is still memory-mapped keeps reading the old file instead
+    # of seeing it truncated mid-rewrite
+    with open(path + ".tmp", "wb") as f:
+        np.save(f, array)
+    os.replace(path + ".tmp", path)
+
+
+def _gold_signature(gold_rows):
+    return hashlib.sha1(np.asarray(gold_rows,
+                                   dtype=np.int64).tobytes()).hexdigest()
+
+
+def _write_meta(model_path, meta):
+    meta_path = os.path.join(model_path, META_FILE)
+    write_json(meta, meta_path + ".tmp")
+    os.replace(meta_path + ".tmp", meta_path)
+
+
+def _file_signature(path):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+class TopKStore:
+    """Per-model sparse score store.
+
+    Holds the top-k section ids (int32) and raw scores (float16) of every
+    query, the row-wise min/max over all sections for min-max scaling, and a
+    gold side array. All arrays are loaded memory-mapped, so reading a store
+    costs O(Q * k) I/O instead of O(Q * S).
+    """
+
+    def __init__(self, path, mmap_mode="r"):
+        self.path = path
+        self.meta = read_json(os.path.join(path, META_FILE))
+        self.ids = np.load(os.path.join(path, TOPK_IDS_FILE),
+                           mmap_mode=mmap_mode)
+        self.scores = np.load(os.path.join(path, TOPK_SCORES_FILE),
+                              mmap_mode=mmap_mode)
+        row_stats = np.load(os.path.join(path, ROW_STATS_FILE),
+                            mmap_mode=mmap_mode)
+        self.row_min = row_stats[:, 0]
+        self.row_max = row_stats[:, 1]
+        # A gold file only counts if the meta says it was written for the
+        # current scores
+        gold_path = os.path.join(path, GOLD_FILE)
+        self.gold = np.load(gold_path, mmap_mode=mmap_mode) if (
+            self.meta.get("gold") and os.path.exists(gold_path)) else None
+
+    @property
+    def k(self):
+        return self.meta["k"]
+
+    def scaled_scores(self, rows=slice(None)):
+        """Min-max scaled top-k scores for the given query rows."""
+        return min_max_scale(self.scores[rows], self.row_min[rows],
+                             self.row_max[rows])
+
+    def gold_scaled_scores(self):
+        """Min-max scaled gold scores; NaN where the gold section is unknown.
+        """
+        return min_max_scale(self.gold["score"], self.row_min, self.row_max)
+
+    def is_current(self,
+                   query_emb_path,
+                   section_emb_path,
+                   k,
+                   prefix_dim=None,
+                   ann_n_probe=None):
+        # With fewer sections than k the store holds every section
+        return (self.k >= min(k, self.meta["n_sections"]) and
+                self.meta.get("prefix_dim") == prefix_dim and
+                self.meta.get("ann_n_probe") == ann_n_probe and
+                self.meta["sources"] == {
+                    "query": _file_signature(query_emb_path),
+                    "section": _file_signature(section_emb_path),
+                })
+
+
+def make_gold(gold_rows, gold_scores, gold_ranks):
+    """Pack gold rows, raw scores and exact ranks into the gold side array."""
+    gold = np.empty(len(gold_rows), dtype=GOLD_DTYPE)
+    gold["row"] = gold_rows
+    gold["score"] = gold_scores
+    gold["rank"] = np.where(
+        np.asarray(gold_ranks) < 0, MISSING_RANK, gold_ranks)
+    return gold
+
+
+def build_topk_store(model_path,
+                     k,
+                     gold_rows=None,
+                     device="auto",
+                     memory_budget_mb=512,
+                     prefix_dim=None,
+                     ann_n_probe=None):
+    """Score a model's query and section embeddings and write its top-k store.
+
+    Args:
+        model_path: Encoder directory holding `query_embeddings.npy` and
+            `section_embeddings.npy`
+        k: Number of sections to keep per query
+        gold_rows: Optional (Q,) gold section row per query, -1 if unknown
+        device: Scoring backend, see `scoring.resolve_device`
+        memory_budget_mb: Memory budget for one score tile
+        prefix_dim: Shortlist on this many leading dimensions and re-score
+            the shortlist at full dimension (see
+            `scoring.two_stage_topk_similarity`); None scores exactly
+        ann_n_probe: Search the model's IVF index (see `ann_index`), probing
+            this many lists per query, and re-score the candidates exactly;
+            None scores exhaustively
+
+    Returns:
+        The written TopKStore.
+    """
+    if prefix_dim is not None and ann_n_probe is not None:
+        raise ValueError("prefix_dim and ann_n_probe cannot be combined")
+    query_emb_path = os.path.join(model_path, 'query_embeddings.npy')
+    section_emb_path = os.path.join(model_path, 'section_embeddings.npy')
+    query_embeddings = load_embeddings(query_emb_path)
+    section_embeddings = load_embeddings(section_emb_path)
+
+    if ann_n_probe is not None:
+        result = get_ivf_index(model_path).search(
+            query_embeddings,
+            k,
+            ann_n_probe,
+            doc_embeddings=section_embeddings,
+            gold_rows=gold_rows,
+            memory_budget_mb=memory_budget_mb)
+    elif prefix_dim is None:
+        result = topk_similarity(query_embeddings,
+                                 section_embeddings,
+                                 k,
+                                 device=device,
+                                 memory_budget_mb=memory_budget_mb,
+                                 gold_rows=gold_rows)
+    else:
+        result = two_stage_topk_similarity(query_embeddings,
+                                           section_embeddings,
+                                           k,
+                                           prefix_dim,
+                                           device=device,
+                                           memory_budget_mb=memory_budget_mb,
+                                           gold_rows=gold_rows)
+
+    _save_atomic(os.path.join(model_path, TOPK_IDS_FILE),
+                 result.ids.astype(np.int32))
+    _save_atomic(os.path.join(model_path, TOPK_SCORES_FILE),
+                 result.scores.astype(np.float16))
+    _save_atomic(os.path.join(model_path, ROW_STATS_FILE),
+                 np.stack([result.row_min, result.row_max], axis=1))
+    gold_path = os.path.join(model_path, GOLD_FILE)
+    gold_signature = None
+    if gold_rows is not None:
+        gold_signature = _gold_signature(gold_rows)
+        _save_atomic(gold_path,
+                     make_gold(gold_rows, result.gold_scores,
+                               result.gold_ranks))
+    elif os.path.exists(gold_path):
+        # Ranks from the previous embeddings must not be reused
+        os.remove(gold_path)
+
+    _write_meta(
+        model_path, {
+            "k": int(result.ids.shape[1]),
+            "n_queries": int(query_embeddings.shape[0]),
+            "n_sections": int(section_embeddings.shape[0]),
+            "prefix_dim": prefix_dim,
+            "ann_n_probe": ann_n_probe,
+            "sources": {
+                "query": _file_signature(query_emb_path),
+                "section": _file_signature(section_emb_path),
+            },
+            "gold": gold_signature,
+        })
+    return TopKStore(model_path)
+
+
+def load_topk_store(model_path, mmap_mode="r"):
+    """Load a model's top-k store, or return None if it was never built."""
+    if not os.path.exists(os.path.join(model_path, META_FILE)):
+        return None
+    return TopKStore(model_path, mmap_mode=mmap_mode)
+
+
+def get_topk_store(model_path,
+                   k,
+                   gold_rows=None,
+                   device="auto",
+                   memory_budget_mb=512,
+                   prefix_dim=None,
+                   ann_n_probe=None):
+    """Load a model's top-k store, rebuilding it when it is missing, holds
+    fewer than k entries per query, is older than the embeddings or was
+    scored with another `prefix_dim` or `ann_n_probe`. The gold side array
+    of an exact store is recounted on its own when `gold_rows` changed."""
+    query_emb_path = os.path.join(model_path, 'query_embeddings.npy')
+    section_emb_path = os.path.join(model_path, 'section_embeddings.npy')
+
+    store = load_topk_store(model_path)
+    if store is None or not store.is_current(query_emb_path, section_emb_path,
+                                             k, prefix_dim, ann_n_probe):
+        del store
+        return build_topk_store(model_path, k, gold_rows, device,
+                                memory_budget_mb, prefix_dim, ann_n_probe)
+
+    if gold_rows is not None and (store.gold is None or
+                                  store.meta["gold"] != _gold_signature(
+                                      gold_rows)):
+        if prefix_dim is not None or ann_n_probe is not None:
+            # Approximate gold ranks come from the candidates; rebuild them
+            del store
+            return build_topk_store(model_path, k, gold_rows, device,
+                                    memory_budget_mb, prefix_dim, ann_n_probe)
+        gold_scores, ranks = gold_ranks(load_embeddings(query_emb_path),
+                                        load_embeddings(section_emb_path),
+                                        gold_rows,
+                                        device=device,
+                                        memory_budget_mb=memory_budget_mb)
+        meta = dict(store.meta, gold=_gold_signature(gold_rows))
+        del store
+        _save_atomic(os.path.join(model_path, GOLD_FILE),
+                     make_gold(gold_rows, gold_scores, ranks))
+        _write_meta(model_path, meta)
+        store = TopKStore(model_path)
+    return store
@@ -0,0 +1,821 @@
+import heapq
+import itertools
+import numpy as np
+from collections import namedtuple
+
+# Per-row top-k result of a tiled similarity pass. `ids` and `scores` are
+# sorted by descending score; `row_min`/`row_max` cover the full row so that
+# callers can reproduce the row-wise min-max scaling without the dense matrix.
+# When gold rows are given, `gold_scores` holds each query's raw score with its
+# gold document and `gold_ranks` the number of documents scoring strictly
+# higher (-1 where the gold row is unknown).
+TopKResult = namedtuple(
+    "TopKResult",
+    ["ids", "scores", "row_min", "row_max", "gold_scores", "gold_ranks"],
+    defaults=[None, None])
+
+
+def resolve_device(device="auto"):
+    """Resolve the scoring backend.
+
+    Args:
+        device: "numpy" for NumPy/BLAS, "cpu" or "cuda" (or "cuda:N") for
+            torch, or "auto" to use CUDA when available and NumPy otherwise.
+
+    Returns:
+        The resolved device string.
+    """
+    if device != "auto":
+        return device
+    try:
+        import torch
+    except ImportError:
+        return "numpy"
+    return "cuda" if torch.cuda.is_available() else "numpy"
+
+
+def plan_blocks(n_queries, n_sections, k=0, memory_budget_mb=512):
+    """Pick query/section block sizes so a tile and its top-k merge buffer
+    stay within the memory budget.
+
+    Returns:
+        Tuple (query_block, section_block).
+    """
+    budget = max(1, int(memory_budget_mb * 1024 * 1024))
+    section_block = max(1, min(n_sections, 16384))
+    # Score tile, candidate scores and candidate ids for each query row.
+    bytes_per_row = 4 * section_block + 12 * (section_block + k)
+    query_block = max(1, min(n_queries, budget // bytes_per_row))
+    return query_block, section_block
+
+
+def _validate(query_embeddings, doc_embeddings):
+    if isinstance(query_embeddings, list):
+        query_embeddings = np.array(query_embeddings, dtype=np.float32)
+    if isinstance(doc_embeddings, list):
+        doc_embeddings = np.array(doc_embeddings, dtype=np.float32)
+
+    assert query_embeddings.ndim == 2, "Query embeddings should be a 2D array"
+    assert doc_embeddings.ndim == 2, "Document embeddings should be a 2D array"
+    assert query_embeddings.shape[1] == doc_embeddings.shape[
+        1], "Query and document embeddings must have the same dimension"
+    return query_embeddings, doc_embeddings
+
+
+def _to_block(embeddings, start, end):
+    # Slicing a memory-mapped array only reads the requested rows.
+    return np.ascontiguousarray(embeddings[start:end], dtype=np.float32)
+
+
+def truncate_embeddings(embeddings, dim, chunk_rows=65536):
+    """First `dim` dimensions of every row, re-normalized to unit length
+    (Matryoshka-style truncation), as one contiguous float32 array.
+
+    Rows are read in chunks, so memory-mapped or quantized embeddings are
+    never expanded to a full float32 copy; the result takes `dim / D` of it.
+    """
+    prefix = np.empty((embeddings.shape[0], dim), dtype=np.float32)
+    for start in range(0, embeddings.shape[0], chunk_rows):
+        end = min(start + chunk_rows, embeddings.shape[0])
+        block = np.asarray(embeddings[start:end], dtype=np.float32)[:, :dim]
+        norms = np.linalg.norm(block, axis=1, keepdims=True)
+        prefix[start:end] = block / np.where(norms == 0, 1, norms)
+    return prefix
+
+
+class _NumpyBackend:
+
+    def put(self, block):
+        return block
+
+    def scores(self, query_block, section_block):
+        return query_block @ section_block.T
+
+    def row_min_max(self, scores):
+        return scores.min(axis=1), scores.max(axis=1)
+
+    def row_argmin(self, scores):
+        idx = scores.argmin(axis=1)
+        return scores[np.arange(len(idx)), idx], idx
+
+    def topk(self, scores, k):
+        if k >= scores.shape[1]:
+            idx = np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+            return scores, np.array(idx)
+        idx = np.argpartition(scores, -k, axis=1)[:, -k:]
+        return np.take_along_axis(scores, idx, axis=1), idx
+
+    def count_greater(self, scores, thresholds, exclude_cols):
+        greater = scores > thresholds[:, None]
+        rows = np.flatnonzero((exclude_cols >= 0) &
+                              (exclude_cols < scores.shape[1]))
+        greater[rows, exclude_cols[rows]] = False
+        return greater.sum(axis=1)
+
+    def to_numpy(self, x):
+        return x
+
+
+class _TorchBackend:
+
+    def __init__(self, device):
+        import torch
+        self.torch = torch
+        self.device = torch.device(device)
+
+    def put(self, block):
+        return self.torch.from_numpy(block).to(self.device)
+
+    def scores(self, query_block, section_block):
+        return self.torch.matmul(query_block, section_block.T)
+
+    def row_min_max(self, scores):
+        return (self.to_numpy(scores.min(dim=1).values),
+                self.to_numpy(scores.max(dim=1).values))
+
+    def row_argmin(self, scores):
+        values, idx = scores.min(dim=1)
+        return self.to_numpy(values), self.to_numpy(idx)
+
+    def topk(self, scores, k):
+        # Only the (rows, k) winners are copied back to the host.
+        values, idx = self.torch.topk(scores, min(k, scores.shape[1]), dim=1)
+        return self.to_numpy(values), self.to_numpy(idx)
+
+    def count_greater(self, scores, thresholds, exclude_cols):
+        greater = scores > self.put(thresholds)[:, None]
+        exclude_cols = self.put(exclude_cols)
+        rows = self.torch.nonzero((exclude_cols >= 0) &
+                                  (exclude_cols < scores.shape[1])).flatten()
+        greater[rows, exclude_cols[rows]] = False
+        return self.to_numpy(greater.sum(dim=1))
+
+    def to_numpy(self, x):
+        return x.cpu().numpy()
+
+
+def get_backend(device="auto"):
+    device = resolve_device(device)
+    if device == "numpy":
+        return _NumpyBackend()
+    return _TorchBackend(device)
+
+
+def merge_topk(ids, scores, new_ids, new_scores, k):
+    """Merge two per-row candidate lists and keep the k best of each row."""
+    cand_scores = np.concatenate([scores, new_scores], axis=1)
+    cand_ids = np.concatenate([ids, new_ids], axis=1)
+    if cand_scores.shape[1] > k:
+        keep = np.argpartition(cand_scores, -k, axis=1)[:, -k:]
+        cand_scores = np.take_along_axis(cand_scores, keep, axis=1)
+        cand_ids = np.take_along_axis(cand_ids, keep, axis=1)
+    return cand_ids, cand_scores
+
+
+def sort_topk(ids, scores):
+    """Sort per-row candidates by descending score."""
+    order = np.argsort(-scores, axis=1, kind="stable")
+    ids = np.take_along_axis(ids, order, axis=1)
+    scores = np.take_along_axis(scores, order, axis=1)
+    return ids, scores
+
+
+def _iter_tiles(query_embeddings, doc_embeddings, backend, query_block,
+                doc_block):
+    # Outer loop over documents so each document block is moved to the
+    # device once; query blocks are usually far smaller.
+    n_queries, n_docs = query_embeddings.shape[0], doc_embeddings.shape[0]
+    for d_start in range(0, n_docs, doc_block):
+        d_end = min(d_start + doc_block, n_docs)
+        docs = backend.put(_to_block(doc_embeddings, d_start, d_end))
+        for q_start in range(0, n_queries, query_block):
+            q_end = min(q_start + query_block, n_queries)
+            queries = backend.put(_to_block(query_embeddings, q_start, q_end))
+            yield d_start, q_start, q_end, backend.scores(queries, docs)
+
+
+def gold_similarity(query_embeddings, doc_embeddings, gold_rows):
+    """Raw score of each query with its gold document (NaN if unknown)."""
+    gold_rows = np.asarray(gold_rows, dtype=np.int64)
+    gold_scores = np.full(len(gold_rows), np.nan, dtype=np.float32)
+    valid = np.flatnonzero(gold_rows >= 0)
+    if len(valid):
+        queries = np.asarray(query_embeddings[valid], dtype=np.float32)
+        docs = np.asarray(doc_embeddings[gold_rows[valid]], dtype=np.float32)
+        gold_scores[valid] = np.einsum("ij,ij->i", queries, docs)
+    return gold_scores
+
+
+def topk_similarity(query_embeddings,
+                    doc_embeddings,
+                    k,
+                    device="auto",
+                    memory_budget_mb=512,
+                    gold_rows=None):
+    """Compute per-query top-k dot-product scores without building the full
+    query x document matrix.
+
+    Documents are scored block by block under `memory_budget_mb`; each block
+    is reduced to its top-k on the scoring device and merged into a running
+    top-k on the host. The row-wise minimum and maximum over all documents
+    are tracked along the way so scores can be min-max scaled afterwards with
+    `min_max_scale`.
+
+    Args:
+        query_embeddings: (Q, D) array, list or memory-mapped array
+        doc_embeddings: (S, D) array, list or memory-mapped array
+        k: Number of top documents to keep per query
+        device: Scoring backend, see `resolve_device`
+        memory_budget_mb: Approximate memory budget for one score tile
+        gold_rows: Optional (Q,) gold document row per query (-1 if unknown).
+            When given, the exact rank of every gold document is counted in
+            the same pass.
+
+    Returns:
+        TopKResult with (Q, min(k, S)) `ids`/`scores` sorted by descending
+        raw score and (Q,) `row_min`/`row_max` raw scores.
+    """
+    if k < 1:
+        raise ValueError(f"k must be at least 1, got {k}")
+    query_embeddings, doc_embeddings = _validate(query_embeddings,
+                                                 doc_embeddings)
+    n_queries, n_docs = query_embeddings.shape[0], doc_embeddings.shape[0]
+    k = min(k, n_docs)
+    backend = get_backend(device)
+    query_block, doc_block = plan_blocks(n_queries, n_docs, k, memory_budget_mb)
+
+    ids = np.full((n_queries, k), -1, dtype=np.int64)
+    scores = np.full((n_queries, k), -np.inf, dtype=np.float32)
+    row_min = np.full(n_queries, np.inf, dtype=np.float32)
+    row_max = np.full(n_queries, -np.inf, dtype=np.float32)
+    gold_scores = gold_ranks = None
+    if gold_rows is not None:
+        gold_rows = np.asarray(gold_rows, dtype=np.int64)
+        gold_scores = gold_similarity(query_embeddings, doc_embeddings,
+                                      gold_rows)
+        gold_ranks = np.zeros(n_queries, dtype=np.int64)
+
+    for d_start, q_start, q_end, block in _iter_tiles(query_embeddings,
+                                                      doc_embeddings, backend,
+                                                      query_block, doc_block):
+        rows = slice(q_start, q_end)
+        block_min, block_max = backend.row_min_max(block)
+        np.minimum(row_min[rows], block_min, out=row_min[rows])
+        np.maximum(row_max[rows], block_max, out=row_max[rows])
+
+        block_scores, block_ids = backend.topk(block, k)
+        ids[rows], scores[rows] = merge_topk(
+            ids[rows], scores[rows],
+            block_ids.astype(np.int64) + d_start,
+            block_scores.astype(np.float32), k)
+
+        if gold_rows is not None:
+            # The gold column itself is excluded so that rounding differences
+            # between the tile and the gathered gold score cannot count it.
+            gold_ranks[rows] += backend.count_greater(block, gold_scores[rows],
+                                                      gold_rows[rows] - d_start)
+
+    if gold_rows is not None:
+        gold_ranks[gold_rows < 0] = -1
+
+    ids, scores = sort_topk(ids, scores)
+    return TopKResult(ids, scores, row_min, row_max, gold_scores, gold_ranks)
+
+
+def rescore_candidates(query_embeddings,
+                       doc_embeddings,
+                       candidate_ids,
+                       memory_budget_mb=512):
+    """Exact scores of every query with its candidate documents.
+
+    Args:
+        query_embeddings: (Q, D) array, list or memory-mapped array
+        doc_embeddings: (S, D) array, list or memory-mapped array
+        candidate_ids: (Q, C) document rows per query, -1 for none
+        memory_budget_mb: Approximate memory budget for one gathered block
+
+    Returns:
+        (Q, C) float32 scores, -inf where the candidate id is -1.
+    """
+    candidate_ids = np.asarray(candidate_ids, dtype=np.int64)
+    n_queries, n_candidates = candidate_ids.shape
+    scores = np.full(candidate_ids.shape, -np.inf, dtype=np.float32)
+    # Small gathered blocks stay cache-friendly; the gather is memory-bound
+    budget = min(memory_budget_mb, 16) * 1024 * 1024
+    row_bytes = 4 * max(1, n_candidates) * doc_embeddings.shape[1]
+    block = max(1, int(budget) // row_bytes)
+    for start in range(0, n_queries, block):
+        end = min(start + block, n_queries)
+        ids = candidate_ids[start:end]
+        docs = np.asarray(doc_embeddings[np.maximum(ids, 0)], dtype=np.float32)
+        queries = _to_block(query_embeddings, start, end)
+        block_scores = np.matmul(docs, queries[:, :, None])[..., 0]
+        scores[start:end] = np.where(ids >= 0, block_scores, -np.inf)
+    return scores
+
+
+def two_stage_topk_similarity(query_embeddings,
+                              doc_embeddings,
+                              k,
+                              prefix_dim,
+                              shortlist=None,
+                              device="auto",
+                              memory_budget_mb=512,
+                              gold_rows=None):
+    """Top-k similarity with a truncated-dimension first pass.
+
+    For Matryoshka-style embeddings, whose leading dimensions carry most of
+    the signal. Every document is scored on re-normalized `prefix_dim`
+    prefixes to shortlist `shortlist` candidates per query, plus the
+    lowest-scoring document; only those are re-scored at full dimension.
+
+    The top-k is exact whenever the full-dimension top-k is inside the
+    shortlist. `row_max` and `row_min` are the extremes of the re-scored
+    candidates and the gold score, and a gold rank counts the shortlisted
+    documents scoring above the gold document, so a gold document outside
+    the shortlist is ranked at most at the shortlist size.
+
+    Args:
+        query_embeddings: (Q, D) array, list or memory-mapped array
+        doc_embeddings: (S, D) array, list or memory-mapped array
+        k: Number of top documents to keep per query
+        prefix_dim: Dimensions scored in the first pass
+        shortlist: Candidates re-scored per query (default 4 * k)
+        device: Scoring backend for the first pass, see `resolve_device`
+        memory_budget_mb: Approximate memory budget for one score tile
+        gold_rows: Optional (Q,) gold document row per query (-1 if unknown)
+
+    Returns:
+        TopKResult, as `topk_similarity`.
+    """
+    if k < 1:
+        raise ValueError(f"k must be at least 1, got {k}")
+    query_embeddings, doc_embeddings = _validate(query_embeddings,
+                                                 doc_embeddings)
+    n_queries, n_docs = query_embeddings.shape[0], doc_embeddings.shape[0]
+    if prefix_dim >= query_embeddings.shape[1]:
+        return topk_similarity(query_embeddings, doc_embeddings, k, device,
+                               memory_budget_mb, gold_rows)
+    k = min(k, n_docs)
+    shortlist = min(max(shortlist or 4 * k, k), n_docs)
+
+    # Stage 1: shortlist on the truncated vectors
+    query_prefix = truncate_embeddings(query_embeddings, prefix_dim)
+    doc_prefix = truncate_embeddings(doc_embeddings, prefix_dim)
+    backend = get_backend(device)
+    query_block, doc_block = plan_blocks(n_queries, n_docs, shortlist,
+                                         memory_budget_mb)
+    top_ids = np.full((n_queries, shortlist), -1, dtype=np.int64)
+    top_scores = np.full((n_queries, shortlist), -np.inf, dtype=np.float32)
+    low_ids = np.zeros(n_queries, dtype=np.int64)
+    low_scores = np.full(n_queries, np.inf, dtype=np.float32)
+    for d_start, q_start, q_end, block in _iter_tiles(query_prefix, doc_prefix,
+                                                      backend, query_block,
+                                                      doc_block):
+        rows = slice(q_start, q_end)
+        block_scores, block_ids = backend.topk(block, shortlist)
+        top_ids[rows], top_scores[rows] = merge_topk(
+            top_ids[rows], top_scores[rows],
+            block_ids.astype(np.int64) + d_start,
+            block_scores.astype(np.float32), shortlist)
+        block_min, block_argmin = backend.row_argmin(block)
+        lower = block_min < low_scores[rows]
+        low_scores[rows] = np.where(lower, block_min, low_scores[rows])
+        low_ids[rows] = np.where(lower, block_argmin + d_start, low_ids[rows])
+    del query_prefix, doc_prefix
+
+    # Stage 2: exact scores for the candidates only
+    scores = rescore_candidates(query_embeddings, doc_embeddings, top_ids,
+                                memory_budget_mb)
+    low = rescore_candidates(query_embeddings, doc_embeddings, low_ids[:, None],
+                             memory_budget_mb)[:, 0]
+    row_max = scores.max(axis=1)
+    row_min = np.minimum(low, scores.min(axis=1))
+
+    gold_scores = gold_ranks = None
+    if gold_rows is not None:
+        gold_rows = np.asarray(gold_rows, dtype=np.int64)
+        gold_scores = gold_similarity(query_embeddings, doc_embeddings,
+                                      gold_rows)
+        above = scores > gold_scores[:, None]
+        above &= top_ids != gold_rows[:, None]
+        gold_ranks = above.sum(axis=1).astype(np.int64)
+        gold_ranks[gold_rows < 0] = -1
+        known = gold_rows >= 0
+        row_max[known] = np.maximum(row_max[known], gold_scores[known])
+        row_min[known] = np.minimum(row_min[known], gold_scores[known])
+
+    ids, scores = sort_topk(top_ids, scores)
+    return TopKResult(ids[:, :k], scores[:, :k], row_min, row_max, gold_scores,
+                      gold_ranks)
+
+
+def gold_ranks(query_embeddings,
+               doc_embeddings,
+               gold_rows,
+               device="auto",
+               memory_budget_mb=512):
+    """Rank of each query's gold document, counted as the number of documents
+    scoring strictly higher, without building the full matrix.
+
+    Returns:
+        Tuple (gold_scores, gold_ranks) of raw gold scores (NaN if unknown)
+        and int64 ranks (-1 if unknown).
+    """
+    query_embeddings, doc_embeddings = _validate(query_embeddings,
+                                                 doc_embeddings)
+    n_queries, n_docs = query_embeddings.shape[0], doc_embeddings.shape[0]
+    backend = get_backend(device)
+    query_block, doc_block = plan_blocks(n_queries, n_docs, 0, memory_budget_mb)
+
+    gold_rows = np.asarray(gold_rows, dtype=np.int64)
+    gold_scores = gold_similarity(query_embeddings, doc_embeddings, gold_rows)
+    ranks = np.zeros(n_queries, dtype=np.int64)
+    for d_start, q_start, q_end, block in _iter_tiles(query_embeddings,
+                                                      doc_embeddings, backend,
+                                                      query_block, doc_block):
+        ranks[q_start:q_end] += backend.count_greater(
+            block, gold_scores[q_start:q_end],
+            gold_rows[q_start:q_end] - d_start)
+    ranks[gold_rows < 0] = -1
+    return gold_scores, ranks
+
+
+def _scale_columns(row_min, row_max):
+    row_min = np.asarray(row_min, dtype=np.float32)[:, None]
+    row_range = np.asarray(row_max, dtype=np.float32)[:, None] - row_min
+    return row_min, np.where(row_range == 0, 1, row_range).astype(np.float32)
+
+
+def _iter_average_tiles(model_embeddings, model_row_stats, backend,
+                        memory_budget_mb):
+    # Yields (q_start, q_end, d_start, tile) where `tile` is the min-max
+    # scaled score tile averaged across models, still on the backend device.
+    n_models = len(model_embeddings)
+    n_queries, n_docs = (model_embeddings[0][0].shape[0],
+                         model_embeddings[0][1].shape[0])
+    query_block, doc_block = plan_blocks(n_queries, n_docs, 0,
+                                         memory_budget_mb / 2)
+    for q_start in range(0, n_queries, query_block):
+        q_end = min(q_start + query_block, n_queries)
+        query_blocks, offsets, scales = [], [], []
+        for (queries, _), (row_min, row_max) in zip(model_embeddings,
+                                                    model_row_stats):
+            # Scaled tiles are pre-divided by the model count so that their
+            # sum is the average.
+            offset, scale = _scale_columns(row_min[q_start:q_end],
+                                           row_max[q_start:q_end])
+            query_blocks.append(backend.put(_to_block(queries, q_start, q_end)))
+            offsets.append(backend.put(offset))
+            scales.append(backend.put(scale * n_models))
+
+        for d_start in range(0, n_docs, doc_block):
+            d_end = min(d_start + doc_block, n_docs)
+            accumulator = None
+            for m, (_, docs) in enumerate(model_embeddings):
+                tile = backend.scores(
+                    query_blocks[m],
+                    backend.put(_to_block(docs, d_start, d_end)))
+                tile = (tile - offsets[m]) / scales[m]
+                accumulator = tile if accumulator is None else accumulator + tile
+            yield q_start, q_end, d_start, accumulator
+
+
+def average_gold_ranks(model_embeddings,
+                       model_row_stats,
+                       gold_rows,
+                       device="auto",
+                       memory_budget_mb=512):
+    """Gold scores and ranks on min-max scaled scores averaged across models.
+
+    The average is built tile by tile in a float32 accumulator, so only one
+    (query block x document block) tile per model is ever resident, and
+    embeddings may be memory-mapped.
+
+    Args:
+        model_embeddings: List of (query_embeddings, doc_embeddings) per model
+        model_row_stats: List of (row_min, row_max) raw score arrays per model
+        gold_rows: (Q,) gold document row per query, -1 if unknown
+        device: Scoring backend, see `resolve_device`
+        memory_budget_mb: Approximate memory budget for one tile
+
+    Returns:
+        Tuple (gold_scores, gold_ranks) of averaged scaled gold scores and
+        int64 ranks (-1 if unknown).
+    """
+    model_embeddings = [_validate(q, d) for q, d in model_embeddings]
+    n_models = len(model_embeddings)
+    n_queries = model_embeddings[0][0].shape[0]
+    backend = get_backend(device)
+
+    gold_rows = np.asarray(gold_rows, dtype=np.int64)
+    gold_scores = np.zeros(n_queries, dtype=np.float32)
+    for (queries, docs), (row_min, row_max) in zip(model_embeddings,
+                                                   model_row_stats):
+        gold_scores += min_max_scale(gold_similarity(queries, docs, gold_rows),
+                                     row_min, row_max)
+    gold_scores /= n_models
+
+    ranks = np.zeros(n_queries, dtype=np.int64)
+    for q_start, q_end, d_start, tile in _iter_average_tiles(
+            model_embeddings, model_row_stats, backend, memory_budget_mb):
+        ranks[q_start:q_end] += backend.count_greater(
+            tile, gold_scores[q_start:q_end],
+            gold_rows[q_start:q_end] - d_start)
+
+    ranks[gold_rows < 0] = -1
+    gold_scores[gold_rows < 0] = np.nan
+    return gold_scores, ranks
+
+
+def iter_average_similarity_pairs(model_embeddings,
+                                  model_row_stats,
+                                  threshold,
+                                  device="auto",
+                                  memory_budget_mb=512):
+    """Yield, one score tile at a time, the sparse (row, column) pairs whose
+    averaged min-max scaled score reaches `threshold`. The diagonal is
+    skipped, which suits self-similarity searches where queries and
+    documents are the same set. Consumers that fold each tile's pairs away
+    (e.g. into a `UnionFind`) keep memory independent of the pair count.
+
+    Yields:
+        Tuples (rows, cols, weights) of int64, int64 and float32 arrays.
+    """
+    model_embeddings = [_validate(q, d) for q, d in model_embeddings]
+    backend = get_backend(device)
+    for q_start, q_end, d_start, tile in _iter_average_tiles(
+            model_embeddings, model_row_stats, backend, memory_budget_mb):
+        tile = backend.to_numpy(tile)
+        tile_rows, tile_cols = np.nonzero(tile >= threshold)
+        tile_weights = tile[tile_rows, tile_cols]
+        tile_rows = tile_rows.astype(np.int64) + q_start
+        tile_cols = tile_cols.astype(np.int64) + d_start
+        off_diagonal = tile_rows != tile_cols
+        yield (tile_rows[off_diagonal], tile_cols[off_diagonal],
+               tile_weights[off_diagonal].astype(np.float32))
+
+
+def average_similarity_pairs(model_embeddings,
+                             model_row_stats,
+                             threshold,
+                             device="auto",
+                             memory_budget_mb=512):
+    """All pairs of `iter_average_similarity_pairs`, concatenated.
+
+    Returns:
+        Tuple (rows, cols, weights) of int64, int64 and float32 arrays.
+    """
+    rows, cols, weights = [np.empty(0, np.int64)], [np.empty(0, np.int64)], [
+        np.empty(0, np.float32)
+    ]
+    for tile_rows, tile_cols, tile_weights in iter_average_similarity_pairs(
+            model_embeddings, model_row_stats, threshold, device,
+            memory_budget_mb):
+        rows.append(tile_rows)
+        cols.append(tile_cols)
+        weights.append(tile_weights)
+    return np.concatenate(rows), np.concatenate(cols), np.concatenate(weights)
+
+
+def average_similarity_dense(model_embeddings,
+                             model_row_stats,
+                             device="auto",
+                             memory_budget_mb=512):
+    """Dense averaged min-max scaled scores of a (small) query set against
+    all documents, assembled from the same tiles as the sparse variants.
+
+    Returns:
+        (Q, S) float32 array.
+    """
+    model_embeddings = [_validate(q, d) for q, d in model_embeddings]
+    backend = get_backend(device)
+    n_queries, n_docs = (model_embeddings[0][0].shape[0],
+                         model_embeddings[0][1].shape[0])
+    dense = np.empty((n_queries, n_docs), dtype=np.float32)
+    for q_start, q_end, d_start, tile in _iter_average_tiles(
+            model_embeddings, model_row_stats, backend, memory_budget_mb):
+        tile = backend.to_numpy(tile)
+        dense[q_start:q_end, d_start:d_start + tile.shape[1]] = tile
+    return dense
+
+
+def average_similarity_group_sums(model_embeddings,
+                                  model_row_stats,
+                                  labels,
+                                  device="auto",
+                                  memory_budget_mb=512):
+    """For every row, the sum of its averaged min-max scaled scores with all
+    other columns carrying the same group label (diagonal excluded).
+
+    Returns:
+        (Q,) float64 array of within-group score sums.
+    """
+    model_embeddings = [_validate(q, d) for q, d in model_embeddings]
+    backend = get_backend(device)
+    labels = np.asarray(labels)
+    sums = np.zeros(len(labels), dtype=np.float64)
+    for q_start, q_end, d_start, tile in _iter_average_tiles(
+            model_embeddings, model_row_stats, backend, memory_budget_mb):
+        tile = backend.to_numpy(tile)
+        d_end = d_start + tile.shape[1]
+        same_group = labels[q_start:q_end, None] == labels[None, d_start:d_end]
+        diagonal = (np.arange(q_start,
+                              q_end)[:, None] == np.arange(d_start,
+                                                           d_end)[None, :])
+        sums[q_start:q_end] += np.where(same_group & ~diagonal, tile,
+                                        0).sum(axis=1)
+    return sums
+
+
+def union_average_gold_ranks(model_embeddings,
+                             model_row_stats,
+                             model_topk_ids,
+                             gold_rows,
+                             memory_budget_mb=512):
+    """Like `average_gold_ranks`, but only the documents that appear in some
+    model's top-k list (plus the gold document) are averaged and ranked.
+
+    This scores Q x (M * k) pairs instead of Q x S. A document outside every
+    model's top-k is assumed not to outrank the gold document on the
+    average, so ranks are exact whenever that holds.
+
+    Args:
+        model_topk_ids: List of (Q, k) top-k document ids per model
+
+    Returns:
+        Tuple (gold_scores, gold_ranks) as in `average_gold_ranks`.
+    """
+    n_models = len(model_embeddings)
+    gold_rows = np.asarray(gold_rows, dtype=np.int64)
+    n_queries = len(gold_rows)
+    dim = max(np.shape(docs)[1] for _, docs in model_embeddings)
+    n_candidates = sum(np.shape(ids)[1] for ids in model_topk_ids) + 1
+    budget = max(1, int(memory_budget_mb * 1024 * 1024))
+    query_block = max(1, min(n_queries, budget // (8 * n_candidates * dim)))
+
+    gold_scores = np.full(n_queries, np.nan, dtype=np.float32)
+    ranks = np.full(n_queries, -1, dtype=np.int64)
+    for q_start in range(0, n_queries, query_block):
+        q_end = min(q_start + query_block, n_queries)
+        block_gold = np.maximum(gold_rows[q_start:q_end], 0)
+        # Candidate set per row: all top-k ids and the gold row, sorted so
+        # that duplicates are adjacent and can be masked out.
+        candidates = np.concatenate(
+            [np.asarray(ids[q_start:q_end]) for ids in model_topk_ids] +
+            [block_gold[:, None]],
+            axis=1).astype(np.int64)
+        candidates.sort(axis=1)
+        duplicate = np.zeros(candidates.shape, dtype=bool)
+        duplicate[:, 1:] = candidates[:, 1:] == candidates[:, :-1]
+
+        unique_ids, inverse = np.unique(candidates, return_inverse=True)
+        inverse = inverse.reshape(candidates.shape)
+
+        average = np.zeros(candidates.shape, dtype=np.float32)
+        for (queries, docs), (row_min, row_max) in zip(model_embeddings,
+                                                       model_row_stats):
+            query_rows = _to_block(queries, q_start, q_end)
+            doc_rows = np.asarray(docs[unique_ids], dtype=np.float32)
+            scores = np.einsum("qd,qcd->qc", query_rows, doc_rows[inverse])
+            average += min_max_scale(scores, row_min[q_start:q_end],
+                                     row_max[q_start:q_end])
+        average /= n_models
+
+        is_gold = (candidates == block_gold[:, None]) & ~duplicate
+        block_gold_scores = average[is_gold]
+        greater = (average > block_gold_scores[:, None]) & ~duplicate & ~is_gold
+        gold_scores[q_start:q_end] = block_gold_scores
+        ranks[q_start:q_end] = greater.sum(axis=1)
+
+    ranks[gold_rows < 0] = -1
+    gold_scores[gold_rows < 0] = np.nan
+    return gold_scores, ranks
+
+
+def dense_gold_ranks(scores, gold_rows, block_rows=4096):
+    """Gold scores and ranks from an already materialized (Q, S) score
+    matrix, counted over row blocks.
+
+    Returns:
+        Tuple (gold_scores, gold_ranks) as in `gold_ranks`.
+    """
+    gold_rows = np.asarray(gold_rows, dtype=np.int64)
+    n_queries = scores.shape[0]
+    gold_scores = np.full(n_queries, np.nan, dtype=np.float32)
+    ranks = np.full(n_queries, -1, dtype=np.int64)
+    backend = _NumpyBackend()
+    for start in range(0, n_queries, block_rows):
+        end = min(start + block_rows, n_queries)
+        block = np.asarray(scores[start:end])
+        block_gold = gold_rows[start:end]
+        valid = np.flatnonzero(block_gold >= 0)
+        gold_scores[start + valid] = block[valid, block_gold[valid]]
+        counts = backend.count_greater(block, gold_scores[start:end],
+                                       block_gold)
+        ranks[start + valid] = counts[valid]
+    return gold_scores, ranks
+
+
+def heap_merge_topk(results, k):
+    """Merge per-shard top-k results into one global top-k per query.
+
+    Each input must cover the same queries, hold global document ids and be
+    sorted by descending raw score (as returned by `topk_similarity`). Rows
+    are merged with a k-way heap merge, so the cost per query is
+    O(k log n_shards) regardless of shard sizes.
+
+    Returns:
+        TopKResult over all shards; `row_min`/`row_max` span every shard.
+    """
+    n_queries = results[0].ids.shape[0]
+    k = min(k, sum(result.ids.shape[1] for result in results))
+    ids = np.full((n_queries, k), -1, dtype=np.int64)
+    scores = np.full((n_queries, k), -np.inf, dtype=np.float32)
+    for row in range(n_queries):
+        shard_rows = [
+            zip(result.scores[row].tolist(), result.ids[row].tolist())
+            for result in results
+        ]
+        merged = heapq.merge(*shard_rows,
+                             key=lambda item: item[0],
+                             reverse=True)
+        for col, (score, doc_id) in enumerate(itertools.islice(merged, k)):
+            scores[row, col] = score
+            ids[row, col] = doc_id
+    row_min = np.min([result.row_min for result in results], axis=0)
+    row_max = np.max([result.row_max for result in results], axis=0)
+    return TopKResult(ids, scores, row_min, row_max)
+
+
+def iter_similarity_blocks(query_embeddings,
+                           doc_embeddings,
+                           device="auto",
+                           memory_budget_mb=512):
+    """Yield full-width raw score blocks one query block at a time.
+
+    Yields:
+        Tuple (q_start, q_end, scores) where `scores` is a float32
+        (q_end - q_start, S) NumPy array.
+    """
+    query_embeddings, doc_embeddings = _validate(query_embeddings,
+                                                 doc_embeddings)
+    n_queries, n_docs = query_embeddings.shape[0], doc_embeddings.shape[0]
+    backend = get_backend(device)
+    budget = max(1, int(memory_budget_mb * 1024 * 1024))
+    query_block = max(1, min(n_queries, budget // (8 * max(1, n_docs))))
+    docs = backend.put(_to_block(doc_embeddings, 0, n_docs))
+    for q_start in range(0, n_queries, query_block):
+        q_end = min(q_start + query_block, n_queries)
+        queries = backend.put(_to_block(query_embeddings, q_start, q_end))
+        yield q_start, q_end, backend.to_numpy(backend.scores(queries, docs))
+
+
+def min_max_scale(scores, row_min, row_max):
+    """Apply row-wise min-max scaling with precomputed row statistics.
+
+    Works on full rows as well as on top-k rows or single gathered scores,
+    as long as `row_min`/`row_max` broadcast against `scores`.
+    """
+    row_min = np.asarray(row_min, dtype=np.float32)
+    row_max = np.asarray(row_max, dtype=np.float32)
+    if np.ndim(scores) == 2:
+        row_min, row_max = row_min[:, None], row_max[:, None]
+    # Where range is 0, set it to 1 to avoid division by zero
+    range_vals = row_max - row_min
+    range_vals = np.where(range_vals == 0, 1, range_vals)
+    return (np.asarray(scores, dtype=np.float32) - row_min) / range_vals
+
+
+def dense_similarity(query_embeddings,
+                     doc_embeddings,
+                     device="auto",
+                     memory_budget_mb=512):
+    """Row-wise min-max scaled similarity matrix, computed in query blocks
+    into a single preallocated float32 output."""
+    query_embeddings, doc_embeddings = _validate(query_embeddings,
+                                                 doc_embeddings)
+    out = np.empty((query_embeddings.shape[0], doc_embeddings.shape[0]),
+                   dtype=np.float32)
+    for q_start, q_end, block in iter_similarity_blocks(query_embeddings,
+                                                        doc_embeddings, device,
+                                                        memory_budget_mb):
+        out[q_start:q_end] = min_max_scale(block, block.min(axis=1),
+                                           block.max(axis=1))
+    return out
+
+
+def similarity_gpu(query_embeddings, doc_embeddings, device="auto"):
+    """Row-wise min-max scaled similarity matrix.
+
+    Runs on CUDA when available and falls back to NumPy/BLAS otherwise. The
+    matrix is scored in query blocks into a float32 output, so the device
+    never holds more than one block of scores. Prefer `topk_similarity` when
+    only the best matches per query are needed.
+    """
+    return dense_similarity(query_embeddings, doc_embeddings, device=device)
+
+
+def similarity(query_embeddings, doc_embeddings):
+    return dense_similarity(query_embeddings, doc_embeddings,
+                            device="numpy").tolist()
@@ -1,4 +1,5 @@
 import os
+from openragbench.models.autotune import BatchSizeTuner
 from openragbench.models.query_evaluator import DocumentRelevanceFilter
 
 if __name__ == "__main__":
@@ -6,8 +7,14 @@ if __name__ == "__main__":
     output_dir = "data/final/pdf/arxiv/embeddings"
     corpus_path = os.path.join(input_dir, "corpus")
     queries_path = os.path.join(input_dir, "queries.json")
+    cache_dir = os.path.join(input_dir, "embedding_cache")
     os.makedirs(output_dir, exist_ok=True)
 
-    model = DocumentRelevanceFilter()
-    model.compute_query_embeddings(queries_path, output_dir)
-    model.compute_section_embeddings(corpus_path, output_dir)
\ No newline at end of file
+    # Batch sizes are calibrated once per machine and cached
+    model = DocumentRelevanceFilter(cache_dir=cache_dir,
+                                    batch_tuner=BatchSizeTuner())
+    # Load every encoder once for both queries and sections
+    model.compute_all_embeddings(output_dir,
+                                 query_path=queries_path,
+                                 corpus_path=corpus_path,
+                                 roles=("query", "section"))
\ No newline at end of file
@@ -1,25 +1,118 @@
 import os
 import json
+import hashlib
 import argparse
 import random
 import numpy as np
 
 from openragbench.utils import read_json, write_json
-from openragbench.models.encoders import similarity_gpu
+from openragbench.models.ann_index import get_ivf_index
+from openragbench.models.id_maps import load_query_id_map, load_section_index
+from openragbench.models.quantization import load_embeddings
+from openragbench.models.scoring import (TopKResult, heap_merge_topk,
+                                         topk_similarity,
+                                         two_stage_topk_similarity)
 
 
-def find_hard_negatives(input_dir, k):
-    # Load the data
-    query_embeddings = np.load(
-        os.path.join(input_dir, 'StellaEncoder/query_embeddings.npy'))
-    section_embeddings = np.load(
-        os.path.join(input_dir, 'StellaEncoder/section_embeddings.npy'))
+def list_corpus_shards(input_dir, encoder_name):
+    """List the corpus shards to mine hard negatives from.
 
-    with open(os.path.join(input_dir, 'query_id_to_index.json'), 'r') as f:
-        query_id_to_index = json.load(f)
+    The main corpus (`<input_dir>/<encoder_name>/section_embeddings.npy`) is
+    the base shard and uses global section ids 0..S-1. Each folder in
+    `<input_dir>/shards/` is an extra shard holding
+    `<encoder_name>/section_embeddings.npy` and `section_rows.npy`, the global
+    section index (as in section_id_to_index.json) of each embedding row.
 
-    with open(os.path.join(input_dir, 'section_id_to_index.json'), 'r') as f:
-        section_id_to_index = json.load(f)
+    Returns:
+        List of (shard_name, embeddings_dir, section_rows_path or None)
+    """
+    shards = []
+    base_dir = os.path.join(input_dir, encoder_name)
+    if os.path.exists(os.path.join(base_dir, 'section_embeddings.npy')):
+        shards.append(('base', base_dir, None))
+
+    shards_dir = os.path.join(input_dir, 'shards')
+    if os.path.isdir(shards_dir):
+        for shard_name in sorted(os.listdir(shards_dir)):
+            shard_path = os.path.join(shards_dir, shard_name)
+            embeddings_dir = os.path.join(shard_path, encoder_name)
+            if os.path.exists(
+                    os.path.join(embeddings_dir, 'section_embeddings.npy')):
+                shards.append((shard_name, embeddings_dir,
+                               os.path.join(shard_path, 'section_rows.npy')))
+    return shards
+
+
+def score_shard(embeddings_dir,
+                section_rows_path,
+                query_embeddings,
+                query_indices,
+                k,
+                prefix_dim=None,
+                ann_n_probe=None):
+    """Top-k sections of one shard for the given queries, with global ids.
+
+    Results are cached in the shard folder and reused as long as the queries
+    and their embeddings, k, `prefix_dim`, `ann_n_probe` and the shard's embeddings are unchanged,
+    so adding a shard never rescores the existing ones. With `prefix_dim` the
+    shard is shortlisted on truncated embeddings and only the shortlist is
+    re-scored at full dimension; with `ann_n_probe` candidates come from the
+    shard's IVF index and are re-scored exactly.
+    """
+    section_emb_path = os.path.join(embeddings_dir, 'section_embeddings.npy')
+    stat = os.stat(section_emb_path)
+    settings = (f"{k}:{prefix_dim}:{ann_n_probe}:"
+                f"{stat.st_size}:{stat.st_mtime_ns}")
+    # The query embeddings themselves are hashed, since the query file can be
+    # rewritten with new vectors of the same shape
+    digest = hashlib.sha1(np.asarray(query_indices, dtype=np.int64).tobytes())
+    query_embeddings = np.ascontiguousarray(query_embeddings)
+    digest.update(f"{query_embeddings.dtype}{query_embeddings.shape}".encode())
+    digest.update(query_embeddings.tobytes())
+    digest.update(settings.encode())
+    key = digest.hexdigest()
+
+    cache_path = os.path.join(embeddings_dir, 'subset_topk.npz')
+    if os.path.exists(cache_path):
+        cached = np.load(cache_path)
+        if str(cached['key']) == key:
+            return TopKResult(cached['ids'], cached['scores'],
+                              cached['row_min'], cached['row_max'])
+
+    section_embeddings = load_embeddings(section_emb_path)
+    if ann_n_probe is not None:
+        result = get_ivf_index(embeddings_dir).search(
+            query_embeddings, k, ann_n_probe, doc_embeddings=section_embeddings)
+    elif prefix_dim is None:
+        result = topk_similarity(query_embeddings, section_embeddings, k)
+    else:
+        result = two_stage_topk_similarity(query_embeddings, section_embeddings,
+                                           k, prefix_dim)
+    if section_rows_path is not None:
+        # Map shard-local rows to global section ids
+        section_rows = np.load(section_rows_path)
+        result = result._replace(ids=section_rows[result.ids])
+
+    np.savez(cache_path,
+             key=key,
+             ids=result.ids,
+             scores=result.scores,
+             row_min=result.row_min,
+             row_max=result.row_max)
+    return result
+
+
+def find_hard_negatives(input_dir,
+                        k,
+                        encoder_name='StellaEncoder',
+                        prefix_dim=None,
+                        ann_n_probe=None):
+    # Load the query embeddings memory-mapped; only the subset rows are read
+    query_embeddings = load_embeddings(
+        os.path.join(input_dir, encoder_name, 'query_embeddings.npy'))
+
+    query_id_map = load_query_id_map(input_dir)
+    section_index = load_section_index(input_dir)
 
     # Load the subset of query IDs
     queries_subset_path = os.path.join(input_dir, 'queries_subset.json')
@@ -29,104 +122,47 @@ def find_hard_negatives(input_dir, k):
     print(f"Loaded subset of {len(query_ids_subset)} query IDs to process")
 
     # Get the indices for the subset of queries
-    query_indices_to_process = []
-    for query_id, query_idx in query_id_to_index.items():
-        if query_id in query_ids_subset:
-            query_indices_to_process.append(query_idx)
+    query_rows = query_id_map.rows_of(sorted(query_ids_subset))
+    query_indices_to_process = np.unique(query_rows[query_rows >= 0]).tolist()
 
     print(
         f"Found {len(query_indices_to_process)} corresponding query indices to process"
     )
 
-    # Check if similarity matrix is already computed and saved
-    similarity_matrix_path = os.path.join(input_dir, 'similarity_matrix.npy')
-    similarity_matrix_2_path = os.path.join(input_dir,
-                                            'similarity_matrix_2.npy')
-
-    # Process each query row-by-row instead of loading entire matrices
-    if not os.path.exists(similarity_matrix_path):
-        print("Computing similarity matrix...")
-        similarity_matrix = similarity_gpu(query_embeddings, section_embeddings)
-        np.save(similarity_matrix_path, similarity_matrix)
-        print("Similarity matrix saved for future use.")
-
-    # Check if second similarity matrix exists
-    has_matrix_2 = os.path.exists(similarity_matrix_2_path)
-    if has_matrix_2:
-        print(
-            "Second similarity matrix found. Will process with both matrices.")
-    else:
-        print("No second similarity matrix found. Using only the first matrix.")
-
-    # Initialize memory-mapped arrays for reading
-    sim_matrix_1 = np.load(similarity_matrix_path, mmap_mode='r')
-    sim_matrix_2 = np.load(similarity_matrix_2_path,
-                           mmap_mode='r') if has_matrix_2 else None
-
-    # Process only the subset of queries to find relevant section indices
-    relevant_section_indices = set()
-
+    # Score only the subset rows against each corpus shard, streaming section
+    # blocks into a top-k accumulator; no similarity matrix is ever built
+    shards = list_corpus_shards(input_dir, encoder_name)
+    if not shards:
+        raise FileNotFoundError(
+            f"No section embeddings found for {encoder_name} in {input_dir}")
     print(
-        f"Processing {len(query_indices_to_process)} queries from the subset to find top-{k} sections..."
+        f"Processing {len(query_indices_to_process)} queries from the subset to find top-{k} sections in {len(shards)} shard(s)..."
     )
-    for i, query_idx in enumerate(query_indices_to_process):
-        if i % 100 == 0:
-            print(f"Processing query {i}/{len(query_indices_to_process)}...")
-
-        # Get current query's similarity scores from first matrix
-        scores = sim_matrix_1[query_idx].copy(
-        )  # Copy to avoid issues with mmap
-
-        if has_matrix_2:
-            # Get scores from second matrix and combine
-            scores_2 = sim_matrix_2[query_idx].copy()
-
-            # Find top-k across both matrices
-            # We'll use argpartition which is faster than argsort for just finding top k
-            if len(scores) + len(scores_2) <= k:
-                # If we have fewer sections than k, just take all indices
-                top_indices = list(range(len(scores)))
-            else:
-                # Create virtual combined array for ranking
-                combined_scores = np.concatenate([scores, scores_2])
-                top_k_partition = np.argpartition(combined_scores, -k)[-k:]
-                # Get original indices that are in top-k and part of first matrix
-                top_indices = [
-                    idx for idx in top_k_partition if idx < len(scores)
-                ]
-        else:
-            # Using just the first matrix
-            if len(scores) <= k:
-                top_indices = list(range(len(scores)))
-            else:
-                top_k_partition = np.argpartition(scores, -k)[-k:]
-                top_indices = list(top_k_partition)
-
-        # Update the set of relevant section indices
-        relevant_section_indices.update(top_indices)
+    subset_embeddings = query_embeddings[query_indices_to_process]
+    shard_results = []
+    for shard_name, embeddings_dir, section_rows_path in shards:
+        print(f"Scoring shard {shard_name}...")
+        shard_results.append(
+            score_shard(embeddings_dir, section_rows_path, subset_embeddings,
+                        query_indices_to_process, k, prefix_dim, ann_n_probe))
+
+    # Merge the per-shard top-k lists into the global top-k per query
+    top_indices = heap_merge_topk(shard_results, k).ids
+
+    # Flag every section that made some query's top-k
+    hit_mask = np.zeros(max(section_index.n_sections,
+                            int(top_indices.max(initial=-1)) + 1),
+                        dtype=bool)
+    hit_mask[top_indices[top_indices >= 0]] = True
 
     print(
-        f"Found {len(relevant_section_indices)} relevant section indices across the subset of queries."
+        f"Found {hit_mask.sum()} relevant section indices across the subset of queries."
     )
 
-    # Find hard negative documents
-    hard_negative_docs = []
-
-    # Iterate through documents
-    doc_count = len(section_id_to_index)
-    print(f"Checking {doc_count} documents for hard negatives...")
-
-    for doc_id, sections_dict in section_id_to_index.items():
-        # Check if all sections of this document are irrelevant
-        is_hard_negative = True
-        for section_id, section_idx in sections_dict.items():
-            if section_idx in relevant_section_indices:
-                # This section is relevant to at least one query
-                is_hard_negative = False
-                break
-
-        if is_hard_negative:
-            hard_negative_docs.append(doc_id)
+    # A document is a hard negative if none of its sections were hit
+    print(f"Checking {section_index.n_docs} documents for hard negatives...")
+    doc_hits = section_index.doc_hit_counts(hit_mask)
+    hard_negative_docs = section_index.doc_ids[doc_hits == 0].tolist()
 
     # Save the hard negative documents to a JSON file
     output_file = os.path.join(input_dir, 'hard_negative_docs.json')
@@ -206,28 +242,39 @@ def sample_hard_negatives(categories_dir, hard_negative_documents, n=600):
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         description='Find hard negative documents.')
-    parser.add_argument(
-        '--input_dir',
-        type=str,
-        default=
-        "copy/data/final/pdf/arxiv/embeddings",
-        help='Directory containing the data files')
+    parser.add_argument('--input_dir',
+                        type=str,
+                        default="copy/data/final/pdf/arxiv/embeddings",
+                        help='Directory containing the data files')
     parser.add_argument('--k',
                         type=int,
                         default=50,
                         help='Number of top-k retrieval results to consider')
+    parser.add_argument(
+        '--prefix_dim',
+        type=int,
+        default=None,
+        help='Shortlist with the first prefix_dim embedding dimensions and '
+        're-score the shortlist at full dimension (Matryoshka encoders)')
+    parser.add_argument(
+        '--ann_n_probe',
+        type=int,
+        default=None,
+        help='Search each shard\'s IVF index (built on first use), probing '
+        'this many lists per query, and re-score the candidates exactly')
 
     args = parser.parse_args()
 
-    hard_negatives = find_hard_negatives(args.input_dir, args.k)
+    hard_negatives = find_hard_negatives(args.input_dir,
+                                         args.k,
+                                         prefix_dim=args.prefix_dim,
+                                         ann_n_probe=args.ann_n_probe)
 
     categories_dir = "copy/data/raw/pdf/arxiv/pdf"
     hard_negative_documents = read_json(
-        "copy/data/final/pdf/arxiv/embeddings/hard_negative_docs.json"
-    )
+        "copy/data/final/pdf/arxiv/embeddings/hard_negative_docs.json")
     sampled_docs = sample_hard_negatives(categories_dir,
                                          hard_negative_documents)
     write_json(
         sampled_docs,
-        "copy/data/final/pdf/arxiv/embeddings/hard_negative_docs_sampled.json"
-    )
+        "copy/data/final/pdf/arxiv/embeddings/hard_negative_docs_sampled.json")
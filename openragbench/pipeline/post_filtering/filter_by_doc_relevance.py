@@ -1,10 +1,22 @@
 import os
+import time
+import tempfile
 import numpy as np
 import random
 from collections import Counter, defaultdict
 import logging
 
-from openragbench.models.encoders import similarity_gpu as similarity
+from openragbench.models.clustering import (UnionFind, connected_components,
+                                            select_representatives)
+from openragbench.models.id_maps import load_query_id_map, load_section_index
+from openragbench.models.quantization import load_embeddings, quantize_npy
+from openragbench.models.score_store import get_topk_store
+from openragbench.models.scoring import (average_gold_ranks,
+                                         average_similarity_dense,
+                                         average_similarity_group_sums,
+                                         iter_average_similarity_pairs,
+                                         min_max_scale, topk_similarity,
+                                         union_average_gold_ranks)
 from openragbench.utils import read_json, write_json
 
 # Set up logging
@@ -13,16 +25,44 @@ logging.basicConfig(level=logging.INFO,
 logger = logging.getLogger(__name__)
 
 
+def get_gold_rows(query_id_map, section_index, qrels):
+    """Map every query row to the row of its relevant section (-1 if the
+    query has no qrel or its section is not in the mapping)."""
+    qrel_ids = list(qrels)
+    query_rows = query_id_map.rows_of(qrel_ids)
+    section_rows = section_index.rows_of(
+        [qrels[query_id]['doc_id'] for query_id in qrel_ids],
+        [int(qrels[query_id]['section_id']) for query_id in qrel_ids])
+
+    gold_rows = np.full(len(query_id_map), -1, dtype=np.int32)
+    found = query_rows >= 0
+    gold_rows[query_rows[found]] = section_rows[found]
+    return gold_rows
+
+
+def relevance_masks(gold_rows, gold_ranks, gold_scores, n_retrieval_results,
+                    score_threshold):
+    """Stage 1 and Stage 2 keep masks over query rows.
+
+    Stage 1 keeps queries with a known relevant section ranked within the top
+    N; Stage 2 additionally requires its scaled score to reach the threshold.
+    """
+    stage1 = (gold_rows >= 0) & (gold_ranks < n_retrieval_results)
+    with np.errstate(invalid='ignore'):
+        stage2 = stage1 & (gold_scores >= score_threshold)
+    return stage1, stage2
+
+
 def filter_by_intersection(directory_path,
                            qrels_path,
                            output_path,
                            n_retrieval_results=50,
-                           score_threshold=0.8):
+                           score_threshold=0.8,
+                           prefix_dim=None,
+                           ann_n_probe=None):
     # Load the mappings
-    query_id_to_index = read_json(
-        os.path.join(directory_path, 'query_id_to_index.json'))
-    section_id_to_index = read_json(
-        os.path.join(directory_path, 'section_id_to_index.json'))
+    query_id_map = load_query_id_map(directory_path)
+    section_index = load_section_index(directory_path)
     qrels = read_json(qrels_path)
 
     # Get all model directories
@@ -31,8 +71,13 @@ def filter_by_intersection(directory_path,
         if os.path.isdir(os.path.join(directory_path, d))
     ]
 
+    # Resolve each query's relevant section row once for all models
+    gold_rows = get_gold_rows(query_id_map, section_index, qrels)
+    query_ids = query_id_map.ids_by_row()
+
     # Store filtered query IDs for each model
     model_filtered_queries = {}
+    intersection_mask = np.ones(len(query_ids), dtype=bool)
 
     # Process each model
     for model_name in model_dirs:
@@ -41,8 +86,6 @@ def filter_by_intersection(directory_path,
         model_path = os.path.join(directory_path, model_name)
         query_emb_path = os.path.join(model_path, 'query_embeddings.npy')
         section_emb_path = os.path.join(model_path, 'section_embeddings.npy')
-        similarity_scores_path = os.path.join(model_path,
-                                              'similarity_scores.npy')
 
         # Skip if embedding files don't exist
         if not (os.path.exists(query_emb_path) and
@@ -51,103 +94,39 @@ def filter_by_intersection(directory_path,
                 f"Embedding files not found for {model_name}, skipping...")
             continue
 
-        # Check if similarity scores already exist
-        if os.path.exists(similarity_scores_path):
-            logger.info(
-                f"Loading precomputed similarity scores for {model_name}...")
-            similarity_scores = np.load(similarity_scores_path)
-        else:
-            # Load embeddings
-            query_embeddings = np.load(query_emb_path)
-            section_embeddings = np.load(section_emb_path)
-
-            logger.info(f"Computing similarity scores for {model_name}...")
-            # Compute similarity scores (cosine similarity)
-            similarity_scores = similarity(query_embeddings, section_embeddings)
-
-            # Save similarity scores
-            logger.info(f"Saving similarity scores for {model_name}...")
-            np.save(similarity_scores_path, similarity_scores)
-
-        # Initialize set of all query IDs
-        filtered_query_ids = set(query_id_to_index.keys())
-        initial_count = len(filtered_query_ids)
-
-        # Stage 1: Check if relevant section is in top N results
+        # Load the top-k store, (re)building it if missing or stale
         logger.info(
-            f"Starting Stage 1 filtering for {model_name} (top {n_retrieval_results})..."
-        )
-        for query_id in list(filtered_query_ids):
-            # Skip if query not in qrels
-            if query_id not in qrels:
-                filtered_query_ids.remove(query_id)
-                continue
-
-            query_idx = query_id_to_index[query_id]
-            doc_id = qrels[query_id]['doc_id']
-            section_id = str(qrels[query_id]['section_id'])
-
-            # Skip if document or section not in mappings
-            if doc_id not in section_id_to_index or section_id not in section_id_to_index[
-                    doc_id]:
-                filtered_query_ids.remove(query_id)
-                continue
-
-            # Get index of relevant section
-            relevant_section_idx = section_id_to_index[doc_id][section_id]
+            f"Loading top-{n_retrieval_results} scores for {model_name}...")
+        store = get_topk_store(model_path,
+                               n_retrieval_results,
+                               gold_rows,
+                               prefix_dim=prefix_dim,
+                               ann_n_probe=ann_n_probe)
+        stage1, stage2 = relevance_masks(gold_rows, store.gold["rank"],
+                                         store.gold_scaled_scores(),
+                                         n_retrieval_results, score_threshold)
 
-            # Get top N sections for this query
-            query_sim_scores = similarity_scores[query_idx]
-            top_n_indices = np.argsort(
-                query_sim_scores)[::-1][:
-                                        n_retrieval_results]  # Descending order
-
-            # Remove query if relevant section not in top N
-            if relevant_section_idx not in top_n_indices:
-                filtered_query_ids.remove(query_id)
-
-        stage1_count = len(filtered_query_ids)
+        # Stage 1: Check if relevant section is in top N results
         logger.info(
-            f"Stage 1 complete. Remaining queries: {stage1_count}/{initial_count}"
-        )
+            f"Stage 1 complete for {model_name} (top {n_retrieval_results}). "
+            f"Remaining queries: {stage1.sum()}/{len(stage1)}")
 
         # Stage 2: Check if similarity with relevant section > threshold
         logger.info(
-            f"Starting Stage 2 filtering for {model_name} (threshold {score_threshold})..."
-        )
-        for query_id in list(filtered_query_ids):
-            query_idx = query_id_to_index[query_id]
-            doc_id = qrels[query_id]['doc_id']
-            section_id = str(qrels[query_id]['section_id'])
-            relevant_section_idx = section_id_to_index[doc_id][section_id]
-
-            # Get similarity score with relevant section
-            sim_score = similarity_scores[query_idx][relevant_section_idx]
-
-            # Remove query if similarity < threshold
-            if sim_score < score_threshold:
-                filtered_query_ids.remove(query_id)
-
-        stage2_count = len(filtered_query_ids)
-        logger.info(
-            f"Stage 2 complete. Remaining queries: {stage2_count}/{stage1_count}"
-        )
+            f"Stage 2 complete for {model_name} (threshold {score_threshold}). "
+            f"Remaining queries: {stage2.sum()}/{stage1.sum()}")
 
         # Store filtered queries for this model
-        model_filtered_queries[model_name] = list(filtered_query_ids)
+        model_filtered_queries[model_name] = query_ids[stage2].tolist()
+        intersection_mask &= stage2
 
     # Find intersection of filtered query IDs across all models
     if not model_filtered_queries:
         logger.warning("No valid models found.")
-        intersection = set()
-    else:
-        filtered_sets = [set(ids) for ids in model_filtered_queries.values()]
-        intersection = filtered_sets[0]
-        for s in filtered_sets[1:]:
-            intersection = intersection.intersection(s)
+        intersection_mask[:] = False
 
     # Convert to list for JSON serialization
-    intersection_list = list(intersection)
+    intersection_list = query_ids[intersection_mask].tolist()
 
     # Save results
     output_file = os.path.join(output_path,
@@ -164,37 +143,45 @@ def filter_by_intersection(directory_path,
     return intersection_list
 
 
-def filter_by_average(directory_path,
-                      qrels_path,
-                      output_path,
-                      n_retrieval_results=50,
-                      score_threshold=0.8):
-    # Load the mappings
-    query_id_to_index = read_json(
-        os.path.join(directory_path, 'query_id_to_index.json'))
-    section_id_to_index = read_json(
-        os.path.join(directory_path, 'section_id_to_index.json'))
-    qrels = read_json(qrels_path)
+def compute_average_gold(directory_path,
+                         model_dirs,
+                         gold_rows,
+                         n_retrieval_results=50,
+                         union_topk=False,
+                         prefix_dim=None,
+                         ann_n_probe=None):
+    """Gold scores and ranks on the similarity scores averaged across models.
 
-    # Get all model directories
-    model_dirs = [
-        d for d in os.listdir(directory_path)
-        if os.path.isdir(os.path.join(directory_path, d))
-    ]
+    The average is accumulated tile by tile from memory-mapped embeddings,
+    using each model's row min/max from its top-k store for the min-max
+    scaling, so no model's dense matrix is ever held in memory. Stores built
+    with `prefix_dim` or `ann_n_probe` only estimate the row min/max, so the
+    exhaustive average recomputes them exactly instead.
+
+    Args:
+        directory_path: Path to the main directory containing model subfolders
+        model_dirs: Model subfolder names
+        gold_rows: Gold section row per query, -1 if unknown
+        n_retrieval_results: Minimum top-k kept in each model's store
+        union_topk: Only average the sections found in some model's top-k
+            list instead of all sections
+        prefix_dim: Build the top-k stores with two-stage prefix scoring
+        ann_n_probe: Build the top-k stores from each model's IVF index
 
-    # Store similarity scores for each model
-    all_model_similarity_scores = []
+    Returns:
+        Tuple (gold_scores, gold_ranks, valid_models); the arrays are None
+        when no model has embeddings.
+    """
+    model_embeddings, model_row_stats, model_topk_ids = [], [], []
     valid_models = []
 
-    # Process each model to get similarity scores
+    # Process each model to get memory-mapped embeddings and row statistics
     for model_name in model_dirs:
         logger.info(f"Processing model: {model_name}")
 
         model_path = os.path.join(directory_path, model_name)
         query_emb_path = os.path.join(model_path, 'query_embeddings.npy')
         section_emb_path = os.path.join(model_path, 'section_embeddings.npy')
-        similarity_scores_path = os.path.join(model_path,
-                                              'similarity_scores.npy')
 
         # Skip if embedding files don't exist
         if not (os.path.exists(query_emb_path) and
@@ -203,103 +190,90 @@ def filter_by_average(directory_path,
                 f"Embedding files not found for {model_name}, skipping...")
             continue
 
-        # Check if similarity scores already exist
-        if os.path.exists(similarity_scores_path):
-            logger.info(
-                f"Loading precomputed similarity scores for {model_name}...")
-            similarity_scores = np.load(similarity_scores_path)
-        else:
-            # Load embeddings
-            query_embeddings = np.load(query_emb_path)
-            section_embeddings = np.load(section_emb_path)
-
-            logger.info(f"Computing similarity scores for {model_name}...")
-            # Compute similarity scores (cosine similarity)
-            similarity_scores = similarity(query_embeddings, section_embeddings)
-
-            # Save similarity scores
-            logger.info(f"Saving similarity scores for {model_name}...")
-            np.save(similarity_scores_path, similarity_scores)
-
-        # Add to our collection
-        all_model_similarity_scores.append(similarity_scores)
+        store = get_topk_store(model_path,
+                               n_retrieval_results,
+                               gold_rows,
+                               prefix_dim=prefix_dim,
+                               ann_n_probe=ann_n_probe)
+        query_embeddings = load_embeddings(query_emb_path)
+        section_embeddings = load_embeddings(section_emb_path)
+        row_stats = (store.row_min, store.row_max)
+        if not union_topk and (prefix_dim is not None or
+                               ann_n_probe is not None):
+            # Estimated bounds would shift the scaling of the exact average
+            logger.info(f"Computing exact score range for {model_name}...")
+            result = topk_similarity(query_embeddings, section_embeddings, 1)
+            row_stats = (result.row_min, result.row_max)
+        model_embeddings.append((query_embeddings, section_embeddings))
+        model_row_stats.append(row_stats)
+        model_topk_ids.append(store.ids)
         valid_models.append(model_name)
 
-    if not all_model_similarity_scores:
-        logger.error("No valid models found with similarity scores. Exiting.")
-        return []
+    if not valid_models:
+        return None, None, valid_models
 
     # Compute average similarity scores across all models
-    logger.info(
-        f"Computing average similarity scores across {len(valid_models)} models..."
-    )
-    avg_similarity_scores = np.mean(all_model_similarity_scores, axis=0)
-
-    # Now apply two-stage filtering on the averaged similarity scores
-
-    # Initialize set of all query IDs
-    filtered_query_ids = set(query_id_to_index.keys())
-    initial_count = len(filtered_query_ids)
-
-    # Stage 1: Check if relevant section is in top N results
-    logger.info(
-        f"Starting Stage 1 filtering on averaged scores (top {n_retrieval_results})..."
-    )
-    for query_id in list(filtered_query_ids):
-        # Skip if query not in qrels
-        if query_id not in qrels:
-            filtered_query_ids.remove(query_id)
-            continue
+    if union_topk:
+        logger.info(
+            f"Averaging top-k candidate scores across {len(valid_models)} models..."
+        )
+        gold_scores, gold_ranks = union_average_gold_ranks(
+            model_embeddings, model_row_stats, model_topk_ids, gold_rows)
+    else:
+        logger.info(
+            f"Computing average similarity scores across {len(valid_models)} models..."
+        )
+        gold_scores, gold_ranks = average_gold_ranks(model_embeddings,
+                                                     model_row_stats, gold_rows)
+    return gold_scores, gold_ranks, valid_models
 
-        query_idx = query_id_to_index[query_id]
-        doc_id = qrels[query_id]['doc_id']
-        section_id = str(qrels[query_id]['section_id'])
 
-        # Skip if document or section not in mappings
-        if doc_id not in section_id_to_index or section_id not in section_id_to_index[
-                doc_id]:
-            filtered_query_ids.remove(query_id)
-            continue
+def filter_by_average(directory_path,
+                      qrels_path,
+                      output_path,
+                      n_retrieval_results=50,
+                      score_threshold=0.8,
+                      union_topk=False,
+                      prefix_dim=None,
+                      ann_n_probe=None):
+    # Load the mappings
+    query_id_map = load_query_id_map(directory_path)
+    section_index = load_section_index(directory_path)
+    qrels = read_json(qrels_path)
 
-        # Get index of relevant section
-        relevant_section_idx = section_id_to_index[doc_id][section_id]
+    # Get all model directories
+    model_dirs = [
+        d for d in os.listdir(directory_path)
+        if os.path.isdir(os.path.join(directory_path, d))
+    ]
 
-        # Get top N sections for this query
-        query_sim_scores = avg_similarity_scores[query_idx]
-        top_n_indices = np.argsort(
-            query_sim_scores)[::-1][:n_retrieval_results]  # Descending order
+    gold_rows = get_gold_rows(query_id_map, section_index, qrels)
+    query_ids = query_id_map.ids_by_row()
+    gold_scores, gold_ranks, _ = compute_average_gold(directory_path,
+                                                      model_dirs, gold_rows,
+                                                      n_retrieval_results,
+                                                      union_topk, prefix_dim,
+                                                      ann_n_probe)
+    if gold_scores is None:
+        logger.error("No valid models found with similarity scores. Exiting.")
+        return []
 
-        # Remove query if relevant section not in top N
-        if relevant_section_idx not in top_n_indices:
-            filtered_query_ids.remove(query_id)
+    # Now apply two-stage filtering on the averaged similarity scores
+    stage1, stage2 = relevance_masks(gold_rows, gold_ranks, gold_scores,
+                                     n_retrieval_results, score_threshold)
 
-    stage1_count = len(filtered_query_ids)
+    # Stage 1: Check if relevant section is in top N results
     logger.info(
-        f"Stage 1 complete. Remaining queries: {stage1_count}/{initial_count}")
+        f"Stage 1 complete on averaged scores (top {n_retrieval_results}). "
+        f"Remaining queries: {stage1.sum()}/{len(stage1)}")
 
     # Stage 2: Check if similarity with relevant section > threshold
     logger.info(
-        f"Starting Stage 2 filtering on averaged scores (threshold {score_threshold})..."
-    )
-    for query_id in list(filtered_query_ids):
-        query_idx = query_id_to_index[query_id]
-        doc_id = qrels[query_id]['doc_id']
-        section_id = str(qrels[query_id]['section_id'])
-        relevant_section_idx = section_id_to_index[doc_id][section_id]
-
-        # Get similarity score with relevant section
-        sim_score = avg_similarity_scores[query_idx][relevant_section_idx]
-
-        # Remove query if similarity < threshold
-        if sim_score < score_threshold:
-            filtered_query_ids.remove(query_id)
-
-    stage2_count = len(filtered_query_ids)
-    logger.info(
-        f"Stage 2 complete. Remaining queries: {stage2_count}/{stage1_count}")
+        f"Stage 2 complete on averaged scores (threshold {score_threshold}). "
+        f"Remaining queries: {stage2.sum()}/{stage1.sum()}")
 
     # Convert to list for JSON serialization
-    filtered_query_list = list(filtered_query_ids)
+    filtered_query_list = query_ids[stage2].tolist()
 
     # Save results
     output_file = os.path.join(output_path, 'filtered_queries_averaged.json')
@@ -312,44 +286,317 @@ def filter_by_average(directory_path,
     return filtered_query_list
 
 
-def deduplicate_queries(directory_path,
-                        filtered_queries_path,
+def sweep_relevance_filters(directory_path,
+                            qrels_path,
+                            queries_path,
+                            output_path,
+                            n_retrieval_values=(10, 25, 50),
+                            score_thresholds=(0.7, 0.8, 0.9),
+                            prefix_dim=None,
+                            ann_n_probe=None):
+    """
+    Count surviving queries for every (top N, threshold) combination of the
+    intersection and average filters in a single pass.
+
+    Gold ranks and scores are computed once per model (from the top-k
+    stores) and once for the averaged scores; every grid point is then a
+    mask over those arrays.
+
+    Args:
+        directory_path: Path to the main directory containing model subfolders
+        qrels_path: Path to qrels.json
+        queries_path: Path to queries.json, used for the type/source breakdown
+        output_path: Directory to save relevance_sweep.json
+        n_retrieval_values: Candidate values of n_retrieval_results
+        score_thresholds: Candidate values of score_threshold
+        prefix_dim: Build the top-k stores with two-stage prefix scoring
+        ann_n_probe: Build the top-k stores from each model's IVF index
+
+    Returns:
+        List of result rows, one per (mode, N, threshold) grid point
+    """
+    query_id_map = load_query_id_map(directory_path)
+    section_index = load_section_index(directory_path)
+    qrels = read_json(qrels_path)
+    queries_info = read_json(queries_path)
+
+    model_dirs = [
+        d for d in os.listdir(directory_path)
+        if os.path.isdir(os.path.join(directory_path, d))
+    ]
+
+    gold_rows = get_gold_rows(query_id_map, section_index, qrels)
+    query_ids = query_id_map.ids_by_row()
+    max_n = max(n_retrieval_values)
+
+    # Gold ranks/scores per model, shaped (M, Q)
+    model_ranks, model_scores = [], []
+    for model_name in model_dirs:
+        model_path = os.path.join(directory_path, model_name)
+        if not (os.path.exists(os.path.join(model_path, 'query_embeddings.npy'))
+                and os.path.exists(
+                    os.path.join(model_path, 'section_embeddings.npy'))):
+            logger.warning(
+                f"Embedding files not found for {model_name}, skipping...")
+            continue
+        store = get_topk_store(model_path,
+                               max_n,
+                               gold_rows,
+                               prefix_dim=prefix_dim,
+                               ann_n_probe=ann_n_probe)
+        model_ranks.append(np.asarray(store.gold["rank"]))
+        model_scores.append(store.gold_scaled_scores())
+
+    avg_scores, avg_ranks, _ = compute_average_gold(directory_path,
+                                                    model_dirs,
+                                                    gold_rows,
+                                                    max_n,
+                                                    prefix_dim=prefix_dim,
+                                                    ann_n_probe=ann_n_probe)
+    if avg_scores is None:
+        logger.error("No valid models found with similarity scores. Exiting.")
+        return []
+
+    # One-hot category matrix so every grid point is counted with one matmul
+    categories = ['total']
+    columns = [np.ones(len(query_ids), dtype=bool)]
+    for field in ('type', 'source'):
+        values = np.array([
+            queries_info.get(query_id, {}).get(field, 'unknown')
+            for query_id in query_ids
+        ])
+        for value in sorted(set(values)):
+            categories.append(f"{field}:{value}")
+            columns.append(values == value)
+    category_matrix = np.stack(columns, axis=1).astype(np.int64)
+
+    start_time = time.perf_counter()
+    n_values = np.asarray(n_retrieval_values)[:, None, None]
+    thresholds = np.asarray(score_thresholds)[:, None, None]
+    valid = gold_rows >= 0
+    modes = {
+        'intersection': (np.stack(model_ranks), np.stack(model_scores)),
+        'average': (avg_ranks[None], avg_scores[None]),
+    }
+
+    results = []
+    for mode, (ranks, scores) in modes.items():
+        # (len(N), Q) and (len(thresholds), Q): every model must pass
+        rank_ok = (ranks[None] < n_values).all(axis=1) & valid
+        with np.errstate(invalid='ignore'):
+            score_ok = (scores[None] >= thresholds).all(axis=1)
+        keep = rank_ok[:, None, :] & score_ok[None, :, :]
+        counts = keep.astype(np.int64) @ category_matrix
+        for i, n in enumerate(n_retrieval_values):
+            for j, threshold in enumerate(score_thresholds):
+                row = {
+                    'mode': mode,
+                    'n_retrieval_results': int(n),
+                    'score_threshold': float(threshold),
+                }
+                row.update({
+                    category: int(count)
+                    for category, count in zip(categories, counts[i, j])
+                })
+                results.append(row)
+    logger.info(f"Swept {len(results)} grid points in "
+                f"{time.perf_counter() - start_time:.3f}s")
+
+    output_file = os.path.join(output_path, 'relevance_sweep.json')
+    write_json(results, output_file)
+    logger.info(f"Sweep results saved to {output_file}")
+
+    print("\n=== RELEVANCE FILTER SWEEP ===")
+    header = ['mode', 'N', 'threshold'] + categories
+    print("  " + " | ".join(header))
+    for row in results:
+        values = [
+            row['mode'],
+            str(row['n_retrieval_results']), f"{row['score_threshold']:.2f}"
+        ] + [str(row[category]) for category in categories]
+        print("  " + " | ".join(values))
+
+    return results
+
+
+def gold_outcome(query_embeddings, section_embeddings, gold_rows,
+                 n_retrieval_results, score_threshold):
+    """Exact gold ranks, scaled gold scores and Stage 2 keep mask of one
+    model, from a single pass over the embeddings."""
+    result = topk_similarity(query_embeddings,
+                             section_embeddings,
+                             1,
+                             gold_rows=gold_rows)
+    scaled = min_max_scale(result.gold_scores, result.row_min, result.row_max)
+    _, stage2 = relevance_masks(gold_rows, result.gold_ranks, scaled,
+                                n_retrieval_results, score_threshold)
+    return result.gold_ranks, scaled, stage2
+
+
+def keep_difference(reference, keep):
+    """Queries kept with and without quantization, and the flips."""
+    return {
+        'kept_reference': int(reference.sum()),
+        'kept': int(keep.sum()),
+        'added': int((keep & ~reference).sum()),
+        'removed': int((reference & ~keep).sum()),
+    }
+
+
+def quantization_report(directory_path,
+                        qrels_path,
                         output_path,
-                        similarity_threshold=0.95):
+                        dtypes=("float16", "int8"),
+                        n_retrieval_results=50,
+                        score_threshold=0.8):
     """
-    Deduplicate queries based on average similarity across models.
+    Check that storing embeddings as float16 or int8 leaves the relevance
+    filter unchanged.
+
+    Every model's stored embeddings (normally float32) are the reference.
+    For each dtype they are quantized into a temporary copy and scored
+    again; the report compares the exact gold ranks, the scaled gold scores
+    and the Stage 2 outcome per model and for the intersection across
+    models.
 
     Args:
         directory_path: Path to the main directory containing model subfolders
-        filtered_queries_path: Path to the JSON file containing filtered query IDs
-        similarity_threshold: Threshold for considering queries as similar (default: 0.95)
-        output_file: Path to save the deduplicated query list
+        qrels_path: Path to qrels.json
+        output_path: Directory to save quantization_report.json
+        dtypes: Storage dtypes to evaluate
+        n_retrieval_results: Top N used by the filter
+        score_threshold: Scaled score threshold used by the filter
 
     Returns:
-        List of deduplicated query IDs
+        Dict with one entry per dtype: per-model rows and the intersection
+        outcome.
+    """
+    query_id_map = load_query_id_map(directory_path)
+    section_index = load_section_index(directory_path)
+    gold_rows = get_gold_rows(query_id_map, section_index,
+                              read_json(qrels_path))
+    valid = gold_rows >= 0
+
+    model_dirs = sorted(d for d in os.listdir(directory_path)
+                        if os.path.isdir(os.path.join(directory_path, d)))
+
+    report = {dtype: {'models': {}} for dtype in dtypes}
+    intersections = {
+        dtype: np.ones(len(gold_rows), dtype=bool)
+        for dtype in ('reference',) + tuple(dtypes)
+    }
+    for model_name in model_dirs:
+        model_path = os.path.join(directory_path, model_name)
+        query_emb_path = os.path.join(model_path, 'query_embeddings.npy')
+        section_emb_path = os.path.join(model_path, 'section_embeddings.npy')
+        if not (os.path.exists(query_emb_path) and
+                os.path.exists(section_emb_path)):
+            logger.warning(
+                f"Embedding files not found for {model_name}, skipping...")
+            continue
+
+        logger.info(f"Scoring reference embeddings for {model_name}...")
+        query_embeddings = load_embeddings(query_emb_path)
+        section_embeddings = load_embeddings(section_emb_path)
+        reference_bytes = query_embeddings.nbytes + section_embeddings.nbytes
+        ref_ranks, ref_scores, ref_keep = gold_outcome(query_embeddings,
+                                                       section_embeddings,
+                                                       gold_rows,
+                                                       n_retrieval_results,
+                                                       score_threshold)
+        intersections['reference'] &= ref_keep
+
+        for dtype in dtypes:
+            logger.info(f"Scoring {dtype} embeddings for {model_name}...")
+            with tempfile.TemporaryDirectory(dir=output_path) as tmp_dir:
+                query_embeddings = quantize_npy(
+                    query_emb_path, os.path.join(tmp_dir, 'query.npy'), dtype)
+                section_embeddings = quantize_npy(
+                    section_emb_path, os.path.join(tmp_dir, 'section.npy'),
+                    dtype)
+                stored_bytes = (query_embeddings.nbytes +
+                                section_embeddings.nbytes)
+                ranks, scores, keep = gold_outcome(query_embeddings,
+                                                   section_embeddings,
+                                                   gold_rows,
+                                                   n_retrieval_results,
+                                                   score_threshold)
+                del query_embeddings, section_embeddings
+            intersections[dtype] &= keep
+
+            rank_diff = np.abs(ranks[valid] - ref_ranks[valid])
+            score_diff = np.abs(scores[valid] - ref_scores[valid])
+            if not valid.any():
+                rank_diff = score_diff = np.zeros(1)
+            row = {
+                'size_ratio': stored_bytes / reference_bytes,
+                'gold_rank_agreement': float(np.mean(rank_diff == 0)),
+                'mean_abs_rank_diff': float(rank_diff.mean()),
+                'max_abs_rank_diff': int(rank_diff.max()),
+                'max_scaled_score_diff': float(np.nanmax(score_diff)),
+            }
+            row.update(keep_difference(ref_keep, keep))
+            report[dtype]['models'][model_name] = row
+
+    for dtype in dtypes:
+        report[dtype]['intersection'] = keep_difference(
+            intersections['reference'], intersections[dtype])
+
+    output_file = os.path.join(output_path, 'quantization_report.json')
+    write_json(report, output_file)
+    logger.info(f"Quantization report saved to {output_file}")
+
+    print("\n=== QUANTIZATION REPORT ===")
+    print(f"  top {n_retrieval_results}, threshold {score_threshold}")
+    for dtype in dtypes:
+        print(f"  {dtype}:")
+        for model_name, row in report[dtype]['models'].items():
+            print(f"    {model_name}: size x{row['size_ratio']:.2f}, "
+                  f"gold rank agreement {row['gold_rank_agreement']:.4f} "
+                  f"(max diff {row['max_abs_rank_diff']}), "
+                  f"max score diff {row['max_scaled_score_diff']:.4f}, "
+                  f"kept {row['kept']}/{row['kept_reference']} "
+                  f"(+{row['added']} -{row['removed']})")
+        row = report[dtype]['intersection']
+        print(f"    intersection: kept {row['kept']}/{row['kept_reference']} "
+              f"(+{row['added']} -{row['removed']})")
+    return report
+
+
+def load_filtered_query_embeddings(directory_path, filtered_queries_path):
+    """Load every model's embeddings for the filtered queries, with the
+    row-wise min/max of their query-query scores for min-max scaling.
+
+    Returns:
+        Tuple (filtered_queries, model_embeddings, model_row_stats), where
+        filtered_queries only keeps queries present in the index mapping.
     """
     # Load filtered queries
     filtered_queries = read_json(filtered_queries_path)
 
     logger.info(f"Loaded {len(filtered_queries)} filtered queries")
+    return load_query_embeddings(directory_path, filtered_queries)
+
 
-    # Load query ID to index mapping
-    query_id_to_index_path = os.path.join(directory_path,
-                                          'query_id_to_index.json')
-    query_id_to_index = read_json(query_id_to_index_path)
+def load_query_embeddings(directory_path, filtered_queries):
+    """Load every model's embeddings for the given query IDs, with the
+    row-wise min/max of their query-query scores for min-max scaling.
 
-    # Get indices of filtered queries
-    filtered_query_indices = [
-        query_id_to_index[qid]
-        for qid in filtered_queries
-        if qid in query_id_to_index
+    Returns:
+        Tuple (filtered_queries, model_embeddings, model_row_stats) as in
+        load_filtered_query_embeddings.
+    """
+    # Keep only filtered queries that have embeddings
+    query_rows = load_query_id_map(directory_path).rows_of(filtered_queries)
+    filtered_queries = [
+        qid for qid, row in zip(filtered_queries, query_rows) if row >= 0
     ]
+    filtered_query_indices = query_rows[query_rows >= 0].tolist()
 
     if not filtered_query_indices:
         logger.error(
-            "None of the filtered queries were found in query_id_to_index mapping"
-        )
-        return []
+            "None of the filtered queries were found in the query ID map")
+        return filtered_queries, [], []
 
     # Get all model directories
     model_dirs = [
@@ -357,9 +604,7 @@ def deduplicate_queries(directory_path,
         if os.path.isdir(os.path.join(directory_path, d))
     ]
 
-    # Store query-query similarity matrices for each model
-    all_query_similarities = []
-    valid_models = []
+    model_embeddings, model_row_stats = [], []
 
     # Process each model
     for model_name in model_dirs:
@@ -374,76 +619,175 @@ def deduplicate_queries(directory_path,
                 f"Query embeddings not found for {model_name}, skipping...")
             continue
 
-        # Load query embeddings
-        query_embeddings = np.load(query_emb_path)
+        # Gather only the filtered rows from the memory-mapped embeddings
+        query_embeddings = load_embeddings(query_emb_path)
+        filtered_embeddings = np.asarray(
+            query_embeddings[filtered_query_indices], dtype=np.float32)
 
-        # Filter to only include embeddings for the filtered queries
-        filtered_embeddings = query_embeddings[filtered_query_indices]
+        # Row-wise min/max of the query-query scores, for min-max scaling
+        logger.info(f"Computing query-query score range for {model_name}...")
+        result = topk_similarity(filtered_embeddings, filtered_embeddings, 1)
 
-        # Compute query-query similarity
-        logger.info(f"Computing query-query similarity for {model_name}...")
-        query_query_similarity = similarity(filtered_embeddings,
-                                            filtered_embeddings)
-
-        all_query_similarities.append(query_query_similarity)
-        valid_models.append(model_name)
+        model_embeddings.append((filtered_embeddings, filtered_embeddings))
+        model_row_stats.append((result.row_min, result.row_max))
 
-    if not all_query_similarities:
+    if not model_embeddings:
         logger.error("No valid models found. Exiting.")
-        return []
+    return filtered_queries, model_embeddings, model_row_stats
+
+
+def cluster_similarity_sums(labels, model_embeddings, model_row_stats):
+    """Each query's summed average similarity to the other queries of its
+    cluster; zero for singleton clusters, which are never scored."""
+    cluster_sizes = np.bincount(labels, minlength=len(labels))
+    in_cluster = np.flatnonzero(cluster_sizes[labels] > 1)
+    scores = np.zeros(len(labels), dtype=np.float64)
+    if len(in_cluster):
+        scores[in_cluster] = average_similarity_group_sums(
+            [(embeddings[in_cluster], embeddings[in_cluster])
+             for embeddings, _ in model_embeddings],
+            [(row_min[in_cluster], row_max[in_cluster])
+             for row_min, row_max in model_row_stats], labels[in_cluster])
+    return scores
+
+
+def _subset(model_embeddings, model_row_stats, rows, cols):
+    # Averaging inputs for the given query rows against the given columns
+    return ([(embeddings[rows], embeddings[cols])
+             for embeddings, _ in model_embeddings],
+            [(row_min[rows], row_max[rows])
+             for row_min, row_max in model_row_stats])
+
+
+def seed_clusters(model_embeddings,
+                  model_row_stats,
+                  similarity_threshold,
+                  memory_budget_mb=512):
+    """Greedy seed-based clustering on the averaged similarity.
+
+    Queries are visited in order; every query not yet assigned seeds a
+    cluster of itself and all queries whose similarity from the seed reaches
+    the threshold, whether or not they already belong to an earlier cluster.
+    Only the rows of still-unassigned queries are scored, a block at a time,
+    so memory stays linear in the number of queries.
 
-    # Compute average query-query similarity across all models
-    logger.info(
-        f"Computing average query-query similarity across {len(valid_models)} models..."
-    )
-    avg_query_similarity = np.mean(all_query_similarities, axis=0)
+    Returns:
+        List of index arrays, one per cluster, seed first.
+    """
+    n_queries = model_embeddings[0][0].shape[0]
+    block = max(1, int(memory_budget_mb * 2**20 // (4 * n_queries)))
+    all_rows = np.arange(n_queries)
+    assigned = np.zeros(n_queries, dtype=bool)
+    clusters = []
+    for start in range(0, n_queries, block):
+        rows = np.flatnonzero(~assigned[start:start + block]) + start
+        if not len(rows):
+            continue
+        scores = average_similarity_dense(
+            *_subset(model_embeddings, model_row_stats, rows, all_rows),
+            memory_budget_mb=memory_budget_mb)
+        for i, row_scores in zip(rows.tolist(), scores):
+            if assigned[i]:
+                continue
+            similar = np.flatnonzero(row_scores >= similarity_threshold)
+            cluster = np.concatenate([[i], similar[similar != i]])
+            clusters.append(cluster)
+            assigned[cluster] = True
+    return clusters
+
+
+def seed_cluster_representatives(clusters,
+                                 model_embeddings,
+                                 model_row_stats,
+                                 memory_budget_mb=512):
+    """The member of every seed cluster with the highest summed similarity
+    to the rest of its cluster (the first one on ties)."""
+    representatives = []
+    for cluster in clusters:
+        if len(cluster) == 1:
+            representatives.append(int(cluster[0]))
+            continue
+        block = max(1, int(memory_budget_mb * 2**20 // (4 * len(cluster))))
+        sums = np.empty(len(cluster), dtype=np.float64)
+        for start in range(0, len(cluster), block):
+            rows = cluster[start:start + block]
+            scores = average_similarity_dense(
+                *_subset(model_embeddings, model_row_stats, rows, cluster),
+                memory_budget_mb=memory_budget_mb)
+            # Self-similarity does not count
+            scores[np.arange(len(rows)), np.arange(start,
+                                                   start + len(rows))] = 0
+            sums[start:start + len(rows)] = scores.sum(axis=1)
+        representatives.append(int(cluster[np.argmax(sums)]))
+    return representatives
 
-    # Set diagonal to 0 to avoid self-similarity
-    np.fill_diagonal(avg_query_similarity, 0)
 
-    # Cluster queries based on similarity threshold
-    logger.info(
-        f"Clustering queries with similarity threshold {similarity_threshold}..."
-    )
+def deduplicate_queries(directory_path,
+                        filtered_queries_path,
+                        output_path,
+                        similarity_threshold=0.95,
+                        clustering="seed"):
+    """
+    Deduplicate queries based on average similarity across models.
 
-    # Initialize clusters
-    clusters = []
-    assigned_indices = set()
+    Similarity is the row-wise min-max scaled score averaged across models.
+    With clustering="seed" (the default), every query not yet assigned
+    seeds a cluster with the queries similar to it, and each cluster keeps
+    the query with the highest average similarity to the rest of it.
 
-    # Iterate through all filtered query indices
-    for i in range(len(filtered_query_indices)):
-        if i in assigned_indices:
-            continue  # Skip if already assigned to a cluster
+    With clustering="components", clusters are the connected components of
+    the graph of pairs reaching the threshold; pairs are folded into a
+    union-find block by block, so no edge list is kept. Components chain
+    neighbours of neighbours and merge far more at the same threshold
+    (whole topics collapse at 0.6), so they call for a higher threshold.
+    The dedup graph tools (build_query_neighbor_graph,
+    sweep_dedup_thresholds, deduplicate_from_graph) use components.
 
-        # Find all queries similar to this one
-        similar_indices = np.where(
-            avg_query_similarity[i] >= similarity_threshold)[0]
+    Both modes keep memory linear in the number of queries.
 
-        if len(similar_indices) == 0:
-            # No similar queries, add as singleton cluster
-            clusters.append([i])
-            assigned_indices.add(i)
-        else:
-            # Create a new cluster with all similar queries
-            new_cluster = [i] + [idx for idx in similar_indices if idx != i]
-            clusters.append(new_cluster)
-            assigned_indices.update(new_cluster)
+    Args:
+        directory_path: Path to the main directory containing model subfolders
+        filtered_queries_path: Path to the JSON file containing filtered query IDs
+        output_path: Directory to save deduplicated_queries.json
+        similarity_threshold: Threshold for considering queries as similar (default: 0.95)
+        clustering: "seed" or "components"
 
-    # For each cluster, find the query with highest average similarity to other queries in the cluster
-    logger.info("Selecting representative queries from each cluster...")
-    representative_indices = []
+    Returns:
+        List of deduplicated query IDs
+    """
+    if clustering not in ("seed", "components"):
+        raise ValueError(f"Unknown clustering: {clustering}")
+    filtered_queries, model_embeddings, model_row_stats = load_filtered_query_embeddings(
+        directory_path, filtered_queries_path)
+    if not model_embeddings:
+        return []
 
-    for cluster in clusters:
-        if len(cluster) == 1:
-            # Singleton cluster, keep the only query
-            representative_indices.append(cluster[0])
-        else:
-            # For larger clusters, find the query with highest average similarity to others
-            cluster_similarity = avg_query_similarity[cluster, :][:, cluster]
-            avg_similarities = np.sum(cluster_similarity, axis=1) / (
-                len(cluster) - 1)  # Exclude self
-            best_query_idx = cluster[np.argmax(avg_similarities)]
-            representative_indices.append(best_query_idx)
+    logger.info(
+        f"Clustering queries ({clustering}) with average similarity >= "
+        f"{similarity_threshold} across {len(model_embeddings)} models...")
+    if clustering == "seed":
+        clusters = seed_clusters(model_embeddings, model_row_stats,
+                                 similarity_threshold)
+        # For each cluster, find the query with highest average similarity to other queries in the cluster
+        logger.info("Selecting representative queries from each cluster...")
+        representative_indices = seed_cluster_representatives(
+            clusters, model_embeddings, model_row_stats)
+    else:
+        # Fold each tile's pairs into the union-find before the next tile
+        union_find = UnionFind(len(filtered_queries))
+        n_pairs = 0
+        for rows, cols, _ in iter_average_similarity_pairs(
+                model_embeddings, model_row_stats, similarity_threshold):
+            union_find.union_edges(rows, cols)
+            n_pairs += len(rows)
+        logger.info(f"Clustered queries over {n_pairs} similar pairs")
+        labels = union_find.labels()
+
+        logger.info("Selecting representative queries from each cluster...")
+        representative_indices = select_representatives(
+            labels,
+            cluster_similarity_sums(labels, model_embeddings,
+                                    model_row_stats))
 
     # Map representative indices back to query IDs
     deduplicated_queries = [
@@ -452,7 +796,7 @@ def deduplicate_queries(directory_path,
 
     # Log clustering stats
     logger.info(f"Original query count: {len(filtered_queries)}")
-    logger.info(f"Clusters found: {len(clusters)}")
+    logger.info(f"Clusters found: {len(representative_indices)}")
     logger.info(f"Deduplicated query count: {len(deduplicated_queries)}")
     logger.info(
         f"Removed {len(filtered_queries) - len(deduplicated_queries)} duplicate queries"
@@ -467,6 +811,226 @@ def deduplicate_queries(directory_path,
     return deduplicated_queries
 
 
+def keep_top_neighbors(rows, cols, weights, max_neighbors):
+    """Keep the `max_neighbors` heaviest edges of every row of a sparse
+    edge list; returned edges are sorted by row, then decreasing weight."""
+    order = np.lexsort((-weights, rows))
+    rows, cols, weights = rows[order], cols[order], weights[order]
+    rank = np.arange(len(rows)) - np.searchsorted(rows, rows, side='left')
+    keep = rank < max_neighbors
+    return rows[keep], cols[keep], weights[keep]
+
+
+def build_query_neighbor_graph(directory_path,
+                               filtered_queries_path,
+                               output_path,
+                               min_threshold=0.5,
+                               max_neighbors=64):
+    """
+    Build the near-duplicate query graph once at the lowest threshold of
+    interest, so that any higher threshold can be evaluated without touching
+    the embeddings again. Clusters over the graph are connected components,
+    as in deduplicate_queries(clustering="components").
+
+    Low thresholds on min-max scaled scores can admit a large share of all
+    query pairs, so every query keeps at most its `max_neighbors` heaviest
+    edges and the graph stays linear in the number of queries. Clusters
+    from a capped graph can split where deduplicate_queries would merge
+    them; the number of capped queries is saved and reported.
+
+    Args:
+        directory_path: Path to the main directory containing model subfolders
+        filtered_queries_path: Path to the JSON file containing filtered query IDs
+        output_path: Directory to save dedup_graph.npz
+        min_threshold: Lowest similarity threshold that will be considered
+        max_neighbors: Maximum edges kept per query; None keeps every edge
+
+    Returns:
+        Path to the saved graph
+    """
+    filtered_queries, model_embeddings, model_row_stats = load_filtered_query_embeddings(
+        directory_path, filtered_queries_path)
+    if not model_embeddings:
+        return None
+
+    logger.info(
+        f"Finding query pairs with average similarity >= {min_threshold} "
+        f"across {len(model_embeddings)} models...")
+    n_queries = len(filtered_queries)
+    rows, cols = np.empty(0, np.int64), np.empty(0, np.int64)
+    weights = np.empty(0, np.float32)
+    capped = np.zeros(n_queries, dtype=bool)
+    pending = []
+
+    def flush():
+        # Merge pending tiles into the edge list, capping every query
+        nonlocal rows, cols, weights
+        rows, cols, weights = (np.concatenate([rows] + [p[0] for p in pending]),
+                               np.concatenate([cols] + [p[1] for p in pending]),
+                               np.concatenate([weights] +
+                                              [p[2] for p in pending]))
+        pending.clear()
+        if max_neighbors is not None:
+            capped[np.bincount(rows, minlength=n_queries) >
+                   max_neighbors] = True
+            rows, cols, weights = keep_top_neighbors(rows, cols, weights,
+                                                     max_neighbors)
+
+    n_pending = 0
+    for tile_pairs in iter_average_similarity_pairs(model_embeddings,
+                                                    model_row_stats,
+                                                    min_threshold):
+        pending.append(tile_pairs)
+        n_pending += len(tile_pairs[0])
+        if max_neighbors is not None and n_pending > n_queries * max_neighbors:
+            flush()
+            n_pending = 0
+    flush()
+
+    n_capped = int(capped.sum())
+    if n_capped:
+        logger.warning(
+            f"{n_capped} queries had more than {max_neighbors} neighbors at "
+            f"{min_threshold} and were capped; clusters at thresholds near "
+            f"{min_threshold} may split where deduplicate_queries merges them")
+
+    graph_file = os.path.join(output_path, 'dedup_graph.npz')
+    np.savez(graph_file,
+             query_ids=np.array(filtered_queries),
+             rows=rows.astype(np.int32),
+             cols=cols.astype(np.int32),
+             weights=weights,
+             min_threshold=np.float32(min_threshold),
+             n_capped=np.int64(n_capped))
+    logger.info(f"Saved graph with {len(rows)} edges to {graph_file}")
+    return graph_file
+
+
+def sweep_dedup_thresholds(graph_path, thresholds):
+    """
+    Report cluster and kept-query counts for several deduplication
+    thresholds by replaying a union-find over the graph's edges in order of
+    decreasing weight.
+
+    Args:
+        graph_path: Path to a graph saved by build_query_neighbor_graph
+        thresholds: Thresholds to evaluate, none below the graph's min_threshold
+
+    Returns:
+        List of dicts with threshold, clusters (with 2+ queries) and kept
+        query counts
+    """
+    graph = np.load(graph_path)
+    if min(thresholds) < graph['min_threshold']:
+        raise ValueError(
+            f"Graph was built at threshold {graph['min_threshold']}, "
+            f"cannot evaluate {min(thresholds)}")
+
+    _warn_if_capped(graph)
+    n_queries = len(graph['query_ids'])
+    order = np.argsort(-graph['weights'], kind='stable')
+    rows, cols = graph['rows'][order], graph['cols'][order]
+    weights = graph['weights'][order]
+
+    union_find = UnionFind(n_queries)
+    applied = 0
+    results = []
+    for threshold in sorted(thresholds, reverse=True):
+        # Edges are sorted by weight, so each threshold only adds a suffix
+        end = int(np.searchsorted(-weights, -threshold, side='right'))
+        union_find.union_edges(rows[applied:end], cols[applied:end])
+        applied = end
+
+        cluster_sizes = np.bincount(union_find.labels(), minlength=n_queries)
+        results.append({
+            'threshold': float(threshold),
+            'clusters': int((cluster_sizes > 1).sum()),
+            'kept': int(union_find.n_components),
+            'removed': int(n_queries - union_find.n_components),
+        })
+
+    results.sort(key=lambda row: row['threshold'])
+    print("\n=== DEDUPLICATION THRESHOLD SWEEP ===")
+    print(f"Total queries: {n_queries}")
+    for row in results:
+        print(
+            f"  threshold {row['threshold']:.3f}: {row['clusters']} clusters, "
+            f"{row['kept']} kept, {row['removed']} removed")
+    return results
+
+
+def _warn_if_capped(graph):
+    n_capped = int(graph['n_capped']) if 'n_capped' in graph else 0
+    if n_capped:
+        logger.warning(
+            f"Graph capped the neighbors of {n_capped} queries; clusters may "
+            f"split where deduplicate_queries would merge them")
+
+
+def deduplicate_from_graph(graph_path,
+                           output_path,
+                           similarity_threshold,
+                           directory_path=None):
+    """
+    Write the deduplication for one threshold from a precomputed graph.
+    Clusters are connected components, as in
+    deduplicate_queries(clustering="components").
+
+    With `directory_path`, representatives are chosen exactly as there by
+    rescoring every cluster from the embeddings. Without it, only the graph's edges are summed, so pairs below its
+    min_threshold (or dropped by its neighbor cap) count as zero similarity
+    and representatives can differ from deduplicate_queries.
+
+    Args:
+        graph_path: Path to a graph saved by build_query_neighbor_graph
+        output_path: Directory to save deduplicated_queries.json
+        similarity_threshold: Threshold, not below the graph's min_threshold
+        directory_path: Optional path to the main directory containing model
+            subfolders, for exact representative selection
+
+    Returns:
+        List of deduplicated query IDs
+    """
+    graph = np.load(graph_path)
+    if similarity_threshold < graph['min_threshold']:
+        raise ValueError(
+            f"Graph was built at threshold {graph['min_threshold']}, "
+            f"cannot deduplicate at {similarity_threshold}")
+    _warn_if_capped(graph)
+
+    query_ids = graph['query_ids']
+    rows, cols, weights = graph['rows'], graph['cols'], graph['weights']
+    keep = weights >= similarity_threshold
+    labels = connected_components(len(query_ids), rows[keep], cols[keep])
+
+    if directory_path is not None:
+        # Exact within-cluster similarity sums from the embeddings
+        _, model_embeddings, model_row_stats = load_query_embeddings(
+            directory_path, query_ids.tolist())
+        scores = cluster_similarity_sums(labels, model_embeddings,
+                                         model_row_stats)
+    else:
+        # Within-cluster similarity sums from every stored edge
+        logger.warning(
+            "Choosing representatives from graph edges only; pass "
+            "directory_path to match deduplicate_queries exactly")
+        same_cluster = labels[rows] == labels[cols]
+        scores = np.bincount(rows[same_cluster],
+                             weights=weights[same_cluster],
+                             minlength=len(query_ids))
+    representative_indices = select_representatives(labels, scores)
+    deduplicated_queries = query_ids[representative_indices].tolist()
+
+    logger.info(f"Original query count: {len(query_ids)}")
+    logger.info(f"Deduplicated query count: {len(deduplicated_queries)}")
+
+    output_file = os.path.join(output_path, "deduplicated_queries.json")
+    write_json(deduplicated_queries, output_file)
+    logger.info(f"Deduplicated queries saved to {output_file}")
+
+    return deduplicated_queries
+
+
 def balance_queries_by_document(directory_path,
                                 queries_per_doc_threshold=10,
                                 random_seed=2):
@@ -626,6 +1190,19 @@ def print_filtered_query_stats(directory_path,
 
 
 if __name__ == "__main__":
+    # quantization_report("data/final/pdf/arxiv/embeddings",
+    #                     "data/final/pdf/arxiv/qrels.json",
+    #                     "data/final/pdf/arxiv",
+    #                     n_retrieval_results=25,
+    #                     score_threshold=0.8)
+
+    # sweep_relevance_filters("data/final/pdf/arxiv/embeddings",
+    #                         "data/final/pdf/arxiv/qrels.json",
+    #                         "data/final/pdf/arxiv/queries.json",
+    #                         "data/final/pdf/arxiv",
+    #                         n_retrieval_values=(10, 25, 50),
+    #                         score_thresholds=(0.7, 0.8, 0.9))
+
     filter_by_intersection("data/final/pdf/arxiv/embeddings",
                            "data/final/pdf/arxiv/qrels.json",
                            "data/final/pdf/arxiv",
@@ -638,6 +1215,16 @@ if __name__ == "__main__":
                       n_retrieval_results=25,
                       score_threshold=0.9)
 
+    # The graph tools cluster by connected components, which merge far more
+    # than the seed clustering below at the same threshold
+    # build_query_neighbor_graph(
+    #     "data/final/pdf/arxiv/embeddings",
+    #     "data/final/pdf/arxiv/filtered_queries_intersection.json",
+    #     "data/final/pdf/arxiv",
+    #     min_threshold=0.5)
+    # sweep_dedup_thresholds("data/final/pdf/arxiv/dedup_graph.npz",
+    #                        [0.5, 0.6, 0.7, 0.8, 0.9, 0.95])
+
     deduplicate_queries(
         "data/final/pdf/arxiv/embeddings",
         "data/final/pdf/arxiv/filtered_queries_intersection.json",
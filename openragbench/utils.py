@@ -1,4 +1,6 @@
 import os
+import gc
+import sys
 import json
 import yaml
 
@@ -34,3 +36,11 @@ def read_config(config_name):
     config_path = os.path.join(project_root, 'configs', config_name)
     with open(config_path, 'r') as f:
         return yaml.safe_load(f)
+
+
+def clear_memory():
+    gc.collect()
+    # Only local encoders load torch; skip it if none has run
+    torch = sys.modules.get("torch")
+    if torch is not None and torch.cuda.is_available():
+        torch.cuda.empty_cache()
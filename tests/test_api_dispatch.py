@@ -0,0 +1,36 @@
+import asyncio
+
+import pytest
+
+from openragbench.models.api_dispatch import run_sync
+
+
+async def _double(x):
+    await asyncio.sleep(0)
+    return 2 * x
+
+
+async def _fail():
+    raise KeyError("boom")
+
+
+def test_run_sync_without_running_loop():
+    assert run_sync(_double(3)) == 6
+
+
+def test_run_sync_inside_running_loop():
+
+    async def caller():
+        # A synchronous encode call made from async code
+        return run_sync(_double(4))
+
+    assert asyncio.run(caller()) == 8
+
+
+def test_run_sync_propagates_errors_inside_running_loop():
+
+    async def caller():
+        return run_sync(_fail())
+
+    with pytest.raises(KeyError):
+        asyncio.run(caller())
@@ -0,0 +1,40 @@
+import asyncio
+import threading
+import time
+
+from openragbench.models.api_dispatch import dispatch_batches
+from openragbench.models.autotune import BatchSizeTuner
+
+
+def test_calibration_waits_for_and_blocks_shared_work(tmp_path):
+    tuner = BatchSizeTuner(cache_path=str(tmp_path / "sizes.json"),
+                           memory_budget_mb=1024,
+                           max_batch_size=4)
+    events = []
+
+    def probe(batch_size):
+        events.append(("probe", batch_size))
+        time.sleep(0.01)
+
+    tuner.gate.acquire_shared()
+    calibration = threading.Thread(
+        target=tuner.batch_size, args=("enc", "cpu", 64, probe))
+    calibration.start()
+    time.sleep(0.05)
+    # An in-flight request keeps the calibration from probing
+    assert events == []
+    events.append(("request", "done"))
+    tuner.gate.release_shared()
+
+    async def send(batch):
+        events.append(("request", batch[0]))
+        return batch
+
+    # Requests issued during calibration wait until it is finished
+    time.sleep(0.005)
+    asyncio.run(dispatch_batches([["late"]], send, gate=tuner.gate))
+    calibration.join()
+
+    assert events[0] == ("request", "done")
+    assert events[-1] == ("request", "late")
+    assert [kind for kind, _ in events[1:-1]] == ["probe"] * (len(events) - 2)
@@ -0,0 +1,83 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from openragbench.pipeline.post_filtering.filter_by_doc_relevance import \
+    deduplicate_queries
+
+# The threshold the pipeline's __main__ deduplicates at
+PIPELINE_THRESHOLD = 0.6
+
+
+def _write_dataset(path, n_queries=300, n_topics=30, seed=0):
+    rng = np.random.default_rng(seed)
+    topics = rng.standard_normal((n_topics, 32))
+    for model in ("model_a", "model_b"):
+        os.makedirs(path / model)
+        embeddings = (topics[rng.integers(0, n_topics, n_queries)] +
+                      0.8 * rng.standard_normal((n_queries, 32)))
+        np.save(path / model / "query_embeddings.npy",
+                embeddings.astype(np.float32))
+    query_ids = [f"q{i}" for i in range(n_queries)]
+    with open(path / "query_id_to_index.json", "w") as f:
+        json.dump({qid: i for i, qid in enumerate(query_ids)}, f)
+    with open(path / "filtered_queries.json", "w") as f:
+        json.dump(query_ids, f)
+    return query_ids
+
+
+def _reference_seed_dedup(path, query_ids, threshold):
+    # The original dense implementation: scaled scores averaged across
+    # models, greedy seed clusters, best summed similarity per cluster
+    matrices = []
+    for model in ("model_a", "model_b"):
+        embeddings = np.load(path / model / "query_embeddings.npy")
+        scores = embeddings @ embeddings.T
+        low = scores.min(axis=1, keepdims=True)
+        spread = scores.max(axis=1, keepdims=True) - low
+        matrices.append((scores - low) / np.where(spread == 0, 1, spread))
+    average = np.mean(matrices, axis=0)
+    np.fill_diagonal(average, 0)
+
+    clusters, assigned = [], set()
+    for i in range(len(query_ids)):
+        if i in assigned:
+            continue
+        similar = np.where(average[i] >= threshold)[0]
+        cluster = [i] + [j for j in similar if j != i]
+        clusters.append(cluster)
+        assigned.update(cluster)
+    return [
+        query_ids[cluster[np.argmax(average[cluster][:, cluster].sum(
+            axis=1))]] for cluster in clusters
+    ]
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_seed_clustering_matches_reference_at_pipeline_threshold(
+        tmp_path, seed):
+    query_ids = _write_dataset(tmp_path, seed=seed)
+
+    kept = deduplicate_queries(str(tmp_path),
+                               str(tmp_path / "filtered_queries.json"),
+                               str(tmp_path), PIPELINE_THRESHOLD)
+
+    assert kept == _reference_seed_dedup(tmp_path, query_ids,
+                                         PIPELINE_THRESHOLD)
+
+
+def test_components_merge_more_than_seeds_at_pipeline_threshold(tmp_path):
+    _write_dataset(tmp_path)
+    filtered = str(tmp_path / "filtered_queries.json")
+
+    seeds = deduplicate_queries(str(tmp_path), filtered, str(tmp_path),
+                                PIPELINE_THRESHOLD)
+    components = deduplicate_queries(str(tmp_path),
+                                     filtered,
+                                     str(tmp_path),
+                                     PIPELINE_THRESHOLD,
+                                     clustering="components")
+
+    assert len(components) < len(seeds)
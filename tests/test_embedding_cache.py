@@ -0,0 +1,48 @@
+import os
+
+import numpy as np
+
+from openragbench.models.embedding_cache import (VECTORS_DIR, EmbeddingCache,
+                                                 text_hash)
+
+
+def _fake_encode(texts):
+    return np.array([[len(text), text.count("a")] for text in texts],
+                    dtype=np.float32)
+
+
+def test_chunked_puts_share_one_shard(tmp_path):
+    cache = EmbeddingCache(str(tmp_path))
+    texts = [f"text {i} " + "a" * (i % 7) for i in range(100)]
+    for start in range(0, len(texts), 10):
+        cache.encode("enc/doc", texts[start:start + 10], _fake_encode)
+
+    # Buffered embeddings are already visible before they are written
+    found, embeddings = cache.lookup("enc/doc",
+                                     [text_hash(text) for text in texts])
+    assert found.all()
+    np.testing.assert_array_equal(embeddings, _fake_encode(texts))
+
+    cache.flush()
+    assert len(os.listdir(tmp_path / VECTORS_DIR)) == 1
+    reopened = EmbeddingCache(str(tmp_path))
+    np.testing.assert_array_equal(
+        reopened.encode("enc/doc", texts, lambda missing: 1 / 0),
+        _fake_encode(texts))
+
+
+def test_open_shard_mappings_are_bounded(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), shard_mb=0, max_open_shards=2)
+    texts = [f"text {i}" for i in range(5)]
+    for text in texts:
+        cache.encode("enc/doc", [text], _fake_encode)
+    assert len(os.listdir(tmp_path / VECTORS_DIR)) == 5
+
+    # Mixed hits from stored and buffered rows keep their order
+    cache.shard_mb = 1
+    cache.encode("enc/doc", ["new text"], _fake_encode)
+    mixed = texts + ["new text"]
+    np.testing.assert_array_equal(
+        cache.encode("enc/doc", mixed, lambda missing: 1 / 0),
+        _fake_encode(mixed))
+    assert len(cache._shards) == 2
@@ -0,0 +1,42 @@
+import os
+
+import numpy as np
+
+from openragbench.models.score_store import (GOLD_FILE, build_topk_store,
+                                             get_topk_store)
+
+
+def _write_embeddings(path, n_queries, n_sections, seed=0):
+    rng = np.random.default_rng(seed)
+    np.save(os.path.join(path, "query_embeddings.npy"),
+            rng.standard_normal((n_queries, 8)).astype(np.float32))
+    np.save(os.path.join(path, "section_embeddings.npy"),
+            rng.standard_normal((n_sections, 8)).astype(np.float32))
+
+
+def test_store_with_fewer_sections_than_k_is_current(tmp_path):
+    _write_embeddings(tmp_path, 4, 5)
+    store = get_topk_store(str(tmp_path), 10, device="numpy")
+
+    assert store.k == 5
+    assert store.is_current(str(tmp_path / "query_embeddings.npy"),
+                            str(tmp_path / "section_embeddings.npy"), 10)
+
+
+def test_rebuild_without_gold_drops_stale_gold(tmp_path):
+    _write_embeddings(tmp_path, 4, 20)
+    gold_rows = np.arange(4)
+    build_topk_store(str(tmp_path), 3, gold_rows, device="numpy")
+
+    _write_embeddings(tmp_path, 4, 20, seed=1)
+    store = build_topk_store(str(tmp_path), 3, device="numpy")
+    assert store.gold is None
+    assert not os.path.exists(tmp_path / GOLD_FILE)
+
+    # Requesting gold again recounts it on the new embeddings
+    store = get_topk_store(str(tmp_path), 3, gold_rows, device="numpy")
+    queries = np.load(tmp_path / "query_embeddings.npy")
+    sections = np.load(tmp_path / "section_embeddings.npy")
+    np.testing.assert_allclose(store.gold["score"],
+                               (queries * sections[gold_rows]).sum(axis=1),
+                               rtol=1e-5)
@@ -0,0 +1,28 @@
+import numpy as np
+import pytest
+
+from openragbench.models.scoring import topk_similarity
+
+
+def _embeddings(n, dim=16, seed=0):
+    return np.random.default_rng(seed).standard_normal(
+        (n, dim)).astype(np.float32)
+
+
+def test_topk_matches_dense_when_k_exceeds_sections():
+    queries, sections = _embeddings(30), _embeddings(5, seed=1)
+    dense = queries @ sections.T
+
+    result = topk_similarity(queries, sections, 10, device="numpy")
+
+    assert result.ids.shape == (30, 5)
+    np.testing.assert_array_equal(result.ids, np.argsort(-dense, axis=1))
+    np.testing.assert_allclose(result.scores, -np.sort(-dense, axis=1),
+                               rtol=1e-5)
+    np.testing.assert_allclose(result.row_min, dense.min(axis=1), rtol=1e-5)
+    np.testing.assert_allclose(result.row_max, dense.max(axis=1), rtol=1e-5)
+
+
+def test_topk_rejects_non_positive_k():
+    with pytest.raises(ValueError):
+        topk_similarity(_embeddings(3), _embeddings(4), 0, device="numpy")